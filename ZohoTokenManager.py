@@ -1,50 +1,181 @@
 import requests
 import logging
+import threading
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; the cache then works without locking.
+    fcntl = None
+
+import http_client
+from config import (
+    ZOHO_ACCOUNTS_URL, ZOHO_TOKEN_CACHE_PATH, ZOHO_TOKEN_REFRESH_AHEAD_SECONDS,
+    ZOHO_TOKEN_BACKGROUND_REFRESH
+)
+
+# A token is not handed out when it has less than this left to live.
+TOKEN_SAFETY_SECONDS = 60
+# Wait before retrying a failed background refresh.
+REFRESH_RETRY_SECONDS = 30
+
+
 class ZohoTokenManager:
-    def __init__(self, zoho_console_account):
+    """
+    Hands out Zoho OAuth access tokens to any number of threads.
+
+    Tokens are shared across processes through a JSON cache file guarded by
+    an exclusive file lock, so a new run, `add_contact.py <batch_id>` or a
+    parallel worker reuses a live token instead of calling the token
+    endpoint again. A daemon thread refreshes the token `refresh_ahead`
+    seconds before it expires, so callers of get_token() do not wait on
+    OAuth in the normal case.
+    """
+
+    def __init__(self, zoho_console_account, cache_path=ZOHO_TOKEN_CACHE_PATH,
+                 refresh_ahead_seconds=ZOHO_TOKEN_REFRESH_AHEAD_SECONDS,
+                 background_refresh=ZOHO_TOKEN_BACKGROUND_REFRESH):
         self.token = ""
         self.refresh_token_url = ""
         self.token_validity = timedelta(milliseconds=3400000)
         self.token_generated_time = datetime.now()
+        self.expires_at = 0.0
+        self.cache_path = cache_path
+        self.refresh_ahead = refresh_ahead_seconds
+        self.background_refresh = background_refresh
+        self._cache_key = ""
+        # Submission workers share one manager; only one of them refreshes.
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
 
-        if (zoho_console_account.get("ZOHO_REFRESH_TOKEN") and 
-            zoho_console_account.get("ZOHO_CLIENT_ID") and 
+        if (zoho_console_account.get("ZOHO_REFRESH_TOKEN") and
+            zoho_console_account.get("ZOHO_CLIENT_ID") and
             zoho_console_account.get("ZOHO_CLIENT_SECRET")):
             self.refresh_token_url = (
-                f"https://accounts.zoho.com/oauth/v2/token"
+                f"{ZOHO_ACCOUNTS_URL}/oauth/v2/token"
                 f"?refresh_token={zoho_console_account['ZOHO_REFRESH_TOKEN']}"
                 f"&client_id={zoho_console_account['ZOHO_CLIENT_ID']}"
                 f"&client_secret={zoho_console_account['ZOHO_CLIENT_SECRET']}"
                 f"&grant_type=refresh_token"
             )
+            # Cache entries are keyed per account without storing any secret.
+            self._cache_key = hashlib.sha256(self.refresh_token_url.encode("utf-8")).hexdigest()[:16]
         else:
             logging.error("ZOHO_REFRESH_TOKEN , ZOHO_CLIENT_ID , ZOHO_CLIENT_SECRET are mandatory")
 
+    def _is_usable(self, min_remaining=TOKEN_SAFETY_SECONDS):
+        return bool(self.token) and time.time() < self.expires_at - min_remaining
+
     def get_token(self):
-        current_timestamp = datetime.now()
-        difference_time = current_timestamp - self.token_generated_time
-        
-        if difference_time < self.token_validity and self.token:
-            print(self.token)
+        if self._is_usable():
             return self.token
-        else:
-            self.token = self.get_refreshed_token()
-            print(self.token)
+        with self._lock:
+            if not self._is_usable():
+                self._sync_token(TOKEN_SAFETY_SECONDS)
+            self._ensure_refresher()
             return self.token
 
-    def get_refreshed_token(self, retry=1):
+    def get_refreshed_token(self):
+        """Fetches a brand-new token from Zoho, bypassing the shared cache."""
+        token, expires_at = self._fetch_token()
+        return token
+
+    def stop(self):
+        """Stops the background refresher."""
+        self._stop.set()
+
+    # --- Shared cache ---
+    @contextmanager
+    def _cache_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.cache_path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, entries):
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        # The cache holds live access tokens, so keep it private.
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as cache_file:
+            json.dump(entries, cache_file)
+        os.replace(tmp_path, self.cache_path)
+
+    def _sync_token(self, min_remaining):
+        """
+        Adopts the cached token if it has more than `min_remaining` seconds
+        left, otherwise fetches a new one and publishes it. Runs under the
+        file lock so concurrent processes call the token endpoint only once.
+        Returns False if no token could be obtained.
+        """
         try:
-            if retry > 3:
-                return ""
+            with self._cache_lock():
+                entries = self._read_cache()
+                cached = entries.get(self._cache_key) or {}
+                if cached.get("access_token") and time.time() < cached.get("expires_at", 0) - min_remaining:
+                    self.token = cached["access_token"]
+                    self.expires_at = cached["expires_at"]
+                    return True
 
-            response = requests.post(self.refresh_token_url)
+                token, expires_at = self._fetch_token()
+                if not token:
+                    return False
+                self.token, self.expires_at = token, expires_at
+                entries[self._cache_key] = {"access_token": token, "expires_at": expires_at}
+                self._write_cache(entries)
+                return True
+        except OSError as error:
+            logging.error(f"Zoho token cache unavailable ({error}); fetching a token for this process only.")
+            token, expires_at = self._fetch_token()
+            if token:
+                self.token, self.expires_at = token, expires_at
+            return bool(token)
+
+    def _fetch_token(self):
+        # Transient failures are retried with backoff inside http_client.post.
+        try:
+            response = http_client.post(self.refresh_token_url)
             response.raise_for_status()
             data = response.json()
             token = data.get("access_token")
             self.token_generated_time = datetime.now()
-            return token
+            expires_in = data.get("expires_in") or self.token_validity.total_seconds()
+            return token or "", time.time() + float(expires_in)
         except requests.RequestException as error:
-            logging.error(f"Error fetching token: {error}")
-            return self.get_refreshed_token(retry + 1)
+            logging.error(f"Error fetching token: {http_client.redact(error)}")
+            return "", 0.0
+
+    # --- Background refresh ---
+    def _ensure_refresher(self):
+        if not self.background_refresh or self._refresher is not None or not self.token:
+            return
+        self._refresher = threading.Thread(target=self._refresh_loop, name="zoho-token-refresh", daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        wait_time = max(1.0, self.expires_at - self.refresh_ahead - time.time())
+        while not self._stop.wait(wait_time):
+            with self._lock:
+                if time.time() >= self.expires_at - self.refresh_ahead:
+                    if not self._sync_token(self.refresh_ahead):
+                        logging.error(f"Background Zoho token refresh failed; retrying in {REFRESH_RETRY_SECONDS}s.")
+                        wait_time = REFRESH_RETRY_SECONDS
+                        continue
+            wait_time = max(1.0, self.expires_at - self.refresh_ahead - time.time())
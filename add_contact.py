@@ -1,27 +1,45 @@
 # add_contact.py
 import os
 import sys
+import contextvars
 import json
+import logging
+import queue
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
 from datetime import date
+from collections import defaultdict, deque
+from typing import Optional, List
 
 # --- Refactored Imports ---
-from sqlalchemy import create_engine, text
-from conn import get_db_connection_string # Use the new connection logic
+from sqlalchemy import text
+from conn import get_engine # Use the shared connection pool
 
 # --- Existing Imports ---
-from log import log
+import http_client
+from log import log, record_log, batch_context
 from ZohoTokenManager import ZohoTokenManager
+from rate_limiter import ZohoThrottled, create_rate_limiter, parse_retry_after
+from rate_limiter import ZohoMARateLimiter  # noqa: F401 (re-exported for existing imports)
+from checkpoint import record_stage, STAGE_ZOHO_LOADED
+import dead_letter
+from dead_letter import (
+    DeadLetterRecorder, ERROR_TOKEN, ERROR_NETWORK, ERROR_SERVER, ERROR_CLIENT, ERROR_REJECTED,
+    ERROR_THROTTLED, ERROR_UNEXPECTED
+)
+from metrics import metrics
+import subscriber_cache
+from config import (
+    ZOHO_CAMPAIGNS_URL, ZOHO_CONCURRENCY,
+    ZOHO_CHECKPOINT_EVERY, ZOHO_THROTTLE_MAX_REQUEUES, SUBSCRIBER_CACHE
+)
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
 
-# --- Create a Single, Global Engine ---
-# This engine uses your conn.py logic and will be used for all DB operations.
-DB_URL = get_db_connection_string()
-ENGINE = create_engine(DB_URL)
-
 # --- Zoho Token Manager Setup (Unchanged) ---
 ZOHO_CLIENT_ID = os.getenv('ZOHO_CLIENT_ID')
 ZOHO_CLIENT_SECRET = os.getenv('ZOHO_CLIENT_SECRET')
@@ -38,157 +56,436 @@ zoho_config = {
 }
 zoho_token_manager = ZohoTokenManager(zoho_config)
 
-# --- Zoho API Configuration & Rate Limiter (Unchanged) ---
-ZOHO_API_BASE_URL = "https://campaigns.zoho.com/api/v1.1/json/listsubscribe"
-
-class ZohoMARateLimiter:
-    # This entire class is well-defined and remains unchanged.
-    def __init__(self, calls_per_duration, duration_seconds, lock_period_seconds):
-        self.calls_per_duration = calls_per_duration
-        self.duration_seconds = duration_seconds
-        self.lock_period_seconds = lock_period_seconds
-        self.tokens = calls_per_duration
-        self.last_refill_time = time.monotonic()
-        self.locked_until_time = 0
-        self.refill_rate = self.calls_per_duration / self.duration_seconds
-        log.info(f"Zoho Rate Limiter: {calls_per_duration} calls/{duration_seconds}s. Refill: {self.refill_rate:.2f} tokens/sec.")
-
-    def _refill_tokens(self):
-        now = time.monotonic()
-        time_elapsed = now - self.last_refill_time
-        tokens_to_add = time_elapsed * self.refill_rate
-        self.tokens = min(self.calls_per_duration, self.tokens + tokens_to_add)
-        self.last_refill_time = now
-
-    def acquire_token(self):
-        while True:
-            self._refill_tokens()
-            now = time.monotonic()
-            if now < self.locked_until_time:
-                wait_time = self.locked_until_time - now
-                log.warning(f"API locked. Waiting for {wait_time:.2f} seconds.")
-                time.sleep(wait_time)
-                continue
-            if self.tokens >= 1:
-                self.tokens -= 1
-                return True
-            time_to_next_token = (1 - self.tokens) / self.refill_rate
-            log.info(f"Rate limit hit, waiting {time_to_next_token:.2f} seconds.")
-            time.sleep(time_to_next_token + 0.01)
-
-    def trigger_lock(self):
-        self.locked_until_time = time.monotonic() + self.lock_period_seconds
-        log.error(f"Zoho API limit exceeded! Entering {self.lock_period_seconds}s lock.")
-        self.tokens = 0
-        self.last_refill_time = time.monotonic()
-
-zoho_ma_rate_limiter = ZohoMARateLimiter(500, 300, 1800)
+# --- Zoho API Configuration & Rate Limiter ---
+ZOHO_API_BASE_URL = f"{ZOHO_CAMPAIGNS_URL}/api/v1.1/json/listsubscribe"
+
+# Shared by every submission worker; ZOHO_RATE_LIMITER_BACKEND=postgres shares
+# it with other processes as well.
+zoho_ma_rate_limiter = create_rate_limiter()
 
 
 # The old execute_query and update_zoho_load_date functions are no longer needed.
 
-# --- REFACTORED `import_contacts` Function ---
-def import_contacts(batch_id: str):
+# Contact fields sent to Zoho, in the order build_lead_info unpacks them.
+CONTACT_COLUMNS = (
+    "customer_email", "customer_first_name", "customer_last_name",
+    "offer_code_url", "landing_page_offer_code", "campaign_start_date",
+    "manufacturer", "department", "campaign_duration",
+)
+# What an mpos UPDATE must RETURN for contacts_from_update.
+RETURNING_COLUMNS = ("id", "activity_zoho_campaign_load") + CONTACT_COLUMNS
+
+
+def contacts_from_update(rows) -> list:
     """
-    Fetches records, adds them to Zoho, and then performs a single bulk
-    update to the database for all successful contacts.
+    Turns rows RETURNed by an UPDATE (in RETURNING_COLUMNS order) into the
+    records import_contacts would have fetched for them: contacts with an
+    email that have not been loaded yet, one per offer code (lowest id wins).
     """
-    log.info(f"Starting contact import to Zoho for batch_id = {batch_id}")
+    by_code = {}
+    for row in sorted(rows, key=lambda r: r[0]):
+        _, loaded_at, *contact = row
+        email, offer_code = contact[0], contact[4]
+        if loaded_at is not None or not email or offer_code is None:
+            continue
+        by_code.setdefault(offer_code, tuple(contact))
+    return [by_code[code] for code in sorted(by_code)]
 
-    # Step 1: Fetch all records to be processed in a single query
-    sql = text("""
-        SELECT DISTINCT ON (landing_page_offer_code)
-               customer_email, customer_first_name, customer_last_name,
-               offer_code_url, landing_page_offer_code, campaign_start_date,
-               manufacturer, department, campaign_duration
-        FROM   mpos_post_sale_marketing
-        WHERE  batch_id = :batch_id
-          AND  customer_email IS NOT NULL AND customer_email <> ''
-        ORDER BY landing_page_offer_code, id;
-    """)
+
+def acquire_rate_limit_token() -> float:
+    """Takes a rate-limiter token, recording (and returning) how long the caller was held back."""
+    started = time.monotonic()
+    zoho_ma_rate_limiter.acquire_token()
+    waited = time.monotonic() - started
+    metrics.inc("rate_limit_wait_seconds", waited)
+    metrics.observe("rate_limit_wait_seconds", waited)
+    return waited
+
+
+def post_to_zoho(url: str, **kwargs) -> requests.Response:
+    """
+    http_client.post with the call's latency (retries included, rate-limit
+    waits excluded) recorded. A rate-limiter token is taken before every
+    attempt, so retries of a failed call are paid for like any other call.
+    """
+    waits = []
+    started = time.monotonic()
     try:
-        with ENGINE.connect() as conn:
-            records = conn.execute(sql, {"batch_id": str(batch_id)}).fetchall()
-        log.info(f"Found {len(records)} unique contacts to process for batch {batch_id}.")
-    except Exception as e:
-        log.error(f"Failed to fetch records for batch {batch_id}: {e}")
-        return
+        return http_client.post(url, before_attempt=lambda: waits.append(acquire_rate_limit_token()), **kwargs)
+    finally:
+        metrics.observe("zoho_api_latency_seconds", time.monotonic() - started - sum(waits))
+        metrics.inc("zoho_api_requests", len(waits))
 
-    if not records:
-        return
+def build_lead_info(row) -> dict:
+    """Builds the Zoho `leadinfo` payload for one fetched contact row."""
+    email, first_name, last_name, offer_code_url, offer_code, campaign_start_date, manufacturer, department, campaign_duration = row
+    return {
+        "First Name": str(first_name) if first_name else '',
+        "Last Name": str(last_name) if last_name else '',
+        "Lead Email": str(email).strip(),
+        "contract_page_url": str(offer_code_url),
+        "manufacturer": str(manufacturer) if manufacturer else '',
+        "department": str(department) if department else '',
+        "campaign_date": campaign_start_date.strftime("%m/%d/%Y") if campaign_start_date else '',
+        "Is Converted": False,
+        "emails_to_send": 2 if campaign_duration == 30 else 3 if campaign_duration == 60 else 4
+    }
 
-    # Step 2: Loop through records, call the API, and collect successes
-    successful_offer_codes = []
-    for row in records:
-        email, first_name, last_name, offer_code_url,offer_code, campaign_start_date, manufacturer, department, campaign_duration = row
-        # This API interaction logic is unchanged
-        lead_info = {
-            "First Name": str(first_name) if first_name else '',
-            "Last Name": str(last_name) if last_name else '',
-            "Lead Email": str(email).strip(),
-            "contract_page_url": str(offer_code_url),
-            "manufacturer": str(manufacturer) if manufacturer else '',
-            "department": str(department) if department else '',
-            "campaign_date": campaign_start_date.strftime("%m/%d/%Y") if campaign_start_date else '',
-            "Is Converted": False,
-            "emails_to_send": 2 if campaign_duration == 30 else 3 if campaign_duration == 60 else 4
-        }
-        try:
-            zoho_ma_rate_limiter.acquire_token()
-            access_token = zoho_token_manager.get_token()
-            if not access_token:
-                log.error(f"Failed to get Zoho token for '{email}'. Skipping.")
-                continue
-
-            headers = {"Authorization": f"Zoho-oauthtoken {access_token}"}
-            payload = {"resfmt": "JSON", "leadinfo": json.dumps(lead_info)}
-
-            response = requests.post(ZOHO_API_BASE_URL, headers=headers, data=payload)
-            response.raise_for_status()
-            zoho_response = response.json()
-
-            if zoho_response.get('status') == "success":
-                log.info(f"Successfully added '{email}' to Zoho (Offer: {offer_code}).")
-                # Collect the offer code instead of updating the DB immediately
-                successful_offer_codes.append(offer_code)
-            else:
-                log.error(f"Zoho API Error for '{email}': {zoho_response.get('message', 'Unknown')} (Offer: {offer_code})")
 
-        except requests.exceptions.HTTPError as err:
-            log.error(f"HTTP Error for '{email}': {err} - Response: {err.response.text}")
-            if err.response.status_code == 429: zoho_ma_rate_limiter.trigger_lock()
-        except Exception as err:
-            log.error(f"Unexpected error for '{email}': {err}")
+def http_error_class(err: requests.exceptions.HTTPError) -> str:
+    return ERROR_SERVER if err.response.status_code >= 500 else ERROR_CLIENT
+
 
-    # Step 3: Perform a single bulk UPDATE for all successful contacts
-    if successful_offer_codes:
-        log.info(f"Updating database for {len(successful_offer_codes)} successfully processed contacts...")
+def submit_contact(row, dead_letters: Optional[DeadLetterRecorder] = None) -> Optional[str]:
+    """
+    Sends a single contact to Zoho. Returns its offer code on success and
+    None on any failure; errors are logged per contact and never raised,
+    so one bad record cannot stop the rest of the batch. The one exception
+    is a 429, which raises ZohoThrottled so the caller can requeue it.
+    Failures are also added to `dead_letters`, if given.
+    """
+    email, offer_code = row[0], row[4]
+    lead_info = build_lead_info(row)
+    failure = None
+    try:
+        access_token = zoho_token_manager.get_token()
+        if not access_token:
+            record_log.record("zoho_failed", "Failed to get Zoho token for '{email}'. Skipping.",
+                              logging.ERROR, email=email, offer_code=offer_code)
+            failure = (ERROR_TOKEN, "no access token")
+            return None
+
+        headers = {"Authorization": f"Zoho-oauthtoken {access_token}"}
+        payload = {"resfmt": "JSON", "leadinfo": json.dumps(lead_info)}
+
+        response = post_to_zoho(ZOHO_API_BASE_URL, headers=headers, data=payload)
+        response.raise_for_status()
+        zoho_ma_rate_limiter.on_success(response)
+        zoho_response = response.json()
+
+        if zoho_response.get('status') == "success":
+            record_log.record("zoho_submit", "Successfully added '{email}' to Zoho (Offer: {offer_code}).",
+                              email=email, offer_code=offer_code, latency=response.elapsed.total_seconds())
+            return offer_code
+        record_log.record("zoho_failed", "Zoho API Error for '{email}': {reason} (Offer: {offer_code})",
+                          logging.ERROR, email=email, offer_code=offer_code,
+                          reason=zoho_response.get('message', 'Unknown'))
+        failure = (ERROR_REJECTED, zoho_response.get('message', 'Unknown'))
+
+    except requests.exceptions.HTTPError as err:
+        record_log.record("zoho_failed", "HTTP Error for '{email}': {err} - Response: {text}", logging.ERROR,
+                          email=email, offer_code=offer_code, err=err, text=err.response.text)
+        if err.response.status_code == 429:
+            metrics.inc("zoho_throttled")
+            zoho_ma_rate_limiter.on_throttle(parse_retry_after(err.response))
+            raise ZohoThrottled(email) from err
+        failure = (http_error_class(err), f"{err} - {err.response.text}")
+    except requests.exceptions.RequestException as err:
+        record_log.record("zoho_failed", "Network error for '{email}': {err}", logging.ERROR,
+                          email=email, offer_code=offer_code, err=err)
+        failure = (ERROR_NETWORK, err)
+    except Exception as err:
+        record_log.record("zoho_failed", "Unexpected error for '{email}': {err}", logging.ERROR,
+                          email=email, offer_code=offer_code, err=err)
+        failure = (ERROR_UNEXPECTED, err)
+    finally:
+        if failure and dead_letters is not None:
+            dead_letters.add(row, *failure)
+    return None
+
+
+def _submit_single(row, dead_letters: Optional[DeadLetterRecorder] = None) -> List[str]:
+    """Adapts submit_contact to the list-of-successes shape submit_work_items hands to on_result."""
+    offer_code = submit_contact(row, dead_letters)
+    return [offer_code] if offer_code else []
+
+
+class LoadDateRecorder:
+    """
+    Collects the offer codes Zoho accepted and writes
+    activity_zoho_campaign_load for them every `flush_every` successes, so
+    an interrupted run only loses the confirmations of its last partial
+    batch. Shared by all submission workers.
+    """
+
+    def __init__(self, flush_every: int = ZOHO_CHECKPOINT_EVERY):
+        self.flush_every = max(1, flush_every)
+        self.pending = []
+        self.accepted = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def add(self, offer_codes: List[str]):
+        with self._lock:
+            self.accepted += len(offer_codes)
+            self.pending.extend(offer_codes)
+            if len(self.pending) < self.flush_every:
+                return
+            to_write, self.pending = self.pending, []
+        self._write(to_write)
+
+    def flush(self):
+        with self._lock:
+            to_write, self.pending = self.pending, []
+        if to_write:
+            self._write(to_write)
+
+    def _write(self, offer_codes: List[str]):
         update_sql = text("""
             UPDATE mpos_post_sale_marketing
             SET activity_zoho_campaign_load = :load_date
             WHERE landing_page_offer_code = ANY(:offer_codes)
         """)
         try:
-            # .begin() ensures this bulk update is a single transaction
-            with ENGINE.begin() as conn:
-                conn.execute(update_sql, {
-                    "load_date": date.today(),
-                    "offer_codes": successful_offer_codes
-                })
-            log.info("Database update successful.")
+            with get_engine().begin() as conn:
+                conn.execute(update_sql, {"load_date": date.today(), "offer_codes": offer_codes})
+            with self._lock:
+                self.recorded += len(offer_codes)
+            log.info(f"Recorded Zoho load date for {len(offer_codes)} contacts ({self.recorded} so far).")
         except Exception as e:
-            log.error(f"Failed to perform bulk update on database: {e}")
+            log.error(f"Failed to record Zoho load date for {len(offer_codes)} contacts: {e}")
+            # Keep them for the next flush rather than losing the confirmations
+            with self._lock:
+                self.pending.extend(offer_codes)
+            return
+        # Only once the load dates are committed, and never at their expense
+        dead_letter.resolve(offer_codes)
+
+
+class BackgroundLoadDateRecorder(LoadDateRecorder):
+    """
+    LoadDateRecorder whose database writes happen on a dedicated writer
+    thread, so submission workers never wait on Postgres. Confirmations go
+    through a bounded queue (submitters block only if the writer falls far
+    behind) and are written every `flush_every` codes, or after
+    `idle_flush_seconds` without new ones. Call close() when done.
+    """
+
+    def __init__(self, flush_every: int = ZOHO_CHECKPOINT_EVERY, max_queued: int = 1000,
+                 idle_flush_seconds: float = 5.0):
+        super().__init__(flush_every)
+        self.idle_flush_seconds = idle_flush_seconds
+        self._queue = queue.Queue(maxsize=max_queued)
+        # Run in a copy of the caller's context, so its logs keep the batch_id
+        self._writer = threading.Thread(target=contextvars.copy_context().run, args=(self._run,),
+                                        name="zoho-load-date-writer", daemon=True)
+        self._writer.start()
+
+    def add(self, offer_codes: List[str]):
+        if offer_codes:
+            with self._lock:
+                self.accepted += len(offer_codes)
+            self._queue.put(list(offer_codes))
+
+    def close(self):
+        """Writes every queued confirmation and stops the writer thread."""
+        self._queue.put(None)
+        self._writer.join()
+        if self.pending:
+            log.error(f"{len(self.pending)} Zoho load dates could not be recorded; "
+                      f"rerun add_contact.py for this batch to record them.")
+
+    def _run(self):
+        closed = False
+        while not closed:
+            try:
+                item = self._queue.get(timeout=self.idle_flush_seconds)
+            except queue.Empty:
+                item = []
+            if item is None:
+                closed = True
+            else:
+                with self._lock:
+                    self.pending.extend(item)
+            with self._lock:
+                # Write on a full batch, when idle, and at close
+                due = self.pending and (closed or not item or len(self.pending) >= self.flush_every)
+                to_write, self.pending = (self.pending, []) if due else ([], self.pending)
+            if to_write:
+                self._write(to_write)
+
+
+def submit_work_items(work_items, submit, workers: int, on_result, on_give_up=None):
+    """
+    Runs `submit` over every work item on up to `workers` threads and hands
+    each result to `on_result`. Items whose submission was throttled are put
+    back at the end of the queue, up to ZOHO_THROTTLE_MAX_REQUEUES times,
+    instead of being dropped; after that they are passed to `on_give_up`.
+    """
+    pending = deque(work_items)
+    requeues = defaultdict(int)
+
+    def requeue(item):
+        metrics.inc("zoho_requeues")
+        requeues[id(item)] += 1
+        if requeues[id(item)] > ZOHO_THROTTLE_MAX_REQUEUES:
+            log.error(f"Giving up on a throttled submission after {ZOHO_THROTTLE_MAX_REQUEUES} requeues.")
+            if on_give_up is not None:
+                on_give_up(item)
+        else:
+            pending.append(item)
+
+    if workers <= 1:
+        while pending:
+            item = pending.popleft()
+            try:
+                on_result(submit(item))
+            except ZohoThrottled:
+                requeue(item)
+        return
+
+    log.info(f"Submitting contacts with {workers} concurrent workers.")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zoho") as executor:
+        in_flight = {}
+        while pending or in_flight:
+            # Keep a small backlog per worker rather than queueing every item up front
+            while pending and len(in_flight) < workers * 2:
+                item = pending.popleft()
+                # Each call runs in a copy of this context, so its logs keep the batch_id
+                in_flight[executor.submit(contextvars.copy_context().run, submit, item)] = item
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                try:
+                    on_result(future.result())
+                except ZohoThrottled:
+                    requeue(item)
+
+
+def fetch_contacts(batch_id: Optional[str], offer_codes: Optional[List[str]] = None) -> Optional[list]:
+    """
+    Fetches the batch's contacts that have not been loaded into Zoho yet, one
+    per offer code, optionally restricted to `offer_codes`. A batch_id of
+    None searches every batch. Returns None if the query fails.
+    """
+    batch_filter = "AND  batch_id = :batch_id" if batch_id is not None else ""
+    code_filter = "AND  landing_page_offer_code = ANY(:offer_codes)" if offer_codes is not None else ""
+    sql = text(f"""
+        SELECT DISTINCT ON (landing_page_offer_code)
+               {", ".join(CONTACT_COLUMNS)}
+        FROM   mpos_post_sale_marketing
+        WHERE  customer_email IS NOT NULL AND customer_email <> ''
+          AND  activity_zoho_campaign_load IS NULL
+          {batch_filter}
+          {code_filter}
+        ORDER BY landing_page_offer_code, id;
+    """)
+    params = {}
+    if batch_id is not None:
+        params["batch_id"] = str(batch_id)
+    if offer_codes is not None:
+        params["offer_codes"] = list(offer_codes)
+    try:
+        with get_engine().connect() as conn:
+            records = conn.execute(sql, params).fetchall()
+    except Exception as e:
+        log.error(f"Failed to fetch records for batch {batch_id}: {e}")
+        return None
+    return records
+
+
+# --- REFACTORED `import_contacts` Function ---
+def import_contacts(batch_id: str, concurrency: Optional[int] = None, offer_codes: Optional[List[str]] = None,
+                    records: Optional[list] = None, recorder: Optional[LoadDateRecorder] = None) -> int:
+    """
+    Fetches the batch's contacts that have not been loaded yet, adds them to
+    Zoho and records activity_zoho_campaign_load for the successful ones in
+    periodic batches (see LoadDateRecorder). Returns the number recorded.
+    Because loaded contacts are skipped, rerunning a batch only sends the
+    contacts that are still missing.
+
+    `concurrency` is the number of submission workers; it defaults to
+    ZOHO_CONCURRENCY and a value of 1 keeps the old sequential behaviour.
+    `offer_codes` restricts the import to those codes, which lets a streamed
+    run import each chunk as soon as it has been written. `records` (see
+    contacts_from_update) skips the fetch altogether: the pipeline hands
+    over what its UPDATE returned instead of scanning the table again.
+    With a caller-owned `recorder` (e.g. a BackgroundLoadDateRecorder shared
+    across chunks) the load dates are left for it to write, and the return
+    value is the number of contacts Zoho accepted.
+    """
+    with batch_context(batch_id):
+        return _import_contacts(batch_id, concurrency, offer_codes, records, recorder)
+
+
+def _import_contacts(batch_id: str, concurrency: Optional[int], offer_codes: Optional[List[str]],
+                     records: Optional[list], recorder: Optional[LoadDateRecorder]) -> int:
+    log.info(f"Starting contact import to Zoho for batch_id = {batch_id}")
+
+    # Step 1: Fetch the records to be processed, unless they were handed over
+    if records is None:
+        records = fetch_contacts(batch_id, offer_codes)
+        if records is None:
+            return 0
+    metrics.inc("contacts_fetched", len(records))
+    log.info(f"Found {len(records)} unique contacts to process for batch {batch_id}.")
+
+    if not records:
+        return 0
+
+    # Step 2: Submit the records to Zoho and collect successes. With more
+    # than one worker the calls overlap; the shared rate limiter still
+    # decides how fast they actually go out.
+    workers = concurrency or ZOHO_CONCURRENCY
+    owns_recorder = recorder is None
+    recorder = recorder or LoadDateRecorder()
+    accepted_before = recorder.accepted
+
+    # Contacts whose payload Zoho already has are recorded without a call
+    cache = subscriber_cache.get_cache() if SUBSCRIBER_CACHE else None
+    to_send = records
+    if cache is not None:
+        to_send, unchanged = cache.partition(records)
+        if unchanged:
+            recorder.add([row[4] for row in unchanged])
+            metrics.inc("subscriber_cache_skipped", len(unchanged))
+            metrics.inc("zoho_calls_saved", len(unchanged))
+            log.info(f"Subscriber cache: {len(unchanged)} contacts unchanged since their last upload; "
+                     f"{len(unchanged)} Zoho calls saved.")
+
+    dead_letters = DeadLetterRecorder(batch_id)
+
+    def give_up(row):
+        dead_letters.add(row, ERROR_THROTTLED, f"still throttled after {ZOHO_THROTTLE_MAX_REQUEUES} requeues")
+
+    rows_by_code = {row[4]: row for row in to_send} if cache is not None else {}
+
+    def on_result(offer_codes):
+        # Cached before the load date is queued, so a crash between the two
+        # (or before a checkpoint) is recovered by the cache on the rerun
+        if cache is not None and offer_codes:
+            cache.remember([rows_by_code[code] for code in offer_codes])
+        recorder.add(offer_codes)
+
+    submit_work_items(to_send, partial(_submit_single, dead_letters=dead_letters), workers, on_result, give_up)
+    dead_letters.flush()
+
+    # Step 3: Flush the remaining confirmations, unless the caller owns the recorder
+    if owns_recorder:
+        recorder.flush()
+        loaded = recorder.recorded
     else:
+        loaded = recorder.accepted - accepted_before
+    metrics.inc("contacts_loaded", loaded)
+    metrics.inc("contacts_failed", len(records) - loaded)
+    if loaded == 0:
         log.warning("No contacts were successfully processed to update in the database.")
 
-    log.info(f"Finished contact import for batch_id = {batch_id}.")
+    record_log.flush()
+    log.info(f"Finished contact import for batch_id = {batch_id}: "
+             f"{loaded}/{len(records)} contacts loaded.")
+    return loaded
+
 # --- Main Entry Point (Unchanged) ---
 def main(batch_id: str):
     """Main function to initiate adding contacts."""
     if not batch_id:
         log.error("No batch_id provided. Exiting.")
         return
-    import_contacts(batch_id)
+    with metrics.timer(STAGE_ZOHO_LOADED):
+        loaded = import_contacts(batch_id)
+    record_stage(batch_id, STAGE_ZOHO_LOADED, detail={"loaded": loaded, "source": "add_contact"})
+    metrics.write_report(batch_id, {"mode": "add_contact"})
 
 if __name__ == '__main__':
     # Default batch_id for testing purposes
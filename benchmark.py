@@ -0,0 +1,306 @@
+# benchmark.py
+"""
+Offline benchmark for the pipeline: synthetic mpos_post_sale_marketing rows
+in a local Postgres plus zoho_stub.py in place of the Zoho APIs.
+
+Usage:
+    # 1. Point the dev config at a local database (PG_DEV_*) and seed it
+    use_env=dev python benchmark.py seed --rows 100000 --replace
+
+    # 2. Run the batch against the stub and append its timings as JSON
+    use_env=dev python benchmark.py run --zoho-latency-ms 80 --zoho-throttle-rate 0.001 \
+        --zoho-rate-limit-calls 1000000 --zoho-rate-limit-period-seconds 1
+
+`run` processes the benchmark rows exactly as main.py would, through
+run_batch, so the execution mode is picked the same way: --chunk-size and
+--partition-by as on main.py, and MPOS_PIPELINE, OFFER_CODE_INDEX and
+OFFER_CODE_MODE from the environment (OFFER_CODE_MODE=pool needs a filled
+pool first: python offer_code_pool.py fill).
+
+The Zoho stage is still paced by ZOHO_RATE_LIMIT_* (500 calls per 300s by
+default), which makes 10k contacts take well over an hour against the
+stub. Lift it with --zoho-rate-limit-calls/--zoho-rate-limit-period-seconds
+unless the limiter itself is what is being measured.
+
+Each `run` appends one JSON object per line to --output, so runs can be
+compared with any JSON tooling.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+import numpy as np
+import pandas as pd
+
+from log import log
+
+BENCH_INBOUND_BATCH_ID = "bench"
+BRANDSMART_DEALER_ID = "5779155000141100449"
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+# Columns the pipeline reads or writes; enough to run every stage locally.
+BENCH_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS mpos_post_sale_marketing (
+        id                           BIGSERIAL PRIMARY KEY,
+        inbound_batch_id             TEXT,
+        needs_python_proccess        TEXT DEFAULT '1',
+        dealer_id                    TEXT,
+        invoice_number               TEXT,
+        landing_page_offer_code      TEXT,
+        offer_code_url               TEXT,
+        batch_id                     TEXT,
+        activity_plan_purchased_date DATE,
+        activity_zoho_campaign_load  DATE,
+        customer_email               TEXT,
+        customer_first_name          TEXT,
+        customer_last_name           TEXT,
+        campaign_start_date          DATE,
+        manufacturer                 TEXT,
+        department                   TEXT,
+        campaign_duration            INTEGER
+    )
+"""
+
+SEED_COLUMNS = [
+    "inbound_batch_id", "needs_python_proccess", "dealer_id", "invoice_number",
+    "customer_email", "customer_first_name", "customer_last_name", "campaign_start_date",
+    "manufacturer", "department", "campaign_duration",
+]
+
+MANUFACTURERS = ["Samsung", "LG", "Whirlpool", "Sony", "GE", "Frigidaire", "Bosch", "Apple"]
+DEPARTMENTS = ["Appliances", "Electronics", "Furniture", "Mattresses", "Computers"]
+
+
+def check_local_database(allow_remote: bool):
+    """Refuses to seed or benchmark anything but a local database unless told otherwise."""
+    import config
+    db_config = config.PG_DEV_DB_CONFIG if config.use_env == "dev" else config.PG_PROD_DB_CONFIG
+    if db_config["host"] not in LOCAL_HOSTS and not allow_remote:
+        log.error(f"Refusing to benchmark against non-local host '{db_config['host']}'. "
+                  f"Use a local database (use_env=dev, PG_DEV_HOST=localhost) or pass --allow-remote.")
+        sys.exit(1)
+
+
+def synthetic_rows(rows: int, dealers: int, dealer_skew: float, repeat_customer_rate: float,
+                   inbound_batch_id: str, seed: int) -> pd.DataFrame:
+    """
+    Builds `rows` purchase lines. Invoices have a geometric number of lines
+    (mean ~2), dealers follow a Zipf-like distribution with the BrandsMart
+    dealer as the largest, and `repeat_customer_rate` of invoices reuse an
+    email from an earlier invoice.
+    """
+    rng = np.random.default_rng(seed)
+    lines = rng.geometric(0.5, size=rows)
+    lines = lines[:np.searchsorted(np.cumsum(lines), rows) + 1]
+    lines[-1] -= lines.sum() - rows
+    invoices = len(lines)
+
+    dealer_ids = np.array([BRANDSMART_DEALER_ID] + [str(9000000000 + i) for i in range(1, dealers)])
+    weights = 1.0 / np.arange(1, dealers + 1) ** dealer_skew
+    invoice_dealers = rng.choice(dealer_ids, size=invoices, p=weights / weights.sum())
+
+    customers = max(1, int(invoices * (1 - repeat_customer_rate)))
+    invoice_customers = rng.integers(0, customers, size=invoices)
+
+    frame = pd.DataFrame({
+        "invoice_number": np.char.add(f"{inbound_batch_id}-", np.arange(invoices).astype(str)),
+        "dealer_id": invoice_dealers,
+        "customer": invoice_customers,
+        "campaign_duration": rng.choice([30, 60, 90], size=invoices),
+        "manufacturer": rng.choice(MANUFACTURERS, size=invoices),
+        "department": rng.choice(DEPARTMENTS, size=invoices),
+    }).loc[lambda df: df.index.repeat(lines)].reset_index(drop=True)
+
+    frame["customer_email"] = "customer" + frame["customer"].astype(str) + "@example.com"
+    frame["customer_first_name"] = "First" + frame["customer"].astype(str)
+    frame["customer_last_name"] = "Last" + frame["customer"].astype(str)
+    frame["campaign_start_date"] = date.today()
+    frame["inbound_batch_id"] = inbound_batch_id
+    frame["needs_python_proccess"] = "1"
+    return frame[SEED_COLUMNS]
+
+
+def seed(args):
+    from sqlalchemy import text
+    from conn import get_engine, copy_dataframe
+
+    check_local_database(args.allow_remote)
+    with get_engine().begin() as conn:
+        conn.execute(text(BENCH_SCHEMA_SQL))
+        if args.replace:
+            deleted = conn.execute(
+                text("DELETE FROM mpos_post_sale_marketing WHERE inbound_batch_id = :inbound"),
+                {"inbound": args.inbound_batch_id}
+            ).rowcount
+            log.info(f"Removed {deleted} previous benchmark rows.")
+
+    started = time.monotonic()
+    frame = synthetic_rows(args.rows, args.dealers, args.dealer_skew, args.repeat_customer_rate,
+                           args.inbound_batch_id, args.seed)
+    for start in range(0, len(frame), args.copy_batch_rows):
+        with get_engine().begin() as conn:
+            copy_dataframe(conn, frame.iloc[start:start + args.copy_batch_rows],
+                           "mpos_post_sale_marketing", SEED_COLUMNS)
+    with get_engine().begin() as conn:
+        conn.execute(text("ANALYZE mpos_post_sale_marketing"))
+    log.info(f"Seeded {len(frame)} rows ({frame['invoice_number'].nunique()} invoices) "
+             f"in {time.monotonic() - started:.1f}s.")
+
+
+def run(args):
+    # The stub must be running, and the Zoho settings in place, before the
+    # pipeline modules are imported: config reads them at import time.
+    from zoho_stub import StubState, start_stub
+    stub_state = StubState(reject_rate=args.zoho_reject_rate, latency_ms=args.zoho_latency_ms,
+                           error_rate=args.zoho_error_rate, throttle_rate=args.zoho_throttle_rate,
+                           retry_after=args.zoho_retry_after)
+    server = start_stub(port=0, state=stub_state)
+    stub_url = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["ZOHO_CAMPAIGNS_URL"] = stub_url
+    os.environ["ZOHO_ACCOUNTS_URL"] = stub_url
+    os.environ["ZOHO_TOKEN_CACHE_PATH"] = os.path.join(tempfile.gettempdir(), "zoho_token_cache.bench.json")
+    for name in ("ZOHO_CLIENT_ID", "ZOHO_CLIENT_SECRET", "ZOHO_REFRESH_TOKEN"):
+        os.environ.setdefault(name, "bench")
+    if args.zoho_rate_limit_calls is not None:
+        os.environ["ZOHO_RATE_LIMIT_CALLS"] = str(args.zoho_rate_limit_calls)
+    if args.zoho_rate_limit_period_seconds is not None:
+        os.environ["ZOHO_RATE_LIMIT_PERIOD_SECONDS"] = str(args.zoho_rate_limit_period_seconds)
+    check_local_database(args.allow_remote)
+
+    from sqlalchemy import text
+    import config
+    if config.ZOHO_CAMPAIGNS_URL != stub_url or config.ZOHO_ACCOUNTS_URL != stub_url:
+        # config was imported before the stub settings were in place
+        log.error("Zoho URLs do not point at the stub; refusing to send benchmark contacts.")
+        sys.exit(1)
+    from conn import get_engine
+    from main import process_mpos_data
+    from metrics import metrics
+
+    with get_engine().begin() as conn:
+        if args.reset:
+            conn.execute(text("""
+                UPDATE mpos_post_sale_marketing
+                SET needs_python_proccess = '1', landing_page_offer_code = NULL, offer_code_url = NULL,
+                    batch_id = NULL, activity_zoho_campaign_load = NULL
+                WHERE inbound_batch_id = :inbound
+            """), {"inbound": args.inbound_batch_id})
+        pending = conn.execute(text("""
+            SELECT COUNT(*) FROM mpos_post_sale_marketing
+            WHERE needs_python_proccess = '1' AND inbound_batch_id = :inbound
+        """), {"inbound": args.inbound_batch_id}).scalar_one()
+    if pending == 0:
+        log.error("No pending benchmark rows. Seed first, or pass --reset to rerun on the same rows.")
+        sys.exit(1)
+
+    # The whole run as main.py does it, index load included
+    started = time.monotonic()
+    completed = process_mpos_data(chunk_size=args.chunk_size, partition_by=args.partition_by,
+                                  inbound_batch_ids=[args.inbound_batch_id])
+    total_seconds = time.monotonic() - started
+    server.shutdown()
+    if not completed:
+        log.error("The benchmark batch failed; see the errors above.")
+        sys.exit(1)
+
+    batch_id = completed[0]
+    report = metrics.report(batch_id)
+    counters = report["counters"]
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "label": args.label,
+        "host": platform.node(),
+        "batch_id": str(batch_id),
+        "rows": pending,
+        "invoices": counters.get("invoices_coded", 0),
+        "zoho_loaded": counters.get("contacts_loaded", 0),
+        "stages_seconds": {stage: entry["seconds"] for stage, entry in report["stages"].items()},
+        "total_seconds": round(total_seconds, 4),
+        "peak_rss_mb": peak_rss_mb(),
+        "counters": counters,
+        "histograms": report["histograms"],
+        "zoho_stub": dict(stub_state.counters),
+        "settings": {
+            "chunk_size": config.MPOS_CHUNK_SIZE if args.chunk_size is None else args.chunk_size,
+            "partition_by": config.MPOS_PARTITION_BY if args.partition_by is None else args.partition_by,
+            "pipeline": config.MPOS_PIPELINE,
+            "offer_code_mode": config.OFFER_CODE_MODE,
+            "offer_code_index": config.OFFER_CODE_INDEX,
+            "zoho_latency_ms": args.zoho_latency_ms,
+            "zoho_error_rate": args.zoho_error_rate,
+            "zoho_throttle_rate": args.zoho_throttle_rate,
+            "zoho_reject_rate": args.zoho_reject_rate,
+            "zoho_concurrency": config.ZOHO_CONCURRENCY,
+            "zoho_rate_mode": config.ZOHO_RATE_MODE,
+            "rate_limit_calls": config.ZOHO_RATE_LIMIT_CALLS,
+            "rate_limit_period_seconds": config.ZOHO_RATE_LIMIT_PERIOD_SECONDS,
+        },
+    }
+    with open(args.output, "a") as output:
+        output.write(json.dumps(result) + "\n")
+    log.info(f"Benchmark result: {json.dumps(result['stages_seconds'])} -> {args.output}")
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process so far, or None where unsupported."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the MPOS pipeline.")
+    parser.add_argument("--allow-remote", action="store_true",
+                        help="Allow a database host other than localhost.")
+    parser.add_argument("--inbound-batch-id", default=BENCH_INBOUND_BATCH_ID,
+                        help="inbound_batch_id used to tag the synthetic rows.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="Insert synthetic mpos_post_sale_marketing rows.")
+    seed_parser.add_argument("--rows", type=int, default=10000)
+    seed_parser.add_argument("--dealers", type=int, default=25)
+    seed_parser.add_argument("--dealer-skew", type=float, default=1.2,
+                             help="Zipf exponent of the dealer distribution.")
+    seed_parser.add_argument("--repeat-customer-rate", type=float, default=0.3)
+    seed_parser.add_argument("--seed", type=int, default=42)
+    seed_parser.add_argument("--copy-batch-rows", type=int, default=200000)
+    seed_parser.add_argument("--replace", action="store_true", help="Delete earlier rows with the same inbound id.")
+    seed_parser.set_defaults(func=seed)
+
+    run_parser = commands.add_parser("run", help="Run the benchmark batch against the Zoho stub and time it.")
+    run_parser.add_argument("--label", default="", help="Free-text label stored with the result.")
+    run_parser.add_argument("--output", default="benchmark_results.jsonl")
+    run_parser.add_argument("--reset", action="store_true", help="Mark the benchmark rows as pending again first.")
+    run_parser.add_argument("--chunk-size", type=int,
+                            help="Rows per chunk (default MPOS_CHUNK_SIZE; 0 = whole batch).")
+    run_parser.add_argument("--partition-by", help="Process partitions in parallel (default MPOS_PARTITION_BY).")
+    run_parser.add_argument("--zoho-rate-limit-calls", type=int,
+                            help="Override ZOHO_RATE_LIMIT_CALLS; raise it to take the limiter out of the run.")
+    run_parser.add_argument("--zoho-rate-limit-period-seconds", type=int,
+                            help="Override ZOHO_RATE_LIMIT_PERIOD_SECONDS.")
+    run_parser.add_argument("--zoho-latency-ms", type=float, default=50.0)
+    run_parser.add_argument("--zoho-error-rate", type=float, default=0.0)
+    run_parser.add_argument("--zoho-throttle-rate", type=float, default=0.0)
+    run_parser.add_argument("--zoho-retry-after", type=int, default=0)
+    run_parser.add_argument("--zoho-reject-rate", type=float, default=0.0)
+    run_parser.set_defaults(func=run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
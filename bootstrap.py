@@ -0,0 +1,216 @@
+# bootstrap.py
+"""
+Prepares a database for the pipeline and checks that its hot queries are
+index-backed.
+
+    python bootstrap.py               # create missing tables/indexes, then EXPLAIN
+    python bootstrap.py --check-only  # EXPLAIN only, change nothing
+
+Indexes are built with CREATE INDEX CONCURRENTLY, so running this against a
+live database does not block writers. An index left INVALID by an earlier,
+interrupted build is dropped and rebuilt.
+"""
+import argparse
+import json
+
+from sqlalchemy import text
+
+from checkpoint import ensure_progress_table
+from conn import get_engine
+from dead_letter import ensure_dead_letter_table
+from log import log
+from offer_code_db import ensure_offer_code_schema
+from offer_code_pool import ensure_pool_table, POOL_TABLE
+from rate_limiter import ensure_bucket_table
+
+MAIN_TABLE = "mpos_post_sale_marketing"
+# main.update_data's staging table; check_query_plans fills a sample of it.
+STAGING_TABLE = "temp_update_mpos_remove"
+STAGING_SAMPLE_ROWS = 10000
+
+# Relations whose sequential scans check_query_plans warns about
+WATCHED_TABLES = (MAIN_TABLE, POOL_TABLE)
+# Sample keyset position and page size for the chunked page queries
+SAMPLE_PAGE = {"invoice": "0", "page_size": 5000}
+
+# name -> (columns, partial-index predicate)
+RECOMMENDED_INDEXES = {
+    # Fetch of pending rows, and their keyset pages in invoice order
+    # (main.iter_invoice_chunks), with and without --inbound-batch-id
+    "mpos_psm_pending_inbound_invoice_idx": ("inbound_batch_id, invoice_number", "needs_python_proccess = '1'"),
+    "mpos_psm_pending_invoice_idx": ("invoice_number", "needs_python_proccess = '1'"),
+    # Staging UPDATE join
+    "mpos_psm_invoice_dealer_idx": ("invoice_number, dealer_id", None),
+    # Zoho import and resume filters
+    "mpos_psm_batch_id_idx": ("batch_id", None),
+    # Collision checks and the load-date UPDATE
+    "mpos_psm_offer_code_idx": ("landing_page_offer_code", None),
+}
+# Replaced by a RECOMMENDED_INDEXES entry; dropped when found.
+SUPERSEDED_INDEXES = (
+    # A prefix of mpos_psm_pending_inbound_invoice_idx
+    "mpos_psm_pending_inbound_idx",
+)
+
+# The pending-row query as main.build_pending_query writes it for one inbound batch
+PENDING_QUERY = (
+    f"SELECT id, landing_page_offer_code, dealer_id, invoice_number FROM {MAIN_TABLE} "
+    "WHERE needs_python_proccess = '1' AND inbound_batch_id = :inbound_batch_id"
+)
+
+# name -> (statement, sample parameters). EXPLAIN without ANALYZE never
+# executes the statement, so the UPDATE is safe to check.
+PIPELINE_QUERIES = {
+    "fetch_pending": (PENDING_QUERY, {"inbound_batch_id": "0"}),
+    "chunk_page": (
+        f"SELECT * FROM ({PENDING_QUERY}) AS pending "
+        "WHERE invoice_number IS NOT NULL AND invoice_number >= :invoice "
+        "ORDER BY invoice_number LIMIT :page_size",
+        dict(SAMPLE_PAGE, inbound_batch_id="0"),
+    ),
+    "chunk_page_all_pending": (
+        f"SELECT * FROM (SELECT id, landing_page_offer_code, dealer_id, invoice_number FROM {MAIN_TABLE} "
+        "WHERE needs_python_proccess = '1') AS pending "
+        "WHERE invoice_number IS NOT NULL AND invoice_number >= :invoice "
+        "ORDER BY invoice_number LIMIT :page_size",
+        SAMPLE_PAGE,
+    ),
+    "partition_plan": (
+        "SELECT m.dealer_id::text AS partition_value, COUNT(DISTINCT p.invoice_number) AS invoices "
+        f"FROM ({PENDING_QUERY}) AS p JOIN {MAIN_TABLE} AS m ON m.id = p.id GROUP BY 1",
+        {"inbound_batch_id": "0"},
+    ),
+    "pool_claim": (
+        f"SELECT code FROM {POOL_TABLE} WHERE claimed_at IS NULL LIMIT :needed FOR UPDATE SKIP LOCKED",
+        {"needed": 5000},
+    ),
+    "update_join": (
+        f"UPDATE {MAIN_TABLE} AS main SET "
+        "landing_page_offer_code = temp.landing_page_offer_code, batch_id = temp.batch_id, "
+        "offer_code_url = temp.offer_code_url, needs_python_proccess = temp.needs_python_proccess, "
+        "activity_zoho_campaign_load = NULL "
+        f"FROM {STAGING_TABLE} AS temp "
+        "WHERE main.invoice_number = temp.invoice_number AND main.dealer_id = temp.dealer_id",
+        {},
+    ),
+    "import_contacts": (
+        f"SELECT DISTINCT ON (landing_page_offer_code) customer_email, landing_page_offer_code FROM {MAIN_TABLE} "
+        "WHERE batch_id = :batch_id AND activity_zoho_campaign_load IS NULL "
+        "ORDER BY landing_page_offer_code, id",
+        {"batch_id": "0"},
+    ),
+    "check_offercode_db": (
+        f"SELECT landing_page_offer_code FROM {MAIN_TABLE} WHERE landing_page_offer_code = ANY(:codes)",
+        {"codes": ["AAAAA2"]},
+    ),
+    "load_date_update": (
+        f"UPDATE {MAIN_TABLE} SET activity_zoho_campaign_load = now() "
+        "WHERE landing_page_offer_code = ANY(:offer_codes)",
+        {"offer_codes": ["AAAAA2"]},
+    ),
+}
+
+
+def ensure_tables():
+    """
+    Creates the pipeline's own tables: progress, offer code registry and
+    pool, the shared rate-limit bucket and the Zoho dead-letter store.
+    """
+    ensure_progress_table()
+    ensure_offer_code_schema()
+    ensure_pool_table()
+    ensure_bucket_table()
+    ensure_dead_letter_table()
+    log.info("Pipeline tables are in place.")
+
+
+def ensure_indexes():
+    """
+    Creates every RECOMMENDED_INDEXES entry that is missing or invalid, then
+    drops the SUPERSEDED_INDEXES.
+    """
+    # CONCURRENTLY cannot run inside a transaction block.
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, (columns, predicate) in RECOMMENDED_INDEXES.items():
+            valid = conn.execute(text("""
+                SELECT i.indisvalid FROM pg_index AS i
+                JOIN pg_class AS c ON c.oid = i.indexrelid
+                WHERE c.relname = :name
+            """), {"name": name}).scalar_one_or_none()
+            if valid:
+                log.info(f"Index {name} already exists.")
+                continue
+            if valid is False:
+                log.warning(f"Index {name} is invalid (interrupted build); rebuilding it.")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+            where = f" WHERE {predicate}" if predicate else ""
+            log.info(f"Creating index {name} on {MAIN_TABLE} ({columns}){where}...")
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {MAIN_TABLE} ({columns}){where}"))
+            log.info(f"Created index {name}.")
+
+        for name in SUPERSEDED_INDEXES:
+            if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar_one() is not None:
+                log.info(f"Dropping superseded index {name}.")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def _seq_scans(plan: dict):
+    """Yields the relations a JSON plan node (and its children) reads with a Seq Scan."""
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan.get("Relation Name")
+    for child in plan.get("Plans", []):
+        yield from _seq_scans(child)
+
+
+def check_query_plans() -> dict:
+    """
+    EXPLAINs every PIPELINE_QUERIES entry and warns when one would scan one
+    of the WATCHED_TABLES sequentially. Returns {query name: [relations]}.
+    On a small or freshly loaded table the planner may prefer a Seq Scan
+    anyway; ANALYZE the table before trusting the result.
+    """
+    findings = {}
+    with get_engine().connect() as conn:
+        # A staging table like update_data's, with a chunk-sized sample of
+        # real invoices, so the UPDATE join is planned as in a run.
+        conn.execute(text(f"""
+            CREATE TEMP TABLE {STAGING_TABLE} ON COMMIT DROP AS
+            SELECT invoice_number, dealer_id, landing_page_offer_code, batch_id, offer_code_url,
+                   needs_python_proccess
+            FROM {MAIN_TABLE} WHERE invoice_number IS NOT NULL LIMIT :sample_rows
+        """), {"sample_rows": STAGING_SAMPLE_ROWS})
+        conn.execute(text(f"ANALYZE {STAGING_TABLE}"))
+        for name, (statement, params) in PIPELINE_QUERIES.items():
+            plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {statement}"), params).scalar_one()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            seq_scans = [relation for relation in _seq_scans(plan[0]["Plan"]) if relation in WATCHED_TABLES]
+            findings[name] = seq_scans
+            if seq_scans:
+                log.warning(f"Query '{name}' falls back to a sequential scan of {', '.join(seq_scans)}.")
+            else:
+                log.info(f"Query '{name}' is index-backed (estimated cost {plan[0]['Plan']['Total Cost']}).")
+        # Nothing was written; the rollback also drops the staging sample.
+        conn.rollback()
+    return findings
+
+
+# --- Main Entry Point ---
+def main():
+    parser = argparse.ArgumentParser(description="Create the pipeline's tables and indexes and check its query plans.")
+    parser.add_argument("--check-only", action="store_true", help="Only EXPLAIN the pipeline queries.")
+    args = parser.parse_args()
+
+    if not args.check_only:
+        ensure_tables()
+        ensure_indexes()
+    findings = check_query_plans()
+    slow = [name for name, scans in findings.items() if scans]
+    if slow:
+        log.warning(f"{len(slow)} pipeline queries would scan a table sequentially: {', '.join(slow)}")
+    else:
+        log.info("All pipeline queries are index-backed.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# checkpoint.py
+"""
+Per-batch progress records, so an interrupted run can be resumed with
+`python main.py --resume <batch_id>` instead of starting over.
+
+Each batch moves through the stages below. A stage is 'running' while
+chunks are still being processed and 'done' once it has finished for the
+whole batch. The 'started' stage keeps the fetch query so a resume can
+pick up the rows that were not reached.
+"""
+import json
+from typing import Optional
+
+from sqlalchemy import text
+from conn import get_engine
+from log import log
+
+PROGRESS_TABLE = "mpos_pipeline_progress"
+
+STAGE_STARTED = "started"
+STAGE_OFFER_CODES = "offer_codes_assigned"
+STAGE_DB_UPDATED = "db_updated"
+STAGE_ZOHO_LOADED = "zoho_loaded"
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+
+_table_ready = False
+
+
+def ensure_progress_table():
+    """Creates the progress table on first use."""
+    global _table_ready
+    if _table_ready:
+        return
+    with get_engine().begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+                batch_id   TEXT        NOT NULL,
+                stage      TEXT        NOT NULL,
+                status     TEXT        NOT NULL,
+                detail     JSONB       NOT NULL DEFAULT '{{}}'::jsonb,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (batch_id, stage)
+            )
+        """))
+    _table_ready = True
+
+
+def record_stage(batch_id, stage: str, status: str = STATUS_DONE, detail: Optional[dict] = None):
+    """
+    Upserts the progress of one stage. Failures are logged, not raised: a
+    missing checkpoint only costs resumability, never the run itself.
+    """
+    try:
+        ensure_progress_table()
+        with get_engine().begin() as conn:
+            conn.execute(text(f"""
+                INSERT INTO {PROGRESS_TABLE} (batch_id, stage, status, detail, updated_at)
+                VALUES (:batch_id, :stage, :status, CAST(:detail AS JSONB), now())
+                ON CONFLICT (batch_id, stage) DO UPDATE
+                SET status = EXCLUDED.status, detail = EXCLUDED.detail, updated_at = now()
+            """), {
+                "batch_id": str(batch_id),
+                "stage": stage,
+                "status": status,
+                "detail": json.dumps(detail or {}, default=str),
+            })
+    except Exception as e:
+        log.error(f"Failed to record stage '{stage}' ({status}) for batch {batch_id}: {e}")
+
+
+def load_progress(batch_id) -> dict:
+    """Returns {stage: {"status": ..., "detail": {...}}} for a batch."""
+    ensure_progress_table()
+    with get_engine().connect() as conn:
+        rows = conn.execute(
+            text(f"SELECT stage, status, detail FROM {PROGRESS_TABLE} WHERE batch_id = :batch_id"),
+            {"batch_id": str(batch_id)}
+        ).fetchall()
+    return {stage: {"status": status, "detail": detail or {}} for stage, status, detail in rows}
+
+
+def is_done(progress: dict, stage: str) -> bool:
+    return progress.get(stage, {}).get("status") == STATUS_DONE
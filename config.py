@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -23,4 +24,102 @@ PG_DEV_DB_CONFIG = {
     'host': os.getenv('PG_DEV_HOST', 'localhost'),
     'port': os.getenv('PG_DEV_PORT', '5432'),
     'database': os.getenv('PG_DEV_DATABASE', 'your_pg_db_prod')
-}
\ No newline at end of file
+}
+
+# --- Zoho submission settings ---
+# Base URLs can be pointed at zoho_stub.py for offline runs.
+ZOHO_CAMPAIGNS_URL = os.getenv('ZOHO_CAMPAIGNS_URL', 'https://campaigns.zoho.com').rstrip('/')
+ZOHO_ACCOUNTS_URL = os.getenv('ZOHO_ACCOUNTS_URL', 'https://accounts.zoho.com').rstrip('/')
+# Access tokens are shared between processes through this file.
+ZOHO_TOKEN_CACHE_PATH = os.getenv(
+    'ZOHO_TOKEN_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'zoho_token_cache.json')
+)
+# Refresh the token in the background this long before it expires.
+ZOHO_TOKEN_REFRESH_AHEAD_SECONDS = int(os.getenv('ZOHO_TOKEN_REFRESH_AHEAD_SECONDS', '300'))
+ZOHO_TOKEN_BACKGROUND_REFRESH = os.getenv('ZOHO_TOKEN_BACKGROUND_REFRESH', '1') == '1'
+# Number of concurrent listsubscribe workers used by add_contact.import_contacts.
+ZOHO_CONCURRENCY = int(os.getenv('ZOHO_CONCURRENCY', '4'))
+# Zoho account budget. 'local' keeps the token bucket in this process;
+# 'postgres' shares it with every process using the same database.
+ZOHO_RATE_LIMITER_BACKEND = os.getenv('ZOHO_RATE_LIMITER_BACKEND', 'local')
+ZOHO_RATE_LIMIT_KEY = os.getenv('ZOHO_RATE_LIMIT_KEY', 'zoho_campaigns')
+ZOHO_RATE_LIMIT_CALLS = int(os.getenv('ZOHO_RATE_LIMIT_CALLS', '500'))
+ZOHO_RATE_LIMIT_PERIOD_SECONDS = int(os.getenv('ZOHO_RATE_LIMIT_PERIOD_SECONDS', '300'))
+ZOHO_RATE_LIMIT_LOCK_SECONDS = int(os.getenv('ZOHO_RATE_LIMIT_LOCK_SECONDS', '1800'))
+# 'fixed' locks for ZOHO_RATE_LIMIT_LOCK_SECONDS on a 429; 'adaptive' backs
+# off multiplicatively, honours Retry-After and ramps back up additively.
+ZOHO_RATE_MODE = os.getenv('ZOHO_RATE_MODE', 'fixed')
+ZOHO_ADAPTIVE_DECREASE_FACTOR = float(os.getenv('ZOHO_ADAPTIVE_DECREASE_FACTOR', '0.5'))
+# Calls/sec added to the pacing rate after each accepted call.
+ZOHO_ADAPTIVE_INCREASE_PER_SUCCESS = float(os.getenv('ZOHO_ADAPTIVE_INCREASE_PER_SUCCESS', '0.01'))
+ZOHO_ADAPTIVE_MIN_CALLS_PER_MINUTE = float(os.getenv('ZOHO_ADAPTIVE_MIN_CALLS_PER_MINUTE', '6'))
+# Pause after a 429 that carries no Retry-After information.
+ZOHO_ADAPTIVE_DEFAULT_PAUSE_SECONDS = float(os.getenv('ZOHO_ADAPTIVE_DEFAULT_PAUSE_SECONDS', '60'))
+# How many times a throttled contact is put back in the queue.
+ZOHO_THROTTLE_MAX_REQUEUES = int(os.getenv('ZOHO_THROTTLE_MAX_REQUEUES', '5'))
+# Failed submissions land in zoho_dead_letter; `python dead_letter.py retry`
+# re-sends them with per-error-class exponential backoff (capped below) and
+# gives up after ZOHO_DEAD_LETTER_MAX_ATTEMPTS failures.
+ZOHO_DEAD_LETTER_MAX_ATTEMPTS = int(os.getenv('ZOHO_DEAD_LETTER_MAX_ATTEMPTS', '5'))
+ZOHO_DEAD_LETTER_MAX_BACKOFF_SECONDS = int(os.getenv('ZOHO_DEAD_LETTER_MAX_BACKOFF_SECONDS', '86400'))
+# Successful contacts are written back (activity_zoho_campaign_load) every
+# ZOHO_CHECKPOINT_EVERY successes instead of once at the end of the run.
+ZOHO_CHECKPOINT_EVERY = int(os.getenv('ZOHO_CHECKPOINT_EVERY', '100'))
+
+# --- HTTP client settings (used by http_client) ---
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+HTTP_BACKOFF_BASE_SECONDS = float(os.getenv('HTTP_BACKOFF_BASE_SECONDS', '0.5'))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv('HTTP_BACKOFF_MAX_SECONDS', '30'))
+# Keep at least one pooled connection per submission worker.
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', str(max(10, ZOHO_CONCURRENCY))))
+
+# --- Pipeline settings ---
+# Rows per chunk when process_mpos_data pages through its input (keyset
+# pagination on invoice_number). 0 loads the whole result into one DataFrame.
+MPOS_CHUNK_SIZE = int(os.getenv('MPOS_CHUNK_SIZE', '0'))
+# With chunks, overlap the stages: the Zoho upload of committed chunks runs
+# on its own thread while later chunks are coded and written, with at most
+# MPOS_PIPELINE_QUEUE_SIZE chunks waiting in between.
+MPOS_PIPELINE = os.getenv('MPOS_PIPELINE', '0') == '1'
+MPOS_PIPELINE_QUEUE_SIZE = int(os.getenv('MPOS_PIPELINE_QUEUE_SIZE', '2'))
+# Split pending rows by 'dealer_id', 'inbound_batch_id' or 'invoice_hash' and
+# process the partitions in MPOS_PARTITION_WORKERS processes. Empty disables it.
+MPOS_PARTITION_BY = os.getenv('MPOS_PARTITION_BY', '')
+MPOS_PARTITION_WORKERS = int(os.getenv('MPOS_PARTITION_WORKERS', '4'))
+# Load every existing offer code into memory once per run so collision
+# checks in generate_offer_code do not hit the database on each retry.
+OFFER_CODE_INDEX = os.getenv('OFFER_CODE_INDEX', '0') == '1'
+# Where offer codes are assigned: 'python' (generate_offer_code + staging
+# UPDATE), 'pool' (as python, but codes are claimed from the pre-generated
+# offer_code_pool) or 'sql' (offer_code_db: generated, registered and written
+# inside Postgres, so the rows never leave the database).
+OFFER_CODE_MODE = os.getenv('OFFER_CODE_MODE', 'python')
+# Reservation pool: fills top up to TARGET unclaimed codes, in FILL_BATCH
+# steps, whenever fewer than LOW_WATER are left.
+OFFER_CODE_POOL_TARGET = int(os.getenv('OFFER_CODE_POOL_TARGET', '200000'))
+OFFER_CODE_POOL_LOW_WATER = int(os.getenv('OFFER_CODE_POOL_LOW_WATER', '50000'))
+OFFER_CODE_POOL_FILL_BATCH = int(os.getenv('OFFER_CODE_POOL_FILL_BATCH', '20000'))
+
+# --- Database pool settings (used by conn.get_engine) ---
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+DB_POOL_RECYCLE_SECONDS = int(os.getenv('DB_POOL_RECYCLE_SECONDS', '1800'))
+# 0 disables the server-side statement timeout.
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))
+DB_APPLICATION_NAME = os.getenv('DB_APPLICATION_NAME', 'brandsmart_mpos_processing')
+
+# --- Metrics settings (used by metrics) ---
+# Each run writes run_report_<batch_id>.json and refreshes mpos_pipeline.prom
+# here; point node_exporter's textfile collector at this directory.
+METRICS_DIR = os.getenv('METRICS_DIR', 'metrics')
+
+# --- Known-subscriber cache (used by subscriber_cache) ---
+# Skip Zoho calls for contacts whose exact payload was already accepted but
+# whose load date was never recorded (a recovery path; see subscriber_cache).
+SUBSCRIBER_CACHE = os.getenv('SUBSCRIBER_CACHE', '0') == '1'
+SUBSCRIBER_CACHE_PATH = os.getenv('SUBSCRIBER_CACHE_PATH', 'subscriber_cache.sqlite3')
+SUBSCRIBER_CACHE_TTL_DAYS = float(os.getenv('SUBSCRIBER_CACHE_TTL_DAYS', '30'))
+SUBSCRIBER_CACHE_MAX_ENTRIES = int(os.getenv('SUBSCRIBER_CACHE_MAX_ENTRIES', '1000000'))
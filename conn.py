@@ -1,8 +1,11 @@
 # conn.py
+import io
 import os
 import re
 import sys
+import threading
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 
 # Import project-specific modules
 import config
@@ -11,6 +14,10 @@ from log import log
 # --- Global Environment Configuration ---
 ENVIRONMENT = config.use_env
 
+# --- Process-wide Engine ---
+_engine = None
+_engine_lock = threading.Lock()
+
 def get_db_connection_string() -> str:
     """
     Constructs and returns the appropriate PostgreSQL connection string (URL)
@@ -41,6 +48,46 @@ def get_db_connection_string() -> str:
         log.error(f"Database configuration dictionary is missing a required key: {e}")
         sys.exit(1)
 
+def get_engine() -> Engine:
+    """
+    Returns the process-wide SQLAlchemy engine, creating it on first use.
+    Every module shares this one pool, so a run holds a single, bounded
+    set of connections to Postgres however many stages or workers use it.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                connect_args = {"application_name": config.DB_APPLICATION_NAME}
+                if config.DB_STATEMENT_TIMEOUT_MS > 0:
+                    connect_args["options"] = f"-c statement_timeout={config.DB_STATEMENT_TIMEOUT_MS}"
+                _engine = create_engine(
+                    get_db_connection_string(),
+                    pool_size=config.DB_POOL_SIZE,
+                    max_overflow=config.DB_MAX_OVERFLOW,
+                    pool_pre_ping=config.DB_POOL_PRE_PING,
+                    pool_recycle=config.DB_POOL_RECYCLE_SECONDS,
+                    connect_args=connect_args,
+                )
+                log.info(f"Created DB engine (pool_size={config.DB_POOL_SIZE}, "
+                         f"max_overflow={config.DB_MAX_OVERFLOW}, application_name={config.DB_APPLICATION_NAME}).")
+    return _engine
+
+def copy_dataframe(conn, df, table_name: str, columns: list):
+    """
+    Streams the given DataFrame columns into `table_name` with a single
+    `COPY ... FROM STDIN` (CSV). `conn` is an open SQLAlchemy connection;
+    the COPY runs on its DBAPI connection, inside the current transaction.
+    Missing values (None/NaN/NaT) are written as empty fields, i.e. NULL.
+    """
+    buffer = io.StringIO()
+    df[columns].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    column_list = ", ".join(columns)
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table_name} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+
 def mask_password_in_url(url: str) -> str:
     """Replaces the password in a database URL with '***' for safe logging."""
     return re.sub(r':([^@]+)@', r':***@', url)
@@ -56,7 +103,7 @@ if __name__ == "__main__":
         
         print("\nTesting connection with SQLAlchemy engine...")
         try:
-            engine = create_engine(connection_string)
+            engine = get_engine()
             with engine.connect() as conn:
                 print("SQLAlchemy engine connected successfully!")
             print("Connection closed.")
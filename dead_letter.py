@@ -0,0 +1,251 @@
+# dead_letter.py
+"""
+Dead-letter store for Zoho submissions that failed.
+
+import_contacts records every contact it could not load (token failure,
+HTTP or network error, a Zoho rejection, or throttling that outlasted its
+requeues) in `zoho_dead_letter`, with the error class, the last reason and
+an attempt count. Each failure schedules the next attempt with an
+exponential backoff whose base depends on the error class. A later
+successful load of the same offer code, from any path, marks the entry
+resolved.
+
+Usage:
+    python dead_letter.py status
+    python dead_letter.py retry [--batch-id ID] [--limit N]
+"""
+import argparse
+import threading
+from typing import Optional
+
+from sqlalchemy import text
+
+from conn import get_engine
+from config import ZOHO_DEAD_LETTER_MAX_ATTEMPTS, ZOHO_DEAD_LETTER_MAX_BACKOFF_SECONDS
+from log import log
+from metrics import metrics
+
+DEAD_LETTER_TABLE = "zoho_dead_letter"
+
+ERROR_TOKEN = "token"
+ERROR_NETWORK = "network"
+ERROR_SERVER = "server"
+ERROR_CLIENT = "client"
+ERROR_REJECTED = "rejected"
+ERROR_THROTTLED = "throttled"
+ERROR_UNEXPECTED = "unexpected"
+
+# Base delay before the first retry; it doubles with every further failure.
+RETRY_BACKOFF_SECONDS = {
+    ERROR_TOKEN: 60,
+    ERROR_NETWORK: 300,
+    ERROR_SERVER: 300,
+    ERROR_THROTTLED: 900,
+    ERROR_UNEXPECTED: 600,
+    # Zoho refused the contact itself; a retry only helps once the data is fixed.
+    ERROR_CLIENT: 3600,
+    ERROR_REJECTED: 6 * 3600,
+}
+
+STATUS_PENDING = "pending"
+STATUS_RESOLVED = "resolved"
+STATUS_ABANDONED = "abandoned"
+
+_table_ready = False
+
+
+def ensure_dead_letter_table():
+    """Creates the dead-letter table on first use."""
+    global _table_ready
+    if _table_ready:
+        return
+    with get_engine().begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {DEAD_LETTER_TABLE} (
+                offer_code      TEXT        PRIMARY KEY,
+                batch_id        TEXT        NOT NULL,
+                email           TEXT,
+                error_class     TEXT        NOT NULL,
+                reason          TEXT,
+                attempts        INTEGER     NOT NULL DEFAULT 1,
+                status          TEXT        NOT NULL DEFAULT '{STATUS_PENDING}',
+                first_failed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                last_failed_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+                next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                resolved_at     TIMESTAMPTZ
+            )
+        """))
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {DEAD_LETTER_TABLE}_due_idx
+            ON {DEAD_LETTER_TABLE} (next_attempt_at) WHERE status = '{STATUS_PENDING}'
+        """))
+    _table_ready = True
+
+
+class DeadLetterRecorder:
+    """
+    Collects failed contacts from the submission workers of one import and
+    upserts them into the dead-letter table on flush(). A contact that
+    fails again has its attempt count raised and its next attempt pushed
+    back; after ZOHO_DEAD_LETTER_MAX_ATTEMPTS it is marked abandoned.
+    """
+
+    def __init__(self, batch_id):
+        self.batch_id = str(batch_id)
+        self.pending = {}
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def add(self, row, error_class: str, reason: str):
+        """Records one failed contact row (as fetched by import_contacts)."""
+        email, offer_code = row[0], row[4]
+        if offer_code is None:
+            return
+        with self._lock:
+            self.pending[offer_code] = {
+                "offer_code": offer_code,
+                "batch_id": self.batch_id,
+                "email": email,
+                "error_class": error_class,
+                "reason": str(reason)[:1000],
+                "base_seconds": RETRY_BACKOFF_SECONDS.get(error_class, RETRY_BACKOFF_SECONDS[ERROR_UNEXPECTED]),
+            }
+
+    def flush(self):
+        with self._lock:
+            entries, self.pending = list(self.pending.values()), {}
+        if not entries:
+            return
+        try:
+            ensure_dead_letter_table()
+            with get_engine().begin() as conn:
+                conn.execute(text(f"""
+                    INSERT INTO {DEAD_LETTER_TABLE} AS dead
+                        (offer_code, batch_id, email, error_class, reason, next_attempt_at)
+                    VALUES (:offer_code, :batch_id, :email, :error_class, :reason,
+                            now() + make_interval(secs => :base_seconds))
+                    ON CONFLICT (offer_code) DO UPDATE SET
+                        email = EXCLUDED.email,
+                        error_class = EXCLUDED.error_class,
+                        reason = EXCLUDED.reason,
+                        attempts = dead.attempts + 1,
+                        last_failed_at = now(),
+                        next_attempt_at = now() + make_interval(
+                            secs => LEAST(:max_backoff, :base_seconds * power(2, dead.attempts))
+                        ),
+                        status = CASE WHEN dead.attempts + 1 >= :max_attempts
+                                      THEN '{STATUS_ABANDONED}' ELSE '{STATUS_PENDING}' END,
+                        resolved_at = NULL
+                """), [dict(entry, max_backoff=ZOHO_DEAD_LETTER_MAX_BACKOFF_SECONDS,
+                            max_attempts=ZOHO_DEAD_LETTER_MAX_ATTEMPTS) for entry in entries])
+            self.recorded += len(entries)
+            metrics.inc("contacts_dead_lettered", len(entries))
+            log.warning(f"Recorded {len(entries)} failed Zoho submissions in {DEAD_LETTER_TABLE} "
+                        f"for batch {self.batch_id}.")
+        except Exception as e:
+            log.error(f"Failed to record {len(entries)} failed Zoho submissions: {e}")
+
+
+def resolve(offer_codes) -> int:
+    """
+    Marks entries resolved once their contacts have been loaded, in its own
+    transaction. Best effort: a failure (e.g. the table was never created;
+    see bootstrap.py) is logged, and the entries are settled by a later
+    load or retry. Returns the number of entries resolved.
+    """
+    try:
+        with get_engine().begin() as conn:
+            return conn.execute(text(f"""
+                UPDATE {DEAD_LETTER_TABLE} SET status = '{STATUS_RESOLVED}', resolved_at = now()
+                WHERE offer_code = ANY(:offer_codes) AND status <> '{STATUS_RESOLVED}'
+            """), {"offer_codes": list(offer_codes)}).rowcount
+    except Exception as e:
+        log.warning(f"Could not resolve {len(offer_codes)} dead-letter entries: {e}")
+        return 0
+
+
+def due_entries(batch_id: Optional[str] = None, limit: int = 1000) -> list:
+    """Pending entries whose next attempt is due, oldest first."""
+    ensure_dead_letter_table()
+    batch_filter = "AND batch_id = :batch_id" if batch_id else ""
+    with get_engine().connect() as conn:
+        return conn.execute(text(f"""
+            SELECT offer_code, batch_id, error_class, attempts FROM {DEAD_LETTER_TABLE}
+            WHERE status = '{STATUS_PENDING}' AND next_attempt_at <= now() {batch_filter}
+            ORDER BY next_attempt_at
+            LIMIT :limit
+        """), {"batch_id": batch_id, "limit": limit}).fetchall()
+
+
+def retry_dead_letters(batch_id: Optional[str] = None, limit: int = 1000) -> int:
+    """
+    Re-sends the contacts of due dead-letter entries through import_contacts,
+    so they go through the shared rate limiter.
+    Successes get their load date and are resolved; failures are rescheduled.
+    Returns the number of contacts loaded.
+    """
+    # Imported here: add_contact needs the Zoho credentials at import time
+    from add_contact import fetch_contacts, import_contacts
+
+    entries = due_entries(batch_id, limit)
+    if not entries:
+        log.info("No dead-letter entries are due for a retry.")
+        return 0
+    classes = {}
+    for _, _, error_class, _ in entries:
+        classes[error_class] = classes.get(error_class, 0) + 1
+    log.info(f"Retrying {len(entries)} dead-letter entries: {classes}")
+
+    codes = [offer_code for offer_code, _, _, _ in entries]
+    records = fetch_contacts(None, codes)
+    if records is None:
+        return 0
+
+    # Entries whose contact is already loaded (or gone) need no further retries
+    found = {record[4] for record in records}
+    settled = [code for code in codes if code not in found]
+    if settled:
+        resolve(settled)
+        log.info(f"{len(settled)} dead-letter entries were already loaded; marked resolved.")
+
+    # Imported per original batch, so the entries keep their batch_id
+    batch_of = {offer_code: entry_batch_id for offer_code, entry_batch_id, _, _ in entries}
+    by_batch = {}
+    for record in records:
+        by_batch.setdefault(batch_of[record[4]], []).append(record)
+    loaded = 0
+    for entry_batch_id, batch_records in by_batch.items():
+        loaded += import_contacts(entry_batch_id, records=batch_records)
+    log.info(f"Dead-letter retry loaded {loaded} of {len(records)} contacts.")
+    return loaded
+
+
+def status_summary() -> list:
+    ensure_dead_letter_table()
+    with get_engine().connect() as conn:
+        return conn.execute(text(f"""
+            SELECT status, error_class, COUNT(*), MIN(next_attempt_at)
+            FROM {DEAD_LETTER_TABLE}
+            GROUP BY status, error_class
+            ORDER BY status, error_class
+        """)).fetchall()
+
+
+# --- Main Entry Point ---
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and retry failed Zoho submissions.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="Count dead-letter entries by status and error class.")
+    retry_parser = subparsers.add_parser("retry", help="Re-send the contacts whose retry is due.")
+    retry_parser.add_argument("--batch-id", help="Only retry entries of this batch.")
+    retry_parser.add_argument("--limit", type=int, default=1000, help="Maximum entries to retry in this run.")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for status, error_class, count, next_attempt_at in status_summary():
+            log.info(f"{status:<10} {error_class:<11} {count:>8}  next attempt {next_attempt_at}")
+    else:
+        retry_dead_letters(args.batch_id, args.limit)
+
+if __name__ == '__main__':
+    main()
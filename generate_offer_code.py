@@ -1,22 +1,113 @@
 # generate_offer_code.py
 import random
-import sys
+import time
+from math import comb
+from typing import Optional
+
+import numpy as np
 from log import log
 # --- Refactored Imports ---
-from sqlalchemy import create_engine, text
-from conn import get_db_connection_string # Use the new connection logic
+from sqlalchemy import text
+from conn import get_engine # Use the shared connection pool
+from metrics import metrics
+
+# --- Offer Code Alphabet ---
+CODE_LENGTH = 6
+CODE_LETTERS = "ABCDFGHJKLMNPQRSTUVWXYZ"
+CODE_DIGITS = "23456789"
+# Every code is a 6-digit number in base 31 over this alphabet, which fits
+# comfortably in an unsigned 32-bit integer (31**6 < 2**32).
+CODE_ALPHABET = CODE_LETTERS + CODE_DIGITS
+CODE_BASE = len(CODE_ALPHABET)
+_SYMBOL_VALUES = {symbol: value for value, symbol in enumerate(CODE_ALPHABET)}
+# Place value of each position, most significant first (matches encode_code).
+_POSITION_WEIGHTS = CODE_BASE ** np.arange(CODE_LENGTH - 1, -1, -1, dtype=np.uint64)
+_ALPHABET_ARRAY = np.array(list(CODE_ALPHABET), dtype="<U1")
+
+# Codes carry 1-5 digits; each digit count is drawn with equal probability,
+# so the code space is best described per digit count.
+MIN_DIGITS, MAX_DIGITS = 1, 5
+CODE_SPACE_BY_DIGITS = {
+    k: comb(CODE_LENGTH, k) * len(CODE_DIGITS) ** k * len(CODE_LETTERS) ** (CODE_LENGTH - k)
+    for k in range(MIN_DIGITS, MAX_DIGITS + 1)
+}
+CODE_SPACE_SIZE = sum(CODE_SPACE_BY_DIGITS.values())
+
+_rng = np.random.default_rng()
+
+
+def encode_code(code: str) -> Optional[int]:
+    """Packs an offer code into an integer, or returns None if it is not a
+    6-character code over the standard alphabet (e.g. legacy codes)."""
+    if not isinstance(code, str) or len(code) != CODE_LENGTH:
+        return None
+    value = 0
+    for symbol in code:
+        digit = _SYMBOL_VALUES.get(symbol)
+        if digit is None:
+            return None
+        value = value * CODE_BASE + digit
+    return value
+
+
+def decode_code(value: int) -> str:
+    """Inverse of encode_code."""
+    symbols = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(int(value), CODE_BASE)
+        symbols.append(CODE_ALPHABET[digit])
+    return "".join(reversed(symbols))
+
+
+def decode_codes(values: np.ndarray) -> list:
+    """Vectorized decode_code for an array of encoded values."""
+    if len(values) == 0:
+        return []
+    digits = (np.asarray(values, dtype=np.uint64)[:, None] // _POSITION_WEIGHTS) % CODE_BASE
+    return _ALPHABET_ARRAY[digits].view(f"<U{CODE_LENGTH}").ravel().tolist()
+
+
+def digit_counts(values: np.ndarray) -> np.ndarray:
+    """Number of digit characters in each encoded code."""
+    digits = (np.asarray(values, dtype=np.uint64)[:, None] // _POSITION_WEIGHTS) % CODE_BASE
+    return (digits >= len(CODE_LETTERS)).sum(axis=1)
+
+
+def generate_encoded_codes(n: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Draws n distinct codes as encoded uint32 values using whole-array
+    operations. Follows the same rules as generate_single_code: 1-5 digits
+    chosen uniformly, placed at random positions, letters everywhere else.
+    """
+    rng = rng or _rng
+    codes = np.empty(0, dtype=np.uint32)
+    while len(codes) < n:
+        m = n - len(codes)
+        num_counts = rng.integers(MIN_DIGITS, MAX_DIGITS + 1, size=m)
+        # The num_count smallest random keys in each row mark the digit positions.
+        keys = rng.random((m, CODE_LENGTH))
+        thresholds = np.sort(keys, axis=1)[np.arange(m), num_counts - 1]
+        is_digit = keys <= thresholds[:, None]
+
+        letters = rng.integers(0, len(CODE_LETTERS), size=(m, CODE_LENGTH))
+        digits = rng.integers(len(CODE_LETTERS), CODE_BASE, size=(m, CODE_LENGTH))
+        symbols = np.where(is_digit, digits, letters).astype(np.uint64)
+        values = (symbols * _POSITION_WEIGHTS).sum(axis=1).astype(np.uint32)
+
+        # Dedup while keeping draw order, so truncating stays unbiased.
+        _, first_seen = np.unique(values, return_index=True)
+        values = values[np.sort(first_seen)]
+        values = values[~np.isin(values, codes)]
+        codes = np.concatenate([codes, values])[:n]
+    return codes
 
-# --- Create a Single, Global Engine ---
-# This engine uses your conn.py logic and will be used for all DB operations.
-DB_URL = get_db_connection_string()
-ENGINE = create_engine(DB_URL)
 
 def generate_single_code() -> str:
     """Generates one random, 6-character alphanumeric code."""
     # Renamed 'len' to 'code_length' to avoid shadowing the built-in function
-    code_length = 6
-    chars = "ABCDFGHJKLMNPQRSTUVWXYZ"
-    nums = "23456789"
+    code_length = CODE_LENGTH
+    chars = CODE_LETTERS
+    nums = CODE_DIGITS
     
     num_count = random.randint(1, 5)
     char_count = code_length - num_count
@@ -34,11 +125,7 @@ def generate_single_code() -> str:
 
 def generate_candidate_codes(n: int) -> set:
     """Generates a set of n unique candidate offer codes in memory."""
-    offercodes = set()
-    # Using a while loop is correct here to ensure exactly n unique codes are generated
-    while len(offercodes) < n:
-        offercodes.add(generate_single_code())
-    return offercodes
+    return set(decode_codes(generate_encoded_codes(n)))
 
 
 def check_offercode_db(codes_to_check: set) -> set:
@@ -58,33 +145,226 @@ def check_offercode_db(codes_to_check: set) -> set:
     """)
     
     try:
-        with ENGINE.connect() as conn:
+        started = time.monotonic()
+        with get_engine().connect() as conn:
             # Execute the query with safe parameters
             result = conn.execute(query, {"codes": list(codes_to_check)})
             existing_codes = {row[0] for row in result}
+        metrics.observe("offer_code_db_check_seconds", time.monotonic() - started)
+        metrics.inc("offer_code_db_checks")
         
         # Return the codes that are not in the database using a set difference
         return codes_to_check - existing_codes
         
     except Exception as e:
-        print(f"Database error while checking offer codes: {e}", file=sys.stderr)
+        log.error(f"Database error while checking offer codes: {e}")
         # In case of a DB error, assume all codes are invalid to be safe
         return set()
 
 
-def generate_offer_code(n: int) -> list:
+class OfferCodeIndex:
+    """
+    In-memory copy of every `landing_page_offer_code` already issued, so
+    collision checks do not need a database round trip. Existing codes are
+    held as a sorted uint32 array of encoded values; codes issued during the
+    run go to a second, much smaller sorted array, so neither lookup nor
+    add() has to copy the large one. Codes that cannot be encoded (other
+    lengths or characters) are kept as plain strings.
+    """
+
+    def __init__(self):
+        self._sorted = np.empty(0, dtype=np.uint32)
+        self._added = np.empty(0, dtype=np.uint32)
+        self._unencodable = set()
+
+    @classmethod
+    def load(cls, fetch_size: int = 50000) -> "OfferCodeIndex":
+        """Builds the index from a single streamed query."""
+        index = cls()
+        query = text("""
+            SELECT DISTINCT landing_page_offer_code
+            FROM mpos_post_sale_marketing
+            WHERE landing_page_offer_code IS NOT NULL
+        """)
+        parts = []
+        with get_engine().connect() as conn:
+            result = conn.execution_options(stream_results=True, max_row_buffer=fetch_size).execute(query)
+            for rows in result.partitions(fetch_size):
+                encoded = []
+                for (code,) in rows:
+                    value = encode_code(code)
+                    if value is None:
+                        index._unencodable.add(code)
+                    else:
+                        encoded.append(value)
+                parts.append(np.array(encoded, dtype=np.uint32))
+        if parts:
+            index._sorted = np.unique(np.concatenate(parts))
+        log.info(f"Loaded offer code index: {len(index)} existing codes "
+                 f"({index._sorted.nbytes / 1024 / 1024:.1f} MiB).")
+        return index
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._added) + len(self._unencodable)
+
+    def __contains__(self, code: str) -> bool:
+        return not self.filter_new({code})
+
+    def encoded_values(self) -> np.ndarray:
+        """All encodable codes in the index, sorted."""
+        if not len(self._added):
+            return self._sorted
+        return np.union1d(self._sorted, self._added)
+
+    def _found(self, values: np.ndarray) -> np.ndarray:
+        """Boolean mask of the encoded `values` already in the index (binary search)."""
+        found = np.zeros(len(values), dtype=bool)
+        for sorted_values in (self._sorted, self._added):
+            positions = np.searchsorted(sorted_values, values)
+            in_range = positions < len(sorted_values)
+            found[in_range] |= sorted_values[positions[in_range]] == values[in_range]
+        return found
+
+    def filter_new_encoded(self, values: np.ndarray) -> np.ndarray:
+        """Returns the encoded codes from `values` that are not in the index."""
+        return values[~self._found(values)]
+
+    def filter_new(self, codes: set) -> set:
+        """Returns the codes from `codes` that are not in the index."""
+        new_codes = set()
+        encoded = {}
+        for code in codes:
+            value = encode_code(code)
+            if value is None:
+                if code not in self._unencodable:
+                    new_codes.add(code)
+            else:
+                encoded[code] = value
+        if not encoded:
+            return new_codes
+
+        values = np.fromiter(encoded.values(), dtype=np.uint32, count=len(encoded))
+        new_codes.update(code for code, hit in zip(encoded, self._found(values)) if not hit)
+        return new_codes
+
+    def add(self, codes):
+        """Records newly issued codes."""
+        encoded = []
+        for code in codes:
+            value = encode_code(code)
+            if value is None:
+                self._unencodable.add(code)
+            else:
+                encoded.append(value)
+        if encoded:
+            self._added = np.union1d(self._added, np.array(encoded, dtype=np.uint32))
+
+
+def _generate_with_index(n: int, index: OfferCodeIndex) -> set:
+    """
+    Collects n codes using the in-memory index for collision checks, then
+    verifies the final set against the database once. Codes the database
+    rejects (issued after the index was loaded) are replaced and the
+    verification repeats for the replacements only.
+    """
+    final_codes = set()
+    verified_codes = set()
+    drawn = 0
+    while len(verified_codes) < n:
+        while len(final_codes) < n:
+            candidates = generate_encoded_codes(n - len(final_codes))
+            drawn += len(candidates)
+            survivors = set(decode_codes(index.filter_new_encoded(candidates)))
+            final_codes.update(survivors - final_codes)
+
+        unverified = final_codes - verified_codes
+        valid_codes = check_offercode_db(unverified)
+        stale_codes = unverified - valid_codes
+        if stale_codes:
+            log.warning(f"{len(stale_codes)} codes were missing from the offer code index; regenerating them.")
+            index.add(stale_codes)
+            final_codes -= stale_codes
+        verified_codes.update(valid_codes)
+
+    index.add(verified_codes)
+    _log_collision_rate(drawn, n)
+    return verified_codes
+
+
+def _log_collision_rate(drawn: int, accepted: int):
+    metrics.inc("offer_code_candidates", drawn)
+    metrics.inc("offer_code_collisions", drawn - accepted)
+    if drawn:
+        log.info(f"Offer code collision rate: {(drawn - accepted) / drawn:.2%} "
+                 f"({drawn - accepted} of {drawn} candidates rejected).")
+
+
+def code_space_report(index: Optional[OfferCodeIndex] = None) -> dict:
+    """
+    Reports how full the offer code space is, per digit count and overall,
+    together with the collision rate a freshly drawn candidate should expect.
+    Uses the in-memory index when given, otherwise one aggregate query.
+    """
+    if index is not None:
+        counts = np.bincount(digit_counts(index.encoded_values()), minlength=CODE_LENGTH + 1)
+        issued = {k: int(counts[k]) for k in CODE_SPACE_BY_DIGITS}
+    else:
+        query = text("""
+            SELECT length(regexp_replace(landing_page_offer_code, '[^2-9]', '', 'g')) AS digit_count,
+                   COUNT(DISTINCT landing_page_offer_code)
+            FROM mpos_post_sale_marketing
+            WHERE landing_page_offer_code ~ :pattern
+            GROUP BY 1
+        """)
+        pattern = f"^[{CODE_ALPHABET}]{{{CODE_LENGTH}}}$"
+        with get_engine().connect() as conn:
+            rows = conn.execute(query, {"pattern": pattern}).fetchall()
+        issued = {k: 0 for k in CODE_SPACE_BY_DIGITS}
+        issued.update({int(k): int(count) for k, count in rows if int(k) in issued})
+
+    by_digits = {
+        k: {"issued": issued[k], "space": size, "occupancy": issued[k] / size}
+        for k, size in CODE_SPACE_BY_DIGITS.items()
+    }
+    # Digit counts are drawn uniformly, so the expected collision rate is
+    # the mean occupancy across digit counts, not the overall occupancy.
+    expected_collision_rate = sum(v["occupancy"] for v in by_digits.values()) / len(by_digits)
+    total_issued = sum(issued.values())
+    report = {
+        "issued": total_issued,
+        "space": CODE_SPACE_SIZE,
+        "occupancy": total_issued / CODE_SPACE_SIZE,
+        "expected_collision_rate": expected_collision_rate,
+        "by_digit_count": by_digits,
+    }
+    log.info(f"Offer code space: {total_issued} of {CODE_SPACE_SIZE} codes issued "
+             f"({report['occupancy']:.4%}); expected collision rate {expected_collision_rate:.4%}.")
+    return report
+
+
+def generate_offer_code(n: int, index: Optional[OfferCodeIndex] = None) -> list:
     """
     Generates a list of n unique offer codes that are guaranteed
     not to exist in the database.
+
+    With an OfferCodeIndex, collision retries are resolved in memory and the
+    database is queried once for the final set instead of once per retry.
     """
+    if index is not None:
+        final_codes = _generate_with_index(n, index)
+        log.info(f"Finished. Total generated unique offer codes: {len(final_codes)}")
+        return list(final_codes)
+
     final_codes = set()
+    drawn = 0
     
     # Loop until we have collected the required number of unique, valid codes
     while len(final_codes) < n:
         needed = n - len(final_codes)
         
         # Generate a batch of new candidate codes
-        candidate_codes = generate_candidate_codes(needed)
+        candidate_codes = generate_candidate_codes(needed) - final_codes
+        drawn += len(candidate_codes)
         
         # Check which of the candidates are valid (not in the DB)
         valid_codes = check_offercode_db(candidate_codes)
@@ -94,11 +374,13 @@ def generate_offer_code(n: int) -> list:
         
         log.info(f"Generated {len(valid_codes)} new valid codes. Total collected: {len(final_codes)}/{n}")
 
+    _log_collision_rate(drawn, n)
     log.info(f"Finished. Total generated unique offer codes: {len(final_codes)}")
     return list(final_codes)
 
 
 if __name__ == '__main__':
+    code_space_report()
     # Example: generate 10 unique codes
     generated_codes = generate_offer_code(10)
     print("\nFinal Codes:")
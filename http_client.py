@@ -0,0 +1,89 @@
+# http_client.py
+"""
+Shared HTTP client for all Zoho traffic (subscribe calls and token refresh).
+
+One pooled requests.Session keeps TCP/TLS connections alive between calls,
+every request gets connect/read timeouts, and connection errors or 5xx
+responses are retried with jittered exponential backoff. 429s are returned
+to the caller untouched: the Zoho rate limiter owns that decision.
+
+Query strings are redacted from everything logged here: the token refresh
+URL carries the refresh token and client secret.
+"""
+import random
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_BASE_SECONDS, HTTP_BACKOFF_MAX_SECONDS, HTTP_POOL_SIZE
+)
+from log import log
+
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+_QUERY_STRING = re.compile(r"\?[^\s'\")]*")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Returns the process-wide session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Retries are handled in `post` so they can be logged and jittered.
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given 0-based attempt."""
+    ceiling = min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def redact(text) -> str:
+    """Replaces every query string in `text` (a URL or an error message) with '?***'."""
+    return _QUERY_STRING.sub("?***", str(text))
+
+
+def post(url: str, before_attempt=None, **kwargs) -> requests.Response:
+    """
+    POSTs through the shared session. Connection errors, timeouts and 5xx
+    responses are retried up to HTTP_MAX_RETRIES times; the last response
+    (or exception) is passed on to the caller. `before_attempt` is called
+    before every attempt, retries included, e.g. to take a rate-limiter
+    token per call actually made.
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        if before_attempt is not None:
+            before_attempt()
+        try:
+            response = get_session().post(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            log.warning(f"Request to {redact(url)} failed ({redact(err)}); "
+                        f"retry {attempt + 1}/{HTTP_MAX_RETRIES} in {delay:.2f}s.")
+            time.sleep(delay)
+            continue
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < HTTP_MAX_RETRIES:
+            delay = backoff_delay(attempt)
+            log.warning(f"Request to {redact(url)} returned {response.status_code}; "
+                        f"retry {attempt + 1}/{HTTP_MAX_RETRIES} in {delay:.2f}s.")
+            time.sleep(delay)
+            continue
+        return response
@@ -1,4 +1,16 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
 # import os
 # from logdna import LogDNAHandler
 # from dotenv import load_dotenv
@@ -17,9 +29,183 @@ import logging
 # logging.getLogger().addHandler(logdna_handler)
 # logging.getLogger().setLevel(logging.INFO)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Read here rather than through config: importing config freezes every
+# setting, and scripts such as benchmark.py import log before they have
+# put their own environment in place. load_dotenv never overrides.
+load_dotenv()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# 'text' keeps the classic one-line format; 'json' writes one JSON object per
+# line with the structured fields (batch_id, offer_code, stage, latency).
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# Per-record messages (one per contact or rate-limit wait) below
+# LOG_RECORD_SAMPLE_LEVEL are sampled: only every LOG_RECORD_SAMPLE_EVERY-th
+# is written (1 writes all, 0 none), and each stage logs a summary line every
+# LOG_RECORD_SUMMARY_SECONDS instead. Records at or above the level are
+# always written.
+LOG_RECORD_SAMPLE_LEVEL = os.getenv('LOG_RECORD_SAMPLE_LEVEL', 'WARNING').upper()
+LOG_RECORD_SAMPLE_EVERY = int(os.getenv('LOG_RECORD_SAMPLE_EVERY', '100'))
+LOG_RECORD_SUMMARY_SECONDS = float(os.getenv('LOG_RECORD_SUMMARY_SECONDS', '30'))
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Passed through `extra=`; both formatters write them when present.
+STRUCTURED_FIELDS = ("batch_id", "offer_code", "stage", "latency", "count")
+
+
+class TextFormatter(logging.Formatter):
+    """The classic one-line format, followed by any structured fields."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = [f"{name}={getattr(record, name)}" for name in STRUCTURED_FIELDS if hasattr(record, name)]
+        return f"{line} [{' '.join(fields)}]" if fields else line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and the structured fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in STRUCTURED_FIELDS:
+            if hasattr(record, name):
+                entry[name] = getattr(record, name)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+_batch_id = contextvars.ContextVar("mpos_batch_id", default=None)
+
+
+@contextmanager
+def batch_context(batch_id):
+    """
+    Tags every record logged inside the block with `batch_id`, unless the
+    call passes its own. Threads see it when started with a copy of the
+    context (contextvars.copy_context().run).
+    """
+    token = _batch_id.set(None if batch_id is None else str(batch_id))
+    try:
+        yield
+    finally:
+        _batch_id.reset(token)
+
+
+class BatchIdFilter(logging.Filter):
+    """Adds the batch_id of the current batch_context to records that have none."""
+
+    def filter(self, record):
+        if not hasattr(record, "batch_id"):
+            batch_id = _batch_id.get()
+            if batch_id is not None:
+                record.batch_id = batch_id
+        return True
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that keeps a record's traceback apart from its message.
+    The stock prepare() formats the traceback into `msg`, which would leave
+    JsonFormatter nothing to put under "exception"; here it travels as
+    exc_text (already a string, unlike exc_info) and each formatter places it.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def _configure():
+    """
+    Sends every record through a queue: callers (e.g. the Zoho submission
+    workers) only enqueue, and a single listener thread formats and writes.
+    Returns the listener, or None if logging was already configured.
+    """
+    root = logging.getLogger()
+    if any(isinstance(handler, logging.handlers.QueueHandler) for handler in root.handlers):
+        return None
+    records = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter(TEXT_FORMAT))
+    listener = logging.handlers.QueueListener(records, stream_handler, respect_handler_level=True)
+    root.setLevel(LOG_LEVEL)
+    # The filter runs in the logging thread, where the batch context is set.
+    queue_handler = StructuredQueueHandler(records)
+    queue_handler.addFilter(BatchIdFilter())
+    root.addHandler(queue_handler)
+    listener.start()
+    # Drain the queue before the interpreter exits.
+    atexit.register(listener.stop)
+    return listener
+
+
+_listener = _configure()
+log = logging.getLogger("mpos")
+
+
+class RecordLog:
+    """
+    Logging for per-record events (one per contact or rate-limit wait), so
+    log volume stays flat however many records go through. Events below
+    `sample_level` are counted per stage and only every `sample_every`-th is
+    written; every `summary_seconds` each stage gets one summary line with
+    its count and mean latency. Messages are str.format templates filled in
+    from the keyword fields, only for the events that are written.
+    """
+
+    def __init__(self, logger, sample_level=LOG_RECORD_SAMPLE_LEVEL, sample_every=LOG_RECORD_SAMPLE_EVERY,
+                 summary_seconds=LOG_RECORD_SUMMARY_SECONDS):
+        self.logger = logger
+        self.sample_level = logging.getLevelName(sample_level) if isinstance(sample_level, str) else sample_level
+        self.sample_every = sample_every
+        self.summary_seconds = summary_seconds
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._latency = {}
+        self._window_started = time.monotonic()
+
+    def record(self, stage: str, template: str, level=logging.INFO, **fields):
+        """Counts one event of `stage` and writes it if sampled (or at/above sample_level)."""
+        latency = fields.get("latency")
+        with self._lock:
+            count = self._counts.get(stage, 0) + 1
+            self._counts[stage] = count
+            if latency is not None:
+                self._latency[stage] = self._latency.get(stage, 0.0) + latency
+            summary_due = time.monotonic() - self._window_started >= self.summary_seconds
+        if level >= self.sample_level or (self.sample_every > 0 and (count - 1) % self.sample_every == 0):
+            if self.logger.isEnabledFor(level):
+                extra = {name: fields[name] for name in STRUCTURED_FIELDS if name in fields}
+                extra["stage"] = stage
+                self.logger.log(level, template.format(**fields), extra=extra)
+        if summary_due:
+            self.flush()
+
+    def flush(self):
+        """Writes the summary lines of the current window and starts a new one."""
+        with self._lock:
+            counts, latency = self._counts, self._latency
+            elapsed = time.monotonic() - self._window_started
+            self._counts, self._latency = {}, {}
+            self._window_started = time.monotonic()
+        for stage, count in counts.items():
+            extra = {"stage": stage, "count": count}
+            mean = ""
+            if stage in latency:
+                extra["latency"] = round(latency[stage] / count, 4)
+                mean = f", mean latency {extra['latency']:.3f}s"
+            self.logger.info(f"{stage}: {count} records in the last {elapsed:.0f}s{mean}.", extra=extra)
+
 
-log = logging
\ No newline at end of file
+record_log = RecordLog(log)
@@ -1,25 +1,57 @@
 # main_process.py
 import os
+import sys
 import random
+import argparse
+import contextvars
+import json
+import queue
+import threading
+import time
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from datetime import datetime
-from typing import Optional, Any, Union
+from typing import Optional, Any, Union, Iterator
 
 # --- New Imports ---
-from sqlalchemy import create_engine, text
-from sqlalchemy.types import Date
-from conn import get_db_connection_string # Import the new function
+from sqlalchemy import text
+from conn import get_engine, copy_dataframe # Use the shared connection pool
 
 # --- Existing Project-Specific Imports ---
-from add_contact import import_contacts
-from generate_offer_code import generate_offer_code
-from config import use_env
-from log import log
+from add_contact import import_contacts, contacts_from_update, RETURNING_COLUMNS, BackgroundLoadDateRecorder
+from checkpoint import (
+    record_stage, load_progress, is_done, STATUS_RUNNING, STATUS_DONE,
+    STAGE_STARTED, STAGE_OFFER_CODES, STAGE_DB_UPDATED, STAGE_ZOHO_LOADED
+)
+from generate_offer_code import generate_offer_code, OfferCodeIndex, code_space_report
+from offer_code_db import assign_offer_codes_in_db
+from offer_code_pool import claim_offer_codes
+from config import (
+    use_env, MPOS_CHUNK_SIZE, MPOS_PIPELINE, MPOS_PIPELINE_QUEUE_SIZE, OFFER_CODE_INDEX, OFFER_CODE_MODE,
+    MPOS_PARTITION_BY, MPOS_PARTITION_WORKERS
+)
+from log import log, batch_context
+from metrics import metrics
 
-# --- Create a Single, Global Engine ---
-# This engine uses your conn.py logic and will be used for all DB operations.
-DB_URL = get_db_connection_string()
-ENGINE = create_engine(DB_URL)
+# Arrow-backed strings take a fraction of the memory of object columns; plain
+# pandas strings are the fallback when pyarrow is not installed.
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    STRING_DTYPE = "string"
+
+# Columns written by update_data, in COPY order.
+STAGING_COLUMNS = [
+    'invoice_number', 'dealer_id', 'activity_plan_purchased_date',
+    'landing_page_offer_code', 'batch_id', 'offer_code_url', 'needs_python_proccess'
+]
+
+# Offer code URLs: BrandsMart's own dealer gets the environment's landing page.
+BRANDSMART_DEALER_ID = '5779155000141100449'
+GENERAL_OFFER_CODE_URL = "http://default-general-url.com"
 
 # --- Helper Functions (Unchanged) ---
 def UUID() -> int:
@@ -27,28 +59,78 @@ def UUID() -> int:
     now_str = datetime.now().strftime("%y%m%d%H%M%S%f")
     return int(f"{now_str[:-2]}{random.randint(0, 9)}")
 
+def brandsmart_base_url() -> str:
+    return os.getenv(f"{use_env}_brandsmart_url", "http://default-brandsmart-url.com")
+
+@lru_cache(maxsize=None)
+def dealer_base_url(dealer_id: str) -> str:
+    """Base of offer_code_url for one dealer; cached, as a run sees few distinct dealers."""
+    return brandsmart_base_url() if dealer_id == BRANDSMART_DEALER_ID else GENERAL_OFFER_CODE_URL
+
 def offer_code_url_f(dealer_id: Union[str, int], offer_code: str = "") -> str:
     """Returns the appropriate offer code URL based on dealer_id and environment."""
     dealer_id_str = str(dealer_id)
-    base_url = os.getenv(f"{use_env}_brandsmart_url", "http://default-brandsmart-url.com")
-    if dealer_id_str == '5779155000141100449':
-        return f"{base_url}/{offer_code}"
-    return f"http://default-general-url.com/{offer_code}"
+    if dealer_id_str == BRANDSMART_DEALER_ID:
+        return f"{brandsmart_base_url()}/{offer_code}"
+    return f"{GENERAL_OFFER_CODE_URL}/{offer_code}"
 
-def generate_offercode(df: pd.DataFrame) -> pd.DataFrame:
-    """Generates and merges unique offer codes into the DataFrame."""
+def issue_offer_codes(n: int, index: Optional[OfferCodeIndex] = None, batch_id=None) -> list:
+    """Returns n new offer codes, claimed from the pool when OFFER_CODE_MODE is 'pool'."""
+    if OFFER_CODE_MODE == "pool":
+        return claim_offer_codes(n, claimed_by=batch_id, index=index)
+    return generate_offer_code(n, index=index)
+
+def generate_offercode(df: pd.DataFrame, index: Optional[OfferCodeIndex] = None,
+                       reserved_codes: Optional[list] = None, batch_id=None) -> pd.DataFrame:
+    """
+    Generates and merges unique offer codes into the DataFrame.
+    `reserved_codes` are codes already verified for this caller (e.g. a
+    partition's share); they are used first and only the shortfall, if any,
+    is issued.
+    """
     if 'invoice_number' not in df.columns or df['invoice_number'].nunique() == 0:
         log.warning("No unique invoice numbers found to generate offer codes.")
         df['offer_code'] = None
         return df
 
     unique_invoices = df[['invoice_number']].drop_duplicates().reset_index(drop=True)
-    offer_codes = generate_offer_code(len(unique_invoices))
+    offer_codes = list(reserved_codes or [])[:len(unique_invoices)]
+    if len(offer_codes) < len(unique_invoices):
+        offer_codes += issue_offer_codes(len(unique_invoices) - len(offer_codes), index, batch_id)
     unique_invoices['offer_code'] = offer_codes
+    metrics.inc("invoices_coded", len(unique_invoices))
     df = pd.merge(df, unique_invoices, on='invoice_number', how='left')
     log.info("Successfully generated and merged offer codes.")
     return df
 
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts a fetched frame to compact dtypes in place: dealer_id becomes a
+    categorical (a handful of dealers across millions of rows) and the
+    invoice and offer code columns become (Arrow-backed) strings.
+    """
+    if 'dealer_id' in df.columns:
+        df['dealer_id'] = df['dealer_id'].astype(STRING_DTYPE).astype("category")
+    for column in ('invoice_number', 'landing_page_offer_code'):
+        if column in df.columns:
+            df[column] = df[column].astype(STRING_DTYPE)
+    return df
+
+def read_pending_frame(query, conn, params: Optional[dict] = None) -> pd.DataFrame:
+    """pd.read_sql plus compact_frame."""
+    return compact_frame(pd.read_sql(query, conn, params=params))
+
+def clean_codes(codes: pd.Series) -> pd.Series:
+    """Vectorized get_val_or_none: stripped strings, with blanks and missing values as NA."""
+    codes = codes.astype(STRING_DTYPE).str.strip()
+    return codes.mask(codes == "")
+
+def offer_code_urls(dealer_ids: pd.Series, codes: pd.Series) -> pd.Series:
+    """Vectorized offer_code_url_f over aligned dealer_id and offer code columns."""
+    # On a categorical column map() resolves each dealer once, not once per row
+    bases = dealer_ids.map(lambda dealer: dealer_base_url(str(dealer))).astype(STRING_DTYPE)
+    return bases + "/" + codes.astype(STRING_DTYPE).fillna("")
+
 def get_val_or_none(val: Any) -> Optional[str]:
     """Helper to clean and convert values to string or return None."""
     if val is None or pd.isna(val) or (isinstance(val, str) and not val.strip()):
@@ -56,48 +138,65 @@ def get_val_or_none(val: Any) -> Optional[str]:
     return str(val).strip()
 
 # --- REFACTORED `update_data` Function ---
-def update_data(df: pd.DataFrame, batch_id: int):
+def load_staging_table(conn, upload_df: pd.DataFrame, temp_table_name: str):
+    """
+    Creates a session TEMP table with the same column types as
+    mpos_post_sale_marketing, bulk loads `upload_df` into it with COPY and
+    ANALYZEs it so the planner has real row counts for the UPDATE join.
+    The table is dropped automatically when the transaction commits.
+    """
+    column_list = ", ".join(STAGING_COLUMNS)
+    conn.execute(text(f"""
+        CREATE TEMP TABLE {temp_table_name} ON COMMIT DROP AS
+        SELECT {column_list} FROM mpos_post_sale_marketing WITH NO DATA
+    """))
+    copy_dataframe(conn, upload_df, temp_table_name, STAGING_COLUMNS)
+    conn.execute(text(f"ANALYZE {temp_table_name}"))
+
+def update_data(df: pd.DataFrame, batch_id: int) -> list:
     """
-    Updates records by loading data into a temporary table, running a
-    single UPDATE...FROM query, and then dropping the temporary table.
+    Updates records by COPYing the changes into a session temporary table
+    and running a single UPDATE...FROM query in the same transaction.
+
+    The UPDATE RETURNs the contact fields of the rows it wrote, so the
+    result (see contacts_from_update) can go straight to import_contacts
+    without reading the batch back from the table.
     """
     log.info(f"Starting high-performance database update for batch_id = {batch_id}")
     if df.empty:
         log.warning("Input DataFrame is empty. No updates to perform.")
-        return
+        return []
 
-    update_tasks = df.drop_duplicates(subset=["invoice_number", "dealer_id"]).dropna(
-        subset=['invoice_number', 'dealer_id']
-    ).copy()
+    # Filtering first means drop_duplicates hashes fewer rows; no copies are taken
+    update_tasks = df.dropna(subset=['invoice_number', 'dealer_id']).drop_duplicates(
+        subset=["invoice_number", "dealer_id"]
+    )
 
     log.info(f"Consolidated into {len(update_tasks)} unique update operations.")
     if update_tasks.empty:
         log.warning("No valid tasks after cleaning data. Exiting.")
-        return
-
-    upload_df = update_tasks[['invoice_number', 'dealer_id']].copy()
+        return []
 
-    upload_df['activity_plan_purchased_date'] = pd.NaT
-    upload_df['landing_page_offer_code'] = update_tasks['offer_code'].apply(get_val_or_none)
-    upload_df['batch_id'] = str(batch_id)
-    upload_df['offer_code_url'] = update_tasks.apply(
-        lambda row: offer_code_url_f(row.get('dealer_id'), row.get('offer_code')), axis=1
-    )
-    upload_df['needs_python_proccess'] = 0
+    # Built column by column in one go, with vectorized string operations
+    # instead of per-row apply calls to get_val_or_none / offer_code_url_f.
+    upload_df = pd.DataFrame({
+        'invoice_number': update_tasks['invoice_number'],
+        'dealer_id': update_tasks['dealer_id'],
+        'activity_plan_purchased_date': pd.NaT,
+        'landing_page_offer_code': clean_codes(update_tasks['offer_code']),
+        'batch_id': str(batch_id),
+        'offer_code_url': offer_code_urls(update_tasks['dealer_id'], update_tasks['offer_code']),
+        'needs_python_proccess': 0,
+    })
 
-    # Use the specified static temporary table name
+    # Session-scoped, so concurrent runs cannot see each other's rows
     temp_table_name = "temp_update_mpos_remove"
 
     try:
-        with ENGINE.begin() as conn:
+        with get_engine().begin() as conn:
             log.info(f"Loading {len(upload_df)} records into temporary table '{temp_table_name}'...")
-            upload_df.to_sql(
-                name=temp_table_name,
-                con=conn,
-                if_exists="replace",
-                index=False,
-                dtype={'activity_plan_purchased_date': Date}
-            )
+            with metrics.timer("db_copy"):
+                load_staging_table(conn, upload_df, temp_table_name)
             log.info("Temporary table created and populated.")
 
             log.info("Executing the final UPDATE...FROM query.")
@@ -108,74 +207,502 @@ def update_data(df: pd.DataFrame, batch_id: int):
                     landing_page_offer_code = temp.landing_page_offer_code,
                     batch_id = temp.batch_id,
                     offer_code_url = temp.offer_code_url,
-                    needs_python_proccess = temp.needs_python_proccess
+                    needs_python_proccess = temp.needs_python_proccess,
+                    -- A new code means a new offer URL: (re)send the contact to Zoho
+                    activity_zoho_campaign_load = NULL
                 FROM {temp_table_name} AS temp
                 WHERE
                     main.invoice_number = temp.invoice_number
-                    AND main.dealer_id = temp.dealer_id;
+                    AND main.dealer_id = temp.dealer_id
+                RETURNING {", ".join(f"main.{column}" for column in RETURNING_COLUMNS)};
             """)
-            result = conn.execute(update_query)
-            log.info(f"UPDATE command sent. Rows affected: {result.rowcount}")
+            with metrics.timer("db_update_statement"):
+                updated_rows = conn.execute(update_query).fetchall()
+            metrics.inc("rows_updated", len(updated_rows))
+            log.info(f"UPDATE command sent. Rows affected: {len(updated_rows)}")
 
         log.info(f"Successfully committed all updates for batch {batch_id}.")
-
-        # Verification step
-        with ENGINE.connect() as conn:
-            result = conn.execute(
-                text('SELECT COUNT(DISTINCT(invoice_number)) FROM mpos_post_sale_marketing WHERE batch_id = :batch_id'),
-                {"batch_id": str(batch_id)}
-            ).scalar_one_or_none()
-            log.info(f"DB verification for batch {batch_id}: Found {result or 0} unique invoices.")
-        
-        # --- THIS IS THE NEW PART ---
-        # Clean up by dropping the temporary table after a successful run
-        log.info(f"Cleaning up temporary table '{temp_table_name}'...")
-        with ENGINE.connect() as conn:
-            conn.execute(text(f"DROP TABLE {temp_table_name}"))
-            log.info("Temporary table dropped successfully.")
-        # --- END OF NEW PART ---
+        return contacts_from_update(updated_rows)
 
     except Exception as e:
         log.error(f"The bulk update failed and was rolled back. Error: {e}")
-        # Note: If the script fails, the temp table might not be dropped here,
-        # but `if_exists="replace"` will handle it on the next run.
+        # The temp table is session-scoped and ON COMMIT DROP, so a failed
+        # run never leaves staging data behind.
         raise
-def process_mpos_data():
-    """Orchestrates the entire process using the global SQLAlchemy engine."""
-    # General query
-    # query = text("SELECT id, landing_page_offer_code, dealer_id, invoice_number FROM mpos_post_sale_marketing WHERE needs_python_proccess = '1'")
-    # August query
-    # query = text("SELECT id, landing_page_offer_code, dealer_id, invoice_number FROM mpos_post_sale_marketing WHERE inbound_batch_id = '21'")
-    # September query
-    # query = text("SELECT id, landing_page_offer_code, dealer_id, invoice_number FROM mpos_post_sale_marketing WHERE needs_python_proccess = '1' and inbound_batch_id = '61'")
-    # October query
-    # query = text("SELECT id, landing_page_offer_code, dealer_id, invoice_number FROM mpos_post_sale_marketing WHERE needs_python_proccess = '1' and inbound_batch_id = '63'")
-    # November query
-    # query = text("SELECT id, landing_page_offer_code, dealer_id, invoice_number FROM mpos_post_sale_marketing WHERE needs_python_proccess = '1' and inbound_batch_id = '65'")
-    # December query
-    # query = text("SELECT id, landing_page_offer_code, dealer_id, invoice_number FROM mpos_post_sale_marketing WHERE needs_python_proccess = '1' and inbound_batch_id = '67'")
-    
+def iter_invoice_chunks(query, chunk_size: int, params: Optional[dict] = None) -> Iterator[pd.DataFrame]:
+    """
+    Pages through the result of `query` in invoice order and yields
+    DataFrames of roughly `chunk_size` rows, every invoice whole so it gets
+    a single offer code. Pages are keyset-paginated on invoice_number and
+    each is read in its own short transaction, so no snapshot of
+    mpos_post_sale_marketing stays open while a chunk's Zoho stage runs.
+    """
+    # Rows without an invoice are dropped by update_data anyway, and keyset
+    # comparisons cannot page over NULLs.
+    base = f"SELECT * FROM ({query}) AS pending WHERE invoice_number IS NOT NULL"
+    queries = {
+        None: text(f"{base} ORDER BY invoice_number LIMIT :page_size"),
+        # Resume at an invoice the previous page may have cut short
+        ">=": text(f"{base} AND invoice_number >= :invoice ORDER BY invoice_number LIMIT :page_size"),
+        # Continue past an invoice that has been yielded in full
+        ">": text(f"{base} AND invoice_number > :invoice ORDER BY invoice_number LIMIT :page_size"),
+    }
+    whole_invoice_query = text(f"{base} AND invoice_number = :invoice")
+    position, invoice = None, None
+    while True:
+        page_params = dict(params or {}, page_size=chunk_size, invoice=invoice)
+        with get_engine().connect() as conn:
+            page = pd.read_sql(queries[position], conn, params=page_params)
+        if len(page) < chunk_size:
+            # Short page: the end of the result, so its last invoice is complete
+            if not page.empty:
+                yield compact_frame(page)
+            return
+
+        # The page's last invoice may continue past it; the next page starts there.
+        invoice = page['invoice_number'].iloc[-1]
+        is_last_invoice = page['invoice_number'] == invoice
+        if is_last_invoice.all():
+            # A single invoice fills the page: read all of it, then move past it
+            with get_engine().connect() as conn:
+                page = pd.read_sql(whole_invoice_query, conn, params=dict(params or {}, invoice=invoice))
+            yield compact_frame(page)
+            position = ">"
+        else:
+            yield compact_frame(page[~is_last_invoice].reset_index(drop=True))
+            position = ">="
+
+def _code_and_update_chunks(query, chunk_size: int, batch_id, index: Optional[OfferCodeIndex],
+                            params: Optional[dict], progress: dict) -> Iterator[list]:
+    """
+    The database half of a chunked run: reads the rows of `query` in
+    invoice-aligned chunks, assigns each chunk its offer codes, writes it
+    with update_data and yields the contacts that UPDATE returned.
+    `progress` ({"chunks": ..., "rows": ...}) is kept current and goes into
+    the running checkpoints.
+    """
+    for chunk in iter_invoice_chunks(query, chunk_size, params):
+        progress["chunks"] += 1
+        progress["rows"] += len(chunk)
+        metrics.inc("rows_fetched", len(chunk))
+        log.info(f"Processing chunk {progress['chunks']} ({len(chunk)} rows, {progress['rows']} so far) "
+                 f"for batch {batch_id}.")
+        with metrics.timer(STAGE_OFFER_CODES):
+            chunk_with_codes = generate_offercode(chunk, index, batch_id=batch_id)
+        record_stage(batch_id, STAGE_OFFER_CODES, STATUS_RUNNING, dict(progress))
+        with metrics.timer(STAGE_DB_UPDATED):
+            records = update_data(chunk_with_codes, batch_id)
+        record_stage(batch_id, STAGE_DB_UPDATED, STATUS_RUNNING, dict(progress))
+        yield records
+
+def _finish_chunked_batch(batch_id, progress: dict, loaded: int):
+    """Logs the outcome of a chunked run and marks its three stages done."""
+    if progress["chunks"] == 0:
+        log.warning("No records found that require processing.")
+    else:
+        log.info(f"Finished batch {batch_id}: {progress['rows']} rows in {progress['chunks']} chunks, "
+                 f"{loaded} contacts loaded.")
+    record_stage(batch_id, STAGE_OFFER_CODES, STATUS_DONE, progress)
+    record_stage(batch_id, STAGE_DB_UPDATED, STATUS_DONE, progress)
+    record_stage(batch_id, STAGE_ZOHO_LOADED, STATUS_DONE, {"loaded": loaded})
+
+def process_mpos_chunks(query, chunk_size: int, batch_id, index: Optional[OfferCodeIndex] = None,
+                        params: Optional[dict] = None):
+    """
+    Streaming variant of process_mpos_data: each chunk goes through offer
+    code generation, the database update and the Zoho import before the
+    next one is read, so peak memory is bounded by `chunk_size`.
+    """
+    log.info(f"Streaming records in chunks of {chunk_size} for batch {batch_id}.")
+    progress = {"chunks": 0, "rows": 0}
+    loaded = 0
+    for records in _code_and_update_chunks(query, chunk_size, batch_id, index, params, progress):
+        with metrics.timer(STAGE_ZOHO_LOADED):
+            loaded += import_contacts(batch_id, records=records)
+        record_stage(batch_id, STAGE_ZOHO_LOADED, STATUS_RUNNING, {"loaded": loaded})
+    _finish_chunked_batch(batch_id, progress, loaded)
+
+def process_mpos_pipelined(query, chunk_size: int, batch_id, index: Optional[OfferCodeIndex] = None,
+                           params: Optional[dict] = None):
+    """
+    Overlapping variant of process_mpos_chunks (MPOS_PIPELINE=1). This thread
+    codes and writes chunks; as each UPDATE commits, its returned contacts
+    are queued for a Zoho thread, and a BackgroundLoadDateRecorder writes
+    the confirmations in batches. The queue holds at most
+    MPOS_PIPELINE_QUEUE_SIZE chunks, so a slow Zoho stage holds back the
+    database stage instead of piling up memory, and the run takes about as
+    long as its slowest stage.
+    """
+    log.info(f"Pipelining records in chunks of {chunk_size} for batch {batch_id} "
+             f"(queue size {MPOS_PIPELINE_QUEUE_SIZE}).")
+    handoff = queue.Queue(maxsize=max(1, MPOS_PIPELINE_QUEUE_SIZE))
+    recorder = BackgroundLoadDateRecorder()
+    accepted = [0]
+
+    def zoho_stage():
+        while True:
+            records = handoff.get()
+            if records is None:
+                return
+            try:
+                with metrics.timer(STAGE_ZOHO_LOADED):
+                    accepted[0] += import_contacts(batch_id, records=records, recorder=recorder)
+                record_stage(batch_id, STAGE_ZOHO_LOADED, STATUS_RUNNING, {"accepted": accepted[0]})
+            except Exception as e:
+                # The chunk is committed; a later add_contact.py run picks its contacts up.
+                log.error(f"Zoho stage failed for a chunk of {len(records)} contacts: {e}")
+
+    # A copy of this context keeps the batch_id on the stage's logs
+    zoho_thread = threading.Thread(target=contextvars.copy_context().run, args=(zoho_stage,),
+                                   name="zoho-stage", daemon=True)
+    zoho_thread.start()
+
+    progress = {"chunks": 0, "rows": 0}
     try:
-        df = pd.read_sql(query, ENGINE.connect())
+        for records in _code_and_update_chunks(query, chunk_size, batch_id, index, params, progress):
+            with metrics.timer("pipeline_handoff_wait"):
+                handoff.put(records)
+    finally:
+        # Committed chunks are always uploaded, even if a later one failed
+        handoff.put(None)
+        zoho_thread.join()
+        recorder.close()
+    _finish_chunked_batch(batch_id, progress, recorder.recorded)
+
+def process_mpos_frame(query, batch_id, index: Optional[OfferCodeIndex] = None,
+                       params: Optional[dict] = None):
+    """Loads the whole result of `query` and runs each stage over it once."""
+    try:
+        with metrics.timer("fetch"), get_engine().connect() as conn:
+            df = read_pending_frame(query, conn, params)
+        metrics.inc("rows_fetched", len(df))
         log.info(f"Fetched {len(df)} records from database for processing.")
     except Exception as e:
         log.error(f"Failed to fetch initial data from the database. Error: {e}")
         return
 
+    records = []
     if not df.empty:
-        batch_id = UUID()
-        df_with_codes = generate_offercode(df)
-        update_data(df_with_codes, batch_id)
-        import_contacts(batch_id)
+        with metrics.timer(STAGE_OFFER_CODES):
+            df_with_codes = generate_offercode(df, index, batch_id=batch_id)
+        record_stage(batch_id, STAGE_OFFER_CODES, detail={"invoices": int(df['invoice_number'].nunique())})
+        with metrics.timer(STAGE_DB_UPDATED):
+            records = update_data(df_with_codes, batch_id)
+        record_stage(batch_id, STAGE_DB_UPDATED, detail={"rows": len(df)})
     else:
         log.warning("No records found that require processing.")
+        record_stage(batch_id, STAGE_OFFER_CODES, detail={"invoices": 0})
+        record_stage(batch_id, STAGE_DB_UPDATED, detail={"rows": 0})
+
+    with metrics.timer(STAGE_ZOHO_LOADED):
+        loaded = import_contacts(batch_id, records=records)
+    record_stage(batch_id, STAGE_ZOHO_LOADED, detail={"loaded": loaded})
 
-# --- Main Entry Point (Unchanged) ---
+def process_mpos_in_db(query, batch_id, params: Optional[dict] = None):
+    """
+    OFFER_CODE_MODE=sql: offer codes are generated, checked and written by
+    Postgres itself (see offer_code_db), then the batch is imported.
+    """
+    with metrics.timer(STAGE_OFFER_CODES):
+        result = assign_offer_codes_in_db(
+            query, batch_id, BRANDSMART_DEALER_ID, brandsmart_base_url(), GENERAL_OFFER_CODE_URL, params,
+            returning=RETURNING_COLUMNS
+        )
+    record_stage(batch_id, STAGE_OFFER_CODES, detail={"invoices": result["invoices"], "mode": "sql"})
+    record_stage(batch_id, STAGE_DB_UPDATED, detail={"rows": result["rows"], "mode": "sql"})
+
+    with metrics.timer(STAGE_ZOHO_LOADED):
+        loaded = import_contacts(batch_id, records=contacts_from_update(result["returned"]))
+    record_stage(batch_id, STAGE_ZOHO_LOADED, detail={"loaded": loaded})
+
+# --- Partitioned Execution ---
+PARTITION_KEYS = ("dealer_id", "inbound_batch_id", "invoice_hash")
+
+def _partition_expression(partition_by: str, partitions: int) -> str:
+    """SQL expression giving each pending row (`p`, joined to `m`) its partition value."""
+    if partition_by == "dealer_id":
+        return "m.dealer_id::text"
+    if partition_by == "inbound_batch_id":
+        return "m.inbound_batch_id::text"
+    if partition_by == "invoice_hash":
+        # Hashing the invoice (rather than the row id) keeps each invoice in one partition.
+        return f"mod(hashtext(p.invoice_number::text)::bigint + 2147483648, {int(partitions)})::text"
+    raise ValueError(f"Unknown partition key '{partition_by}'. Expected one of {PARTITION_KEYS}.")
+
+def _partition_query(query, expression: str) -> str:
+    return f"""
+        SELECT p.* FROM ({query}) AS p
+        JOIN mpos_post_sale_marketing AS m ON m.id = p.id
+        WHERE {expression} = :partition_value
+    """
+
+def _run_partition(task: dict) -> dict:
+    """
+    Worker body for process_mpos_partitioned. Runs in its own process with
+    its own engine, so the staging TEMP table and the UPDATE transaction
+    belong to this partition's session only.
+    """
+    started = time.monotonic()
+    params = dict(task["params"] or {}, partition_value=task["partition_value"])
+    result = {"partition": task["partition_value"], "rows": 0, "invoices": 0, "offer_codes": [], "records": []}
+    with batch_context(task["batch_id"]):
+        with get_engine().connect() as conn:
+            df = read_pending_frame(text(task["query"]), conn, params)
+        result["rows"] = len(df)
+        if not df.empty:
+            df_with_codes = generate_offercode(df, reserved_codes=task["offer_codes"], batch_id=task["batch_id"])
+            result["records"] = update_data(df_with_codes, task["batch_id"])
+            result["invoices"] = int(df_with_codes['invoice_number'].nunique())
+            result["offer_codes"] = df_with_codes['offer_code'].dropna().unique().tolist()
+    result["seconds"] = round(time.monotonic() - started, 3)
+    return result
+
+def process_mpos_partitioned(query, batch_id, partition_by: str, workers: int,
+                             index: Optional[OfferCodeIndex] = None, params: Optional[dict] = None) -> dict:
+    """
+    Splits the pending rows by `partition_by` and runs offer-code assignment
+    and the database update for each partition in a process pool.
+
+    Offer codes for every partition are generated up front in this process,
+    in one pass, and handed out as disjoint slices, so partitions can never
+    issue the same code. (With dealer_id or inbound_batch_id partitions an
+    invoice number that appears under two keys gets one code per key.) The
+    per-partition results are merged into one report and the Zoho import
+    then runs once for the whole batch.
+    """
+    started = time.monotonic()
+    expression = _partition_expression(partition_by, workers)
+    plan_query = text(f"""
+        SELECT {expression} AS partition_value, COUNT(DISTINCT p.invoice_number) AS invoices
+        FROM ({query}) AS p
+        JOIN mpos_post_sale_marketing AS m ON m.id = p.id
+        GROUP BY 1
+    """)
+    with get_engine().connect() as conn:
+        plan = [(value, invoices) for value, invoices in conn.execute(plan_query, params or {}) if value is not None]
+    if not plan:
+        log.warning("No records found that require processing.")
+        return {"batch_id": str(batch_id), "partitions": []}
+
+    total_invoices = sum(invoices for _, invoices in plan)
+    log.info(f"Partitioned batch {batch_id} by {partition_by}: {len(plan)} partitions, "
+             f"{total_invoices} invoices, {workers} workers.")
+    with metrics.timer(STAGE_OFFER_CODES):
+        codes = issue_offer_codes(total_invoices, index, batch_id)
+
+    tasks, offset = [], 0
+    for value, invoices in plan:
+        tasks.append({
+            "query": _partition_query(query, expression),
+            "params": params,
+            "partition_value": value,
+            "batch_id": batch_id,
+            "offer_codes": codes[offset:offset + invoices],
+        })
+        offset += invoices
+
+    results = []
+    partitions_started = time.monotonic()
+    # spawn, not fork: workers must not inherit the parent's pooled connections or threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for result in executor.map(_run_partition, tasks):
+            log.info(f"Partition {result['partition']}: {result['rows']} rows, "
+                     f"{result['invoices']} invoices in {result['seconds']}s.")
+            results.append(result)
+    # Worker processes keep their own collectors; the parent records the wall time and totals.
+    metrics.add_stage_time(STAGE_DB_UPDATED, time.monotonic() - partitions_started)
+    metrics.inc("rows_fetched", sum(r["rows"] for r in results))
+
+    offer_codes = [code for result in results for code in result.pop("offer_codes")]
+    # Partitions hold disjoint offer codes, so their contacts need no further dedup.
+    records = [record for result in results for record in result.pop("records")]
+    record_stage(batch_id, STAGE_OFFER_CODES, detail={"invoices": len(offer_codes)})
+    record_stage(batch_id, STAGE_DB_UPDATED, detail={"rows": sum(r["rows"] for r in results)})
+
+    with metrics.timer(STAGE_ZOHO_LOADED):
+        loaded = import_contacts(batch_id, records=records)
+    record_stage(batch_id, STAGE_ZOHO_LOADED, detail={"loaded": loaded})
+
+    report = {
+        "batch_id": str(batch_id),
+        "partition_by": partition_by,
+        "workers": workers,
+        "rows": sum(r["rows"] for r in results),
+        "invoices": len(offer_codes),
+        "zoho_loaded": loaded,
+        "seconds": round(time.monotonic() - started, 3),
+        "partitions": results,
+    }
+    log.info(f"Partitioned batch report: {json.dumps(report)}")
+    return report
+
+def run_batch(query, batch_id, chunk_size: int, index: Optional[OfferCodeIndex] = None,
+              params: Optional[dict] = None, partition_by: Optional[str] = None):
+    """
+    Runs the rows of `query` through every stage under `batch_id` and writes
+    the batch's run report (stage timings, counters, latency percentiles).
+    """
+    partition_by = MPOS_PARTITION_BY if partition_by is None else partition_by
+    metrics.reset()
+    if OFFER_CODE_MODE == "sql":
+        # Nothing is fetched, so chunking and partitioning do not apply.
+        extra = {"mode": "sql"}
+    else:
+        chunked = "pipelined" if MPOS_PIPELINE else "chunked"
+        extra = {"mode": "partitioned" if partition_by else chunked if chunk_size > 0 else "frame"}
+    try:
+        with batch_context(batch_id), metrics.timer("total"):
+            if OFFER_CODE_MODE == "sql":
+                process_mpos_in_db(query, batch_id, params)
+            elif partition_by:
+                extra["partitions"] = process_mpos_partitioned(
+                    query, batch_id, partition_by, MPOS_PARTITION_WORKERS, index, params
+                ).get("partitions", [])
+            elif chunk_size > 0 and MPOS_PIPELINE:
+                process_mpos_pipelined(query, chunk_size, batch_id, index, params)
+            elif chunk_size > 0:
+                process_mpos_chunks(query, chunk_size, batch_id, index, params)
+            else:
+                process_mpos_frame(query, batch_id, index, params)
+    finally:
+        metrics.write_report(batch_id, extra)
+
+def resume_mpos_batch(batch_id: str, chunk_size: int, index: Optional[OfferCodeIndex] = None):
+    """
+    Continues an interrupted batch from its checkpoints. Rows of the original
+    query that were not yet stamped with this batch_id are processed under
+    the same batch_id, then only contacts without a Zoho load date are sent.
+    """
+    progress = load_progress(batch_id)
+    if STAGE_STARTED not in progress:
+        log.error(f"No checkpoint found for batch {batch_id}. Nothing to resume.")
+        return
+    stage_status = {stage: info['status'] for stage, info in progress.items()}
+    log.info(f"Resuming batch {batch_id}. Stage status: {stage_status}")
+
+    if not is_done(progress, STAGE_DB_UPDATED):
+        # Rows the interrupted run already wrote are not part of the handoff
+        # below, so send their contacts first.
+        import_contacts(batch_id)
+        started = progress[STAGE_STARTED]["detail"]
+        original_query = started["query"]
+        original_params = started.get("params") or {}
+        remaining_query = f"""
+            SELECT original.* FROM ({original_query}) AS original
+            WHERE NOT EXISTS (
+                SELECT 1 FROM mpos_post_sale_marketing AS done
+                WHERE done.id = original.id AND done.batch_id = :batch_id
+            )
+        """
+        run_batch(text(remaining_query), batch_id, chunk_size, index, dict(original_params, batch_id=str(batch_id)))
+    else:
+        log.info(f"Database stages already complete for batch {batch_id}; resuming the Zoho load only.")
+        metrics.reset()
+        with metrics.timer(STAGE_ZOHO_LOADED):
+            loaded = import_contacts(batch_id)
+        record_stage(batch_id, STAGE_ZOHO_LOADED, detail={"loaded": loaded})
+        metrics.write_report(batch_id, {"mode": "resume"})
+
+PENDING_COLUMNS = "id, landing_page_offer_code, dealer_id, invoice_number"
+
+def build_pending_query(inbound_batch_id: Optional[str] = None, include_processed: bool = False):
+    """
+    Returns (query, params) selecting the rows to process: those flagged
+    needs_python_proccess = '1', optionally limited to one inbound batch.
+    `include_processed` drops the flag filter, which reprocesses every row of
+    the inbound batch and therefore requires one. Rows that get a new code
+    have their Zoho load date cleared, so they are sent to Zoho again.
+    """
+    conditions, params = [], {}
+    if not include_processed:
+        conditions.append("needs_python_proccess = '1'")
+    if inbound_batch_id is not None:
+        conditions.append("inbound_batch_id = :inbound_batch_id")
+        params["inbound_batch_id"] = str(inbound_batch_id)
+    if not conditions:
+        raise ValueError("include_processed requires an inbound_batch_id.")
+    query = f"SELECT {PENDING_COLUMNS} FROM mpos_post_sale_marketing WHERE {' AND '.join(conditions)}"
+    return query, params
+
+def process_mpos_data(chunk_size: Optional[int] = None, resume_batch_id: Optional[str] = None,
+                      partition_by: Optional[str] = None, inbound_batch_ids: Optional[list] = None,
+                      include_processed: bool = False) -> list:
+    """
+    Orchestrates the entire process using the global SQLAlchemy engine.
+    Each of `inbound_batch_ids` is run as its own batch (with its own
+    batch_id and run report); without any, all rows flagged
+    needs_python_proccess = '1' form one batch. All batches share the
+    engine, the Zoho token and rate limiter, and one offer code index.
+
+    A positive `chunk_size` (default MPOS_CHUNK_SIZE) switches to the
+    streaming, chunked execution in process_mpos_chunks (overlapped in
+    process_mpos_pipelined with MPOS_PIPELINE=1), and `partition_by`
+    (default MPOS_PARTITION_BY) to the parallel process_mpos_partitioned.
+    With `resume_batch_id`, an interrupted batch is continued instead.
+    Returns the batch_ids that completed.
+    """
+    inbound_batch_ids = list(inbound_batch_ids or [None])
+    # One index per invocation, shared by every batch (always built when
+    # catching up on several, so the existing codes are read only once);
+    # generate_offer_code keeps it current as codes are issued.
+    index = None
+    if OFFER_CODE_INDEX or (len(inbound_batch_ids) > 1 and OFFER_CODE_MODE != "sql"):
+        index = OfferCodeIndex.load()
+        code_space_report(index)
+
+    chunk_size = MPOS_CHUNK_SIZE if chunk_size is None else chunk_size
+    if resume_batch_id:
+        resume_mpos_batch(resume_batch_id, chunk_size, index)
+        return [resume_batch_id]
+
+    completed, failed = [], []
+    for inbound_batch_id in inbound_batch_ids:
+        query, params = build_pending_query(inbound_batch_id, include_processed)
+        batch_id = UUID()
+        label = f"inbound batch {inbound_batch_id}" if inbound_batch_id is not None else "pending rows"
+        log.info(f"Processing {label} as batch {batch_id}.")
+        record_stage(batch_id, STAGE_STARTED, detail={
+            "query": query, "params": params, "chunk_size": chunk_size, "inbound_batch_id": inbound_batch_id
+        })
+        try:
+            run_batch(text(query), batch_id, chunk_size, index, params, partition_by=partition_by)
+            completed.append(batch_id)
+        except Exception as e:
+            # Later batches are independent; this one can be resumed from its checkpoints
+            log.error(f"Batch {batch_id} ({label}) failed: {e}. Resume it with --resume {batch_id}.")
+            failed.append(batch_id)
+
+    if failed:
+        log.error(f"{len(failed)} of {len(inbound_batch_ids)} batches failed: {failed}")
+    return completed
+
+# --- Main Entry Point ---
 def main():
     """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Assign offer codes to pending MPOS rows and load them into Zoho.")
+    parser.add_argument("--inbound-batch-id", dest="inbound_batch_ids", action="append", metavar="ID",
+                        help="Process only this inbound batch; repeat to process several in one run. "
+                             "Default: every row with needs_python_proccess = '1'.")
+    parser.add_argument("--include-processed", action="store_true",
+                        help="Ignore needs_python_proccess and reprocess every row of the given inbound batches.")
+    parser.add_argument("--chunk-size", type=int, help="Rows per chunk (default MPOS_CHUNK_SIZE; 0 = whole batch).")
+    parser.add_argument("--partition-by", choices=PARTITION_KEYS,
+                        help="Process partitions in parallel (default MPOS_PARTITION_BY).")
+    parser.add_argument("--resume", metavar="BATCH_ID",
+                        help="Continue an interrupted run, skipping the work its checkpoints mark as done.")
+    args = parser.parse_args()
+    if args.include_processed and not args.inbound_batch_ids:
+        parser.error("--include-processed requires at least one --inbound-batch-id.")
+
     log.info("************** START PROCESS **************")
-    process_mpos_data()
+    completed = process_mpos_data(
+        chunk_size=args.chunk_size, resume_batch_id=args.resume, partition_by=args.partition_by,
+        inbound_batch_ids=args.inbound_batch_ids, include_processed=args.include_processed
+    )
     log.info("************** END PROCESS **************")
+    expected = 1 if args.resume else len(args.inbound_batch_ids or [None])
+    if len(completed) < expected:
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
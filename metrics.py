@@ -0,0 +1,173 @@
+# metrics.py
+"""
+Lightweight run instrumentation: stage timers, counters and latency
+histograms, written per batch as a JSON run report and a Prometheus
+textfile (for node_exporter's textfile collector).
+
+Usage:
+    from metrics import metrics
+
+    with metrics.timer("update_data"):
+        ...
+    metrics.inc("rows_updated", len(df))
+    metrics.observe("zoho_api_latency_seconds", elapsed)
+    metrics.write_report(batch_id)
+"""
+import bisect
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+from config import METRICS_DIR
+from log import log
+
+# Upper bounds (seconds) of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Samples kept per histogram for percentiles (reservoir sampling beyond this).
+MAX_SAMPLES = 100000
+PROMETHEUS_PREFIX = "mpos_pipeline"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = value
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.percentile(0.50), 6),
+            "p90": round(self.percentile(0.90), 6),
+            "p99": round(self.percentile(0.99), 6),
+            "max": round(self.max, 6),
+        }
+
+
+class Metrics:
+    """Thread-safe collection of stage timings, counters and histograms for one run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now()
+            self.stages = {}
+            self.counters = {}
+            self.histograms = {}
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Times the enclosed block and adds it to `stage` (stages may repeat, e.g. per chunk)."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_stage_time(stage, time.monotonic() - started)
+
+    def add_stage_time(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["calls"] += 1
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).observe(value)
+
+    def report(self, batch_id, extra: Optional[dict] = None) -> dict:
+        with self._lock:
+            return {
+                "batch_id": str(batch_id),
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "finished_at": datetime.now().isoformat(timespec="seconds"),
+                "stages": {name: {"seconds": round(v["seconds"], 6), "calls": v["calls"]}
+                           for name, v in self.stages.items()},
+                "counters": dict(self.counters),
+                "histograms": {name: h.summary() for name, h in self.histograms.items()},
+                **(extra or {}),
+            }
+
+    def prometheus_text(self, batch_id) -> str:
+        label = f'batch_id="{batch_id}"'
+        lines = []
+        with self._lock:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds gauge")
+            for stage, v in sorted(self.stages.items()):
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds{{{label},stage="{stage}"}} {v["seconds"]:.6f}')
+            for name, value in sorted(self.counters.items()):
+                metric = f"{PROMETHEUS_PREFIX}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric}{{{label}}} {value}")
+            for name, hist in sorted(self.histograms.items()):
+                metric = f"{PROMETHEUS_PREFIX}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.bucket_counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {hist.count}')
+                lines.append(f"{metric}_sum{{{label}}} {hist.sum:.6f}")
+                lines.append(f"{metric}_count{{{label}}} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, batch_id, extra: Optional[dict] = None) -> dict:
+        """
+        Writes run_report_<batch_id>.json and refreshes mpos_pipeline.prom in
+        METRICS_DIR. The textfile is replaced atomically on every run, so the
+        collector always exposes the latest batch rather than piling up series.
+        """
+        report = self.report(batch_id, extra)
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            report_path = os.path.join(METRICS_DIR, f"run_report_{batch_id}.json")
+            with open(report_path, "w") as report_file:
+                json.dump(report, report_file, indent=2)
+
+            prom_path = os.path.join(METRICS_DIR, f"{PROMETHEUS_PREFIX}.prom")
+            tmp_path = f"{prom_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as prom_file:
+                prom_file.write(self.prometheus_text(batch_id))
+            os.replace(tmp_path, prom_path)
+            log.info(f"Wrote run report for batch {batch_id} to {report_path}.")
+        except OSError as e:
+            log.error(f"Failed to write run report for batch {batch_id}: {e}")
+        return report
+
+
+# Process-wide collector shared by every module.
+metrics = Metrics()
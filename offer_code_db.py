@@ -0,0 +1,190 @@
+# offer_code_db.py
+"""
+Server-side offer code assignment (OFFER_CODE_MODE=sql).
+
+Instead of fetching the pending rows, generating codes in Python, checking
+them and COPYing them back, everything happens in one transaction inside
+Postgres:
+
+  1. the distinct (invoice_number, dealer_id) pairs of the query go into a
+     TEMP table, and their distinct invoices into another;
+  2. `mpos_random_offer_code()` draws a code per invoice, which is claimed by
+     inserting it into `mpos_offer_code_registry` (primary key on the code)
+     with ON CONFLICT DO NOTHING. Codes already present on
+     mpos_post_sale_marketing are rejected in the same statement, and only
+     the invoices left without a code are retried;
+  3. a single UPDATE writes landing_page_offer_code, offer_code_url and
+     batch_id, and clears activity_zoho_campaign_load, exactly as
+     generate_offercode + update_data would.
+
+Only the contact fields of the updated rows (for the Zoho stage) travel
+back to the client.
+"""
+from typing import Optional, Sequence
+
+from sqlalchemy import text
+
+from conn import get_engine
+from generate_offer_code import CODE_LENGTH, CODE_LETTERS, CODE_DIGITS, MIN_DIGITS, MAX_DIGITS
+from log import log
+from metrics import metrics
+
+REGISTRY_TABLE = "mpos_offer_code_registry"
+RANDOM_CODE_FUNCTION = "mpos_random_offer_code"
+# Rounds of redraws before giving up; each round only retries the conflicts.
+MAX_ROUNDS = 20
+
+_schema_ready = False
+
+
+def ensure_offer_code_schema():
+    """Creates the code generator function and the registry table on first use."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with get_engine().begin() as conn:
+        # Same rules as generate_single_code: MIN_DIGITS-MAX_DIGITS digits,
+        # letters everywhere else, positions shuffled.
+        conn.execute(text(f"""
+            CREATE OR REPLACE FUNCTION {RANDOM_CODE_FUNCTION}() RETURNS text
+            LANGUAGE plpgsql VOLATILE AS $fn$
+            DECLARE
+                letters   CONSTANT text := '{CODE_LETTERS}';
+                digits    CONSTANT text := '{CODE_DIGITS}';
+                num_count int := {MIN_DIGITS} + floor(random() * {MAX_DIGITS - MIN_DIGITS + 1})::int;
+                symbols   text[] := ARRAY[]::text[];
+            BEGIN
+                FOR i IN 1..{CODE_LENGTH} LOOP
+                    IF i <= num_count THEN
+                        symbols := symbols || substr(digits, 1 + floor(random() * {len(CODE_DIGITS)})::int, 1);
+                    ELSE
+                        symbols := symbols || substr(letters, 1 + floor(random() * {len(CODE_LETTERS)})::int, 1);
+                    END IF;
+                END LOOP;
+                RETURN (SELECT string_agg(symbol, '' ORDER BY random()) FROM unnest(symbols) AS symbol);
+            END
+            $fn$
+        """))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {REGISTRY_TABLE} (
+                code           TEXT        PRIMARY KEY,
+                invoice_number TEXT        NOT NULL,
+                batch_id       TEXT        NOT NULL,
+                created_at     TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """))
+    _schema_ready = True
+
+
+def assign_offer_codes_in_db(query, batch_id, brandsmart_dealer_id: str, brandsmart_url: str,
+                             general_url: str, params: Optional[dict] = None,
+                             returning: Sequence[str] = ()) -> dict:
+    """
+    Assigns one new offer code per distinct invoice of `query` and writes it
+    to every matching (invoice_number, dealer_id) row, all server-side.
+    Rows of `brandsmart_dealer_id` get `brandsmart_url`/<code> as their
+    offer_code_url, all others `general_url`/<code>.
+
+    Returns {"invoices": ..., "rows": ..., "rounds": ..., "returned": [...]},
+    where "returned" holds the `returning` columns of every updated row.
+    """
+    ensure_offer_code_schema()
+    query_params = dict(params or {}, batch_id=str(batch_id))
+
+    with get_engine().begin() as conn:
+        with metrics.timer("offer_codes_sql_prepare"):
+            conn.execute(text(f"""
+                CREATE TEMP TABLE pending_offer_pairs ON COMMIT DROP AS
+                SELECT DISTINCT q.invoice_number, q.dealer_id
+                FROM ({query}) AS q
+                WHERE q.invoice_number IS NOT NULL AND q.dealer_id IS NOT NULL
+            """), query_params)
+            conn.execute(text("""
+                CREATE TEMP TABLE pending_offer_invoices ON COMMIT DROP AS
+                SELECT DISTINCT invoice_number::text AS invoice_number, NULL::text AS code
+                FROM pending_offer_pairs
+            """))
+            conn.execute(text("ANALYZE pending_offer_pairs"))
+            conn.execute(text("ANALYZE pending_offer_invoices"))
+
+        remaining = conn.execute(text("SELECT COUNT(*) FROM pending_offer_invoices")).scalar_one()
+        invoices = remaining
+        if invoices == 0:
+            log.warning("No records found that require processing.")
+            return {"invoices": 0, "rows": 0, "rounds": 0, "returned": []}
+        log.info(f"Assigning offer codes in the database for {invoices} invoices (batch {batch_id}).")
+
+        rounds = 0
+        with metrics.timer("offer_codes_sql_assign"):
+            while remaining:
+                rounds += 1
+                if rounds > MAX_ROUNDS:
+                    raise RuntimeError(f"{remaining} invoices still had no unique offer code "
+                                       f"after {MAX_ROUNDS} rounds.")
+                # A code is accepted only if the registry insert succeeded and
+                # no existing row already carries it.
+                assigned = conn.execute(text(f"""
+                    WITH claimed AS (
+                        INSERT INTO {REGISTRY_TABLE} (code, invoice_number, batch_id)
+                        SELECT {RANDOM_CODE_FUNCTION}(), invoice_number, :batch_id
+                        FROM pending_offer_invoices
+                        WHERE code IS NULL
+                        ON CONFLICT (code) DO NOTHING
+                        RETURNING code, invoice_number
+                    )
+                    UPDATE pending_offer_invoices AS p
+                    SET code = claimed.code
+                    FROM claimed
+                    WHERE p.invoice_number = claimed.invoice_number
+                      AND NOT EXISTS (
+                          SELECT 1 FROM mpos_post_sale_marketing AS m
+                          WHERE m.landing_page_offer_code = claimed.code
+                      )
+                """), {"batch_id": str(batch_id)}).rowcount
+                metrics.inc("offer_code_candidates", remaining)
+                metrics.inc("offer_code_collisions", remaining - assigned)
+                remaining -= assigned
+
+            # Registry rows for codes rejected because mpos already had them
+            # are not this batch's; leave only the codes actually issued.
+            conn.execute(text(f"""
+                DELETE FROM {REGISTRY_TABLE} AS r
+                USING pending_offer_invoices AS p
+                WHERE r.batch_id = :batch_id
+                  AND r.invoice_number = p.invoice_number
+                  AND r.code <> p.code
+            """), {"batch_id": str(batch_id)})
+
+        returning_clause = f"RETURNING {', '.join(f'main.{column}' for column in returning)}" if returning else ""
+        with metrics.timer("db_update_statement"):
+            result = conn.execute(text(f"""
+                UPDATE mpos_post_sale_marketing AS main
+                SET
+                    activity_plan_purchased_date = NULL,
+                    landing_page_offer_code = p.code,
+                    batch_id = :batch_id,
+                    offer_code_url = CASE
+                        WHEN main.dealer_id::text = :brandsmart_dealer_id THEN :brandsmart_url
+                        ELSE :general_url
+                    END || '/' || p.code,
+                    needs_python_proccess = '0',
+                    -- A new code means a new offer URL: (re)send the contact to Zoho
+                    activity_zoho_campaign_load = NULL
+                FROM pending_offer_pairs AS pair
+                JOIN pending_offer_invoices AS p ON p.invoice_number = pair.invoice_number::text
+                WHERE main.invoice_number = pair.invoice_number
+                  AND main.dealer_id = pair.dealer_id
+                {returning_clause}
+            """), {
+                "batch_id": str(batch_id),
+                "brandsmart_dealer_id": str(brandsmart_dealer_id),
+                "brandsmart_url": brandsmart_url,
+                "general_url": general_url,
+            })
+            returned = result.fetchall() if returning else []
+            rows = result.rowcount
+
+    metrics.inc("invoices_coded", invoices)
+    metrics.inc("rows_updated", rows)
+    log.info(f"Assigned {invoices} offer codes in {rounds} rounds and updated {rows} rows for batch {batch_id}.")
+    return {"invoices": invoices, "rows": rows, "rounds": rounds, "returned": returned}
@@ -0,0 +1,187 @@
+# offer_code_pool.py
+"""
+Pre-generated offer code reservation pool (OFFER_CODE_MODE=pool).
+
+A fill job keeps `mpos_offer_code_pool` stocked with codes that were
+verified unique when they were generated, so a run claims its codes with
+one UPDATE ... RETURNING instead of running the collision-check loop of
+generate_offer_code on the critical path. Claims use FOR UPDATE SKIP LOCKED,
+so concurrent workers never receive the same code and never wait on each
+other. Each claimed code is checked against mpos_post_sale_marketing once
+more at claim time; codes issued elsewhere since the fill are discarded.
+
+Usage:
+    python offer_code_pool.py status
+    python offer_code_pool.py fill [--target N]
+    python offer_code_pool.py watch [--interval SECONDS]
+"""
+import argparse
+import time
+from typing import Optional
+
+from sqlalchemy import text
+
+from conn import get_engine
+from config import OFFER_CODE_POOL_TARGET, OFFER_CODE_POOL_LOW_WATER, OFFER_CODE_POOL_FILL_BATCH
+from generate_offer_code import generate_offer_code, OfferCodeIndex
+from log import log
+from metrics import metrics
+
+POOL_TABLE = "mpos_offer_code_pool"
+
+_table_ready = False
+
+
+def ensure_pool_table():
+    """Creates the pool table on first use."""
+    global _table_ready
+    if _table_ready:
+        return
+    with get_engine().begin() as conn:
+        # Claimed codes stay in the table so a later fill cannot re-insert them
+        # before the claiming run has written them to mpos_post_sale_marketing.
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {POOL_TABLE} (
+                code       TEXT        PRIMARY KEY,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                claimed_at TIMESTAMPTZ,
+                claimed_by TEXT
+            )
+        """))
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {POOL_TABLE}_unclaimed_idx
+            ON {POOL_TABLE} (created_at) WHERE claimed_at IS NULL
+        """))
+    _table_ready = True
+
+
+def available_codes() -> int:
+    """Number of unclaimed codes in the pool."""
+    ensure_pool_table()
+    with get_engine().connect() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM {POOL_TABLE} WHERE claimed_at IS NULL")).scalar_one()
+
+
+def fill_pool(target: int = OFFER_CODE_POOL_TARGET, batch_size: int = OFFER_CODE_POOL_FILL_BATCH,
+              index: Optional[OfferCodeIndex] = None) -> int:
+    """
+    Adds verified-unique codes until the pool holds `target` unclaimed codes.
+    Returns the number of codes added.
+    """
+    ensure_pool_table()
+    added = 0
+    available = available_codes()
+    while available < target:
+        codes = generate_offer_code(min(batch_size, target - available), index=index)
+        with get_engine().begin() as conn:
+            inserted = conn.execute(text(f"""
+                INSERT INTO {POOL_TABLE} (code)
+                SELECT unnest(CAST(:codes AS TEXT[]))
+                ON CONFLICT (code) DO NOTHING
+            """), {"codes": codes}).rowcount
+        added += inserted
+        available += inserted
+        log.info(f"Offer code pool: added {inserted} codes ({available}/{target} available).")
+    return added
+
+
+def top_up_pool(low_water: int = OFFER_CODE_POOL_LOW_WATER, target: int = OFFER_CODE_POOL_TARGET) -> int:
+    """Refills the pool to `target` if it has dropped below `low_water`."""
+    available = available_codes()
+    if available >= low_water:
+        return 0
+    log.info(f"Offer code pool below its low-water mark ({available} < {low_water}); refilling to {target}.")
+    # A fresh index per refill keeps collision checks in memory and picks up
+    # the codes runs have issued since the last one.
+    return fill_pool(target, index=OfferCodeIndex.load())
+
+
+def claim_offer_codes(n: int, claimed_by=None, index: Optional[OfferCodeIndex] = None) -> list:
+    """
+    Claims n codes from the pool. Each round is one statement; codes that
+    turn out to exist in mpos_post_sale_marketing by now are deleted from the
+    pool and replaced in the next round. If the pool runs dry, the shortfall
+    is generated directly with generate_offer_code. Refilling is left to
+    the `watch` (or `fill`) command, outside the run.
+    """
+    ensure_pool_table()
+    claimed = []
+    with metrics.timer("offer_code_pool_claim"):
+        while len(claimed) < n:
+            needed = n - len(claimed)
+            with get_engine().begin() as conn:
+                rows = conn.execute(text(f"""
+                    WITH picked AS (
+                        SELECT code FROM {POOL_TABLE}
+                        WHERE claimed_at IS NULL
+                        LIMIT :needed
+                        FOR UPDATE SKIP LOCKED
+                    ),
+                    checked AS (
+                        SELECT picked.code, EXISTS (
+                            SELECT 1 FROM mpos_post_sale_marketing AS m
+                            WHERE m.landing_page_offer_code = picked.code
+                        ) AS stale
+                        FROM picked
+                    ),
+                    discarded AS (
+                        DELETE FROM {POOL_TABLE} AS pool
+                        USING checked
+                        WHERE pool.code = checked.code AND checked.stale
+                        RETURNING pool.code
+                    ),
+                    claimed AS (
+                        UPDATE {POOL_TABLE} AS pool
+                        SET claimed_at = now(), claimed_by = :claimed_by
+                        FROM checked
+                        WHERE pool.code = checked.code AND NOT checked.stale
+                        RETURNING pool.code
+                    )
+                    SELECT code, FALSE AS stale FROM claimed
+                    UNION ALL
+                    SELECT code, TRUE AS stale FROM discarded
+                """), {"needed": needed, "claimed_by": None if claimed_by is None else str(claimed_by)}).fetchall()
+
+            if not rows:
+                log.warning(f"Offer code pool is empty; generating the remaining {needed} codes directly. "
+                            f"Run `python offer_code_pool.py watch` to keep it stocked.")
+                claimed += generate_offer_code(needed, index=index)
+                break
+            stale = [code for code, is_stale in rows if is_stale]
+            if stale:
+                log.warning(f"Discarded {len(stale)} pooled codes that have been issued since the pool was filled.")
+                metrics.inc("offer_code_pool_stale", len(stale))
+            claimed += [code for code, is_stale in rows if not is_stale]
+
+    if index is not None:
+        index.add(claimed)
+    metrics.inc("offer_code_pool_claimed", len(claimed))
+    log.info(f"Claimed {len(claimed)} offer codes from the pool.")
+    return claimed
+
+
+# --- Main Entry Point ---
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the pre-generated offer code pool.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="Show how many unclaimed codes are in the pool.")
+    fill_parser = subparsers.add_parser("fill", help="Fill the pool up to the target once.")
+    fill_parser.add_argument("--target", type=int, default=OFFER_CODE_POOL_TARGET)
+    watch_parser = subparsers.add_parser("watch", help="Keep the pool above its low-water mark.")
+    watch_parser.add_argument("--interval", type=float, default=60.0, help="Seconds between checks.")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        log.info(f"Offer code pool: {available_codes()} unclaimed codes "
+                 f"(low-water {OFFER_CODE_POOL_LOW_WATER}, target {OFFER_CODE_POOL_TARGET}).")
+    elif args.command == "fill":
+        # One index for the whole fill keeps collision checks in memory.
+        added = fill_pool(args.target, index=OfferCodeIndex.load())
+        log.info(f"Offer code pool fill finished: {added} codes added.")
+    else:
+        while True:
+            top_up_pool()
+            time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
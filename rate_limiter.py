@@ -0,0 +1,330 @@
+# rate_limiter.py
+"""
+Rate limiters for the Zoho API budget (500 calls / 300s, with an 1800s
+lockout after a 429).
+
+`ZohoMARateLimiter` is an in-process token bucket shared by the threads of
+one run. `PostgresRateLimiter` keeps the bucket in a database row so every
+process and batch consuming the same Zoho account draws from one budget and
+sees a lockout triggered by any of them. `create_rate_limiter` picks the
+backend from ZOHO_RATE_LIMITER_BACKEND.
+
+With ZOHO_RATE_MODE=adaptive the backend is wrapped in an
+`AdaptiveRateLimiter`, which paces calls at a rate it learns from Zoho's
+responses instead of relying on the fixed budget and 30-minute lockout.
+"""
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from sqlalchemy import text
+
+from conn import get_engine
+from config import (
+    ZOHO_RATE_LIMITER_BACKEND, ZOHO_RATE_LIMIT_CALLS, ZOHO_RATE_LIMIT_PERIOD_SECONDS,
+    ZOHO_RATE_LIMIT_LOCK_SECONDS, ZOHO_RATE_LIMIT_KEY, ZOHO_RATE_MODE,
+    ZOHO_ADAPTIVE_DECREASE_FACTOR, ZOHO_ADAPTIVE_INCREASE_PER_SUCCESS,
+    ZOHO_ADAPTIVE_MIN_CALLS_PER_MINUTE, ZOHO_ADAPTIVE_DEFAULT_PAUSE_SECONDS
+)
+from log import log, record_log
+
+BUCKET_TABLE = "zoho_rate_limit_bucket"
+
+
+class ZohoThrottled(Exception):
+    """Raised by a submission that got a 429; the work item should be requeued."""
+
+
+def parse_retry_after(response) -> Optional[float]:
+    """
+    Seconds to wait according to the response's rate-limit headers, or None
+    if it carries none. Understands Retry-After (seconds or HTTP date) and
+    X-RateLimit-Reset (seconds or epoch timestamp).
+    """
+    if response is None:
+        return None
+    headers = response.headers
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    reset = headers.get("X-RateLimit-Reset") or headers.get("X-Rate-Limit-Reset")
+    if reset:
+        try:
+            value = float(reset)
+        except ValueError:
+            return None
+        # Large values are absolute epoch timestamps, small ones are deltas.
+        return max(0.0, value - time.time()) if value > 1e9 else value
+    return None
+
+
+class ZohoMARateLimiter:
+    # Token bucket shared by every submission worker; all state changes
+    # happen under a lock so it can be used from a thread pool.
+    def __init__(self, calls_per_duration, duration_seconds, lock_period_seconds):
+        self.calls_per_duration = calls_per_duration
+        self.duration_seconds = duration_seconds
+        self.lock_period_seconds = lock_period_seconds
+        self.tokens = calls_per_duration
+        self.last_refill_time = time.monotonic()
+        self.locked_until_time = 0
+        self.refill_rate = self.calls_per_duration / self.duration_seconds
+        self._lock = threading.Lock()
+        log.info(f"Zoho Rate Limiter: {calls_per_duration} calls/{duration_seconds}s. Refill: {self.refill_rate:.2f} tokens/sec.")
+
+    def _refill_tokens(self):
+        now = time.monotonic()
+        time_elapsed = now - self.last_refill_time
+        tokens_to_add = time_elapsed * self.refill_rate
+        self.tokens = min(self.calls_per_duration, self.tokens + tokens_to_add)
+        self.last_refill_time = now
+
+    def acquire_token(self):
+        while True:
+            # Decide under the lock, but never sleep while holding it so the
+            # other workers can keep checking the bucket.
+            with self._lock:
+                self._refill_tokens()
+                now = time.monotonic()
+                if now < self.locked_until_time:
+                    wait_time = self.locked_until_time - now
+                    locked = True
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                else:
+                    wait_time = (1 - self.tokens) / self.refill_rate
+                    locked = False
+            if locked:
+                record_log.record("rate_limit_locked", "API locked. Waiting for {latency:.2f} seconds.",
+                                  logging.WARNING, latency=wait_time)
+                time.sleep(wait_time)
+            else:
+                record_log.record("rate_limit_wait", "Rate limit hit, waiting {latency:.2f} seconds.",
+                                  latency=wait_time)
+                time.sleep(wait_time + 0.01)
+
+    def pause(self, seconds):
+        """Blocks all acquires for `seconds` and empties the bucket."""
+        with self._lock:
+            self.locked_until_time = max(self.locked_until_time, time.monotonic() + seconds)
+            self.tokens = 0
+            self.last_refill_time = time.monotonic()
+
+    def trigger_lock(self):
+        self.pause(self.lock_period_seconds)
+        log.error(f"Zoho API limit exceeded! Entering {self.lock_period_seconds}s lock.")
+
+    # Fixed mode: successes change nothing and any 429 means the full lock.
+    def on_success(self, response=None):
+        pass
+
+    def on_throttle(self, retry_after=None):
+        self.trigger_lock()
+
+
+_bucket_table_ready = False
+
+
+def ensure_bucket_table():
+    """Creates the shared token bucket table on first use."""
+    global _bucket_table_ready
+    if _bucket_table_ready:
+        return
+    with get_engine().begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {BUCKET_TABLE} (
+                name         TEXT PRIMARY KEY,
+                tokens       DOUBLE PRECISION NOT NULL,
+                last_refill  TIMESTAMPTZ      NOT NULL,
+                locked_until TIMESTAMPTZ
+            )
+        """))
+    _bucket_table_ready = True
+
+
+class PostgresRateLimiter:
+    """
+    Token bucket stored in one row of `zoho_rate_limit_bucket`. Each acquire
+    locks the row (SELECT ... FOR UPDATE), refills it from the database clock
+    and takes a token in the same short transaction, so concurrent workers
+    on any host serialise on the row and share one budget.
+    """
+
+    def __init__(self, calls_per_duration, duration_seconds, lock_period_seconds, name=ZOHO_RATE_LIMIT_KEY):
+        self.calls_per_duration = calls_per_duration
+        self.duration_seconds = duration_seconds
+        self.lock_period_seconds = lock_period_seconds
+        self.refill_rate = self.calls_per_duration / self.duration_seconds
+        self.name = name
+        self._ready = False
+        log.info(f"Shared Zoho Rate Limiter '{name}': {calls_per_duration} calls/{duration_seconds}s "
+                 f"(Postgres-backed).")
+
+    def _ensure_bucket(self):
+        if self._ready:
+            return
+        ensure_bucket_table()
+        with get_engine().begin() as conn:
+            conn.execute(text(f"""
+                INSERT INTO {BUCKET_TABLE} (name, tokens, last_refill)
+                VALUES (:name, :tokens, clock_timestamp())
+                ON CONFLICT (name) DO NOTHING
+            """), {"name": self.name, "tokens": self.calls_per_duration})
+        self._ready = True
+
+    def acquire_token(self):
+        self._ensure_bucket()
+        while True:
+            with get_engine().begin() as conn:
+                tokens, last_refill, locked_until, now = conn.execute(text(f"""
+                    SELECT tokens, last_refill, locked_until, clock_timestamp()
+                    FROM {BUCKET_TABLE} WHERE name = :name FOR UPDATE
+                """), {"name": self.name}).one()
+
+                if locked_until is not None and now < locked_until:
+                    wait_time = (locked_until - now).total_seconds()
+                    locked = True
+                else:
+                    elapsed = max(0.0, (now - last_refill).total_seconds())
+                    tokens = min(self.calls_per_duration, tokens + elapsed * self.refill_rate)
+                    acquired = tokens >= 1
+                    if acquired:
+                        tokens -= 1
+                    conn.execute(text(f"""
+                        UPDATE {BUCKET_TABLE} SET tokens = :tokens, last_refill = :now WHERE name = :name
+                    """), {"tokens": tokens, "now": now, "name": self.name})
+                    if acquired:
+                        return True
+                    wait_time = (1 - tokens) / self.refill_rate
+                    locked = False
+            if locked:
+                record_log.record("rate_limit_locked", "API locked (shared). Waiting for {latency:.2f} seconds.",
+                                  logging.WARNING, latency=wait_time)
+                time.sleep(wait_time)
+            else:
+                record_log.record("rate_limit_wait", "Rate limit hit (shared), waiting {latency:.2f} seconds.",
+                                  latency=wait_time)
+                time.sleep(wait_time + 0.01)
+
+    def pause(self, seconds):
+        """Blocks every worker sharing this bucket for `seconds` and empties it."""
+        self._ensure_bucket()
+        with get_engine().begin() as conn:
+            conn.execute(text(f"""
+                UPDATE {BUCKET_TABLE}
+                SET locked_until = GREATEST(
+                        COALESCE(locked_until, clock_timestamp()),
+                        clock_timestamp() + make_interval(secs => :lock_seconds)
+                    ),
+                    tokens = 0,
+                    last_refill = clock_timestamp()
+                WHERE name = :name
+            """), {"lock_seconds": seconds, "name": self.name})
+
+    def trigger_lock(self):
+        self.pause(self.lock_period_seconds)
+        log.error(f"Zoho API limit exceeded! Entering {self.lock_period_seconds}s lock for all workers.")
+
+    # Fixed mode: successes change nothing and any 429 means the full lock.
+    def on_success(self, response=None):
+        pass
+
+    def on_throttle(self, retry_after=None):
+        self.trigger_lock()
+
+
+class AdaptiveRateLimiter:
+    """
+    AIMD pacing on top of a bucket limiter. Calls are spaced at the current
+    rate, which starts at the bucket's refill rate. Every accepted call adds
+    `increase_per_success` calls/sec up to that ceiling. A 429 multiplies
+    the rate by `decrease_factor` and pauses the bucket for the Retry-After
+    the response asked for (or `default_pause_seconds`), not the full
+    lockout. Only the first 429 of a congestion event cuts the rate: the
+    other in-flight calls that come back throttled before the pause ends
+    just extend it. Over a long run the rate settles just under what Zoho
+    accepts.
+    """
+
+    def __init__(self, base, decrease_factor=ZOHO_ADAPTIVE_DECREASE_FACTOR,
+                 increase_per_success=ZOHO_ADAPTIVE_INCREASE_PER_SUCCESS,
+                 min_calls_per_minute=ZOHO_ADAPTIVE_MIN_CALLS_PER_MINUTE,
+                 default_pause_seconds=ZOHO_ADAPTIVE_DEFAULT_PAUSE_SECONDS):
+        self.base = base
+        self.max_rate = base.refill_rate
+        self.min_rate = min_calls_per_minute / 60
+        self.rate = self.max_rate
+        self.decrease_factor = decrease_factor
+        self.increase_per_success = increase_per_success
+        self.default_pause_seconds = default_pause_seconds
+        self.next_slot = time.monotonic()
+        # End of the pause of the last decrease; 429s before it are the same event
+        self.decreased_until = 0.0
+        self._lock = threading.Lock()
+        log.info(f"Adaptive Zoho rate control: {self.min_rate * 60:.1f}-{self.max_rate * 60:.1f} calls/min, "
+                 f"x{decrease_factor} on 429, +{increase_per_success * 60:.2f} calls/min per success.")
+
+    @property
+    def refill_rate(self):
+        return self.rate
+
+    def acquire_token(self):
+        # Reserve the next send slot under the lock, sleep outside it.
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + 1 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+        return self.base.acquire_token()
+
+    def on_success(self, response=None):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_per_success)
+        # Zoho announcing an exhausted window is as good as a 429, minus the failed call.
+        if response is not None and response.headers.get("X-RateLimit-Remaining") == "0":
+            retry_after = parse_retry_after(response)
+            if retry_after:
+                self.base.pause(retry_after)
+
+    def on_throttle(self, retry_after=None):
+        pause_seconds = retry_after if retry_after is not None else self.default_pause_seconds
+        with self._lock:
+            now = time.monotonic()
+            new_event = now >= self.decreased_until
+            if new_event:
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self.decreased_until = max(self.decreased_until, now + pause_seconds)
+            rate = self.rate
+        self.base.pause(pause_seconds)
+        if new_event:
+            log.warning(f"Zoho throttled us; pausing {pause_seconds:.0f}s and slowing to {rate * 60:.1f} calls/min.")
+
+    def trigger_lock(self):
+        self.on_throttle()
+
+
+def create_rate_limiter():
+    """
+    Builds the limiter configured by ZOHO_RATE_LIMITER_BACKEND ('local' or
+    'postgres'), wrapped for adaptive pacing when ZOHO_RATE_MODE is 'adaptive'.
+    """
+    args = (ZOHO_RATE_LIMIT_CALLS, ZOHO_RATE_LIMIT_PERIOD_SECONDS, ZOHO_RATE_LIMIT_LOCK_SECONDS)
+    if ZOHO_RATE_LIMITER_BACKEND == "postgres":
+        limiter = PostgresRateLimiter(*args)
+    else:
+        if ZOHO_RATE_LIMITER_BACKEND != "local":
+            log.warning(f"Unknown ZOHO_RATE_LIMITER_BACKEND '{ZOHO_RATE_LIMITER_BACKEND}'; using 'local'.")
+        limiter = ZohoMARateLimiter(*args)
+    if ZOHO_RATE_MODE == "adaptive":
+        return AdaptiveRateLimiter(limiter)
+    return limiter
@@ -0,0 +1,226 @@
+# subscriber_cache.py
+"""
+Local cache of contacts already subscribed in Zoho (SUBSCRIBER_CACHE=1).
+
+For every email that Zoho accepted, the cache keeps a hash of the fields
+that matter to the campaign: offer_code_url, manufacturer, department and
+campaign date. When import_contacts meets the same email with an unchanged
+payload, the call is skipped and the contact's load date is recorded
+directly, saving a rate-limit token. A changed payload is always sent.
+
+This is a recovery path, not a saving for returning subscribers: the
+offer_code_url carries each invoice's unique code, so a customer buying
+again always has a new payload, and that new URL has to reach Zoho. Hits
+come from contacts Zoho accepted whose load date was never recorded
+(a crash or failed write between the two), which a rerun would otherwise
+send again. Expect zoho_calls_saved to stay near zero in normal runs.
+
+Entries expire after SUBSCRIBER_CACHE_TTL_DAYS and the least recently used
+ones are evicted beyond SUBSCRIBER_CACHE_MAX_ENTRIES.
+
+Usage:
+    python subscriber_cache.py stats
+    python subscriber_cache.py rebuild [--days N]   # reseed from loaded rows
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import text
+
+from conn import get_engine
+from config import SUBSCRIBER_CACHE_PATH, SUBSCRIBER_CACHE_TTL_DAYS, SUBSCRIBER_CACHE_MAX_ENTRIES
+from log import log
+
+# SQLite limits the number of bound parameters per statement.
+LOOKUP_CHUNK = 500
+
+
+def normalize_email(email) -> str:
+    return str(email).strip().lower()
+
+
+def payload_hash(offer_code_url, campaign_start_date, manufacturer, department) -> str:
+    """Hash of the campaign fields Zoho holds for a subscriber."""
+    campaign_date = campaign_start_date.strftime("%m/%d/%Y") if campaign_start_date else ''
+    fields = [str(offer_code_url), str(manufacturer or ''), str(department or ''), campaign_date]
+    return hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()
+
+
+def row_hash(row) -> str:
+    """payload_hash of a contact row in add_contact.CONTACT_COLUMNS order."""
+    return payload_hash(row[3], row[5], row[6], row[7])
+
+
+class SubscriberCache:
+    """SQLite-backed email -> payload hash map with TTL and LRU eviction."""
+
+    def __init__(self, path: str = SUBSCRIBER_CACHE_PATH, ttl_days: float = SUBSCRIBER_CACHE_TTL_DAYS,
+                 max_entries: int = SUBSCRIBER_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_days * 86400
+        self.max_entries = max_entries
+        # One connection shared by the importing threads, serialized by the lock.
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS subscribers (
+                    email        TEXT PRIMARY KEY,
+                    payload_hash TEXT NOT NULL,
+                    sent_at      REAL NOT NULL,
+                    used_at      REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS subscribers_used_at ON subscribers (used_at)")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM subscribers").fetchone()[0]
+
+    def partition(self, records) -> tuple:
+        """
+        Splits contact rows into (to_send, unchanged). A row is unchanged when
+        its email was sent within the TTL with the same payload hash.
+        """
+        emails = list({normalize_email(row[0]) for row in records})
+        cutoff = time.time() - self.ttl_seconds
+        known = {}
+        with self._lock:
+            for start in range(0, len(emails), LOOKUP_CHUNK):
+                chunk = emails[start:start + LOOKUP_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                known.update(self._db.execute(
+                    f"SELECT email, payload_hash FROM subscribers WHERE email IN ({placeholders}) AND sent_at >= ?",
+                    chunk + [cutoff]
+                ).fetchall())
+
+        to_send, unchanged, hits = [], [], set()
+        for row in records:
+            email, digest = normalize_email(row[0]), row_hash(row)
+            if known.get(email) == digest:
+                unchanged.append(row)
+                hits.add(email)
+            else:
+                to_send.append(row)
+        if hits:
+            hit_list = list(hits)
+            now = time.time()
+            with self._lock, self._db:
+                for start in range(0, len(hit_list), LOOKUP_CHUNK):
+                    chunk = hit_list[start:start + LOOKUP_CHUNK]
+                    self._db.execute(
+                        f"UPDATE subscribers SET used_at = ? WHERE email IN ({', '.join('?' * len(chunk))})",
+                        [now] + chunk
+                    )
+        return to_send, unchanged
+
+    def remember(self, rows, sent_at: Optional[float] = None):
+        """Stores the payload hash of contacts Zoho accepted, then evicts."""
+        if not rows:
+            return
+        now = time.time()
+        self._store([(normalize_email(row[0]), row_hash(row), sent_at or now, now) for row in rows])
+        self.evict()
+
+    def _store(self, entries):
+        """Upserts (email, payload_hash, sent_at, used_at) tuples."""
+        with self._lock, self._db:
+            self._db.executemany("""
+                INSERT INTO subscribers (email, payload_hash, sent_at, used_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (email) DO UPDATE SET
+                    payload_hash = excluded.payload_hash, sent_at = excluded.sent_at, used_at = excluded.used_at
+            """, entries)
+
+    def evict(self) -> int:
+        """Drops expired entries, then the least recently used beyond max_entries."""
+        with self._lock, self._db:
+            removed = self._db.execute(
+                "DELETE FROM subscribers WHERE sent_at < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            excess = self._db.execute("SELECT COUNT(*) FROM subscribers").fetchone()[0] - self.max_entries
+            if excess > 0:
+                removed += self._db.execute("""
+                    DELETE FROM subscribers WHERE email IN (
+                        SELECT email FROM subscribers ORDER BY used_at LIMIT ?
+                    )
+                """, (excess,)).rowcount
+        return removed
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM subscribers")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> SubscriberCache:
+    """Returns the process-wide cache, opening it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SubscriberCache()
+    return _cache
+
+
+def rebuild_from_db(days: float = SUBSCRIBER_CACHE_TTL_DAYS, fetch_size: int = 50000) -> int:
+    """
+    Replaces the cache with the latest loaded payload of every email whose
+    contact was loaded into Zoho in the last `days` days.
+    """
+    cache = get_cache()
+    cache.clear()
+    query = text("""
+        SELECT DISTINCT ON (lower(trim(customer_email)))
+               customer_email, offer_code_url, campaign_start_date, manufacturer, department,
+               activity_zoho_campaign_load
+        FROM   mpos_post_sale_marketing
+        WHERE  activity_zoho_campaign_load >= current_date - CAST(:days AS INTEGER)
+          AND  customer_email IS NOT NULL AND customer_email <> ''
+        ORDER BY lower(trim(customer_email)), activity_zoho_campaign_load DESC, id DESC
+    """)
+    total = 0
+    with get_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=fetch_size).execute(
+            query, {"days": int(days)}
+        )
+        for rows in result.partitions(fetch_size):
+            now = time.time()
+            cache._store([
+                (normalize_email(email), payload_hash(url, campaign_start_date, manufacturer, department),
+                 time.mktime(loaded_on.timetuple()), now)
+                for email, url, campaign_start_date, manufacturer, department, loaded_on in rows
+            ])
+            total += len(rows)
+    cache.evict()
+    log.info(f"Rebuilt subscriber cache from the database: {total} subscribers.")
+    return total
+
+
+# --- Main Entry Point ---
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the local known-subscriber cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show how many subscribers are cached.")
+    rebuild_parser = subparsers.add_parser("rebuild", help="Reseed the cache from loaded contacts.")
+    rebuild_parser.add_argument("--days", type=float, default=SUBSCRIBER_CACHE_TTL_DAYS,
+                                help="Only contacts loaded within this many days.")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        cache = get_cache()
+        removed = cache.evict()
+        log.info(f"Subscriber cache {cache.path}: {len(cache)} subscribers ({removed} expired entries evicted).")
+    else:
+        rebuild_from_db(args.days)
+
+if __name__ == '__main__':
+    main()
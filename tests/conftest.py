@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The modules live at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# add_contact exits at import without Zoho credentials; nothing here reaches Zoho.
+for name in ("ZOHO_CLIENT_ID", "ZOHO_CLIENT_SECRET", "ZOHO_REFRESH_TOKEN"):
+    os.environ.setdefault(name, "test")
@@ -0,0 +1,149 @@
+import json
+from datetime import date, timedelta
+
+import pytest
+
+requests = pytest.importorskip("requests")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+
+import add_contact  # noqa: E402
+from dead_letter import ERROR_REJECTED, ERROR_SERVER  # noqa: E402
+from rate_limiter import ZohoThrottled  # noqa: E402
+
+ROW = ("jane@example.com", "Jane", "Doe", "http://offers.example.com/AB12CD", "AB12CD",
+       date(2024, 9, 1), "Acme", "Appliances", 30)
+
+
+class RecordingDeadLetters:
+    def __init__(self):
+        self.added = []
+
+    def add(self, row, error_class, reason):
+        self.added.append((row[4], error_class, str(reason)))
+
+
+class QuietLimiter:
+    def __init__(self):
+        self.throttled = 0
+
+    def on_success(self, response=None):
+        pass
+
+    def on_throttle(self, retry_after=None):
+        self.throttled += 1
+
+
+def zoho_response(status_code: int, body: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode("utf-8")
+    response.url = add_contact.ZOHO_API_BASE_URL
+    response.elapsed = timedelta(milliseconds=40)
+    return response
+
+
+@pytest.fixture
+def zoho(monkeypatch):
+    """Answers every listsubscribe call with the response set on the returned dict."""
+    answer = {}
+    limiter = QuietLimiter()
+    monkeypatch.setattr(add_contact.zoho_token_manager, "get_token", lambda: "token")
+    monkeypatch.setattr(add_contact, "zoho_ma_rate_limiter", limiter)
+    monkeypatch.setattr(add_contact, "post_to_zoho", lambda url, **kwargs: answer["response"])
+    answer["limiter"] = limiter
+    return answer
+
+
+def test_accepted_contact_returns_its_offer_code(zoho):
+    zoho["response"] = zoho_response(200, {"status": "success", "message": "ok"})
+    dead_letters = RecordingDeadLetters()
+
+    assert add_contact.submit_contact(ROW, dead_letters) == "AB12CD"
+    assert dead_letters.added == []
+
+
+def test_rejected_contact_is_dead_lettered_with_zohos_message(zoho):
+    zoho["response"] = zoho_response(200, {"status": "error", "message": "Invalid email address"})
+    dead_letters = RecordingDeadLetters()
+
+    assert add_contact.submit_contact(ROW, dead_letters) is None
+    assert dead_letters.added == [("AB12CD", ERROR_REJECTED, "Invalid email address")]
+
+
+def test_server_error_is_dead_lettered_as_server(zoho):
+    zoho["response"] = zoho_response(503, {"status": "error", "message": "unavailable"})
+    dead_letters = RecordingDeadLetters()
+
+    assert add_contact.submit_contact(ROW, dead_letters) is None
+    assert [(code, error_class) for code, error_class, _ in dead_letters.added] == [("AB12CD", ERROR_SERVER)]
+
+
+def test_throttled_contact_is_raised_for_requeue_not_dead_lettered(zoho):
+    zoho["response"] = zoho_response(429, {"status": "error", "message": "API rate limit exceeded"})
+    dead_letters = RecordingDeadLetters()
+
+    with pytest.raises(ZohoThrottled):
+        add_contact.submit_contact(ROW, dead_letters)
+    assert dead_letters.added == []
+    assert zoho["limiter"].throttled == 1
+
+
+class OrderedCache:
+    """Subscriber cache that sends everything and records when entries are stored."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def partition(self, rows):
+        return list(rows), []
+
+    def remember(self, rows):
+        self.events.extend(("cached", row[4]) for row in rows)
+
+
+class OrderedRecorder(add_contact.LoadDateRecorder):
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def add(self, offer_codes):
+        self.accepted += len(offer_codes)
+        self.events.extend(("load_date", code) for code in offer_codes)
+
+
+def test_accepted_contact_is_cached_before_its_load_date_is_queued(zoho, monkeypatch):
+    zoho["response"] = zoho_response(200, {"status": "success", "message": "ok"})
+    events = []
+    monkeypatch.setattr(add_contact, "SUBSCRIBER_CACHE", True)
+    monkeypatch.setattr(add_contact.subscriber_cache, "get_cache", lambda: OrderedCache(events))
+    second = ROW[:4] + ("EF34GH",) + ROW[5:]
+
+    accepted = add_contact.import_contacts("1", concurrency=1, records=[ROW, second],
+                                           recorder=OrderedRecorder(events))
+
+    assert accepted == 2
+    assert events == [("cached", "AB12CD"), ("load_date", "AB12CD"), ("cached", "EF34GH"), ("load_date", "EF34GH")]
+
+
+def returned(row_id, loaded_at, email, offer_code):
+    """A row as an mpos UPDATE RETURNs it (RETURNING_COLUMNS order)."""
+    return (row_id, loaded_at, email) + ROW[1:4] + (offer_code,) + ROW[5:]
+
+
+def test_contacts_from_update_keeps_one_unloaded_contact_per_offer_code():
+    rows = [
+        returned(5, None, "b@example.com", "BBBBBB"),
+        returned(3, None, "b2@example.com", "BBBBBB"),  # same invoice, lower id wins
+        returned(4, None, "a@example.com", "AAAAAA"),
+        returned(6, date(2024, 8, 1), "c@example.com", "CCCCCC"),  # already loaded
+        returned(7, None, "", "DDDDDD"),  # no email
+        returned(8, None, "e@example.com", None),  # no offer code
+    ]
+
+    contacts = add_contact.contacts_from_update(rows)
+
+    assert [(contact[0], contact[4]) for contact in contacts] == [
+        ("a@example.com", "AAAAAA"), ("b2@example.com", "BBBBBB")
+    ]
+    assert all(len(contact) == len(add_contact.CONTACT_COLUMNS) for contact in contacts)
@@ -0,0 +1,49 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+
+from generate_offer_code import (  # noqa: E402
+    CODE_ALPHABET, CODE_BASE, CODE_LENGTH, decode_code, decode_codes, encode_code, generate_encoded_codes
+)
+
+
+@pytest.mark.parametrize("code", ["AAAAAA", "999999", "AB2CD3", "Z9Z9Z9"])
+def test_encode_code_round_trips(code):
+    value = encode_code(code)
+    assert value is not None and value < 2 ** 32
+    assert decode_code(value) == code
+    assert decode_codes(np.array([value], dtype=np.uint32)) == [code]
+
+
+def test_encoding_is_base_31_most_significant_first():
+    assert encode_code(CODE_ALPHABET[0] * CODE_LENGTH) == 0
+    assert encode_code(CODE_ALPHABET[0] * (CODE_LENGTH - 1) + CODE_ALPHABET[1]) == 1
+    assert encode_code(CODE_ALPHABET[1] + CODE_ALPHABET[0] * (CODE_LENGTH - 1)) == CODE_BASE ** (CODE_LENGTH - 1)
+
+
+@pytest.mark.parametrize("code", ["ABCDE", "ABCDEFG", "ABCDE1", "abcdef", "ABCDE0", None, 123456])
+def test_legacy_codes_are_not_encoded(code):
+    assert encode_code(code) is None
+
+
+def test_decode_codes_matches_decode_code():
+    values = generate_encoded_codes(1000, rng=np.random.default_rng(7))
+    assert decode_codes(values) == [decode_code(value) for value in values]
+    assert decode_codes(np.empty(0, dtype=np.uint32)) == []
+
+
+def test_offer_code_index_filters_loaded_added_and_legacy_codes():
+    from generate_offer_code import OfferCodeIndex
+
+    index = OfferCodeIndex()
+    index._sorted = np.array(sorted(encode_code(code) for code in ("AAAAA2", "ZZZZZ9")), dtype=np.uint32)
+    index.add(["BBBBB3", "LEGACY-1"])
+    index.add(["CCCCC4"])
+
+    assert index.filter_new({"AAAAA2", "BBBBB3", "CCCCC4", "LEGACY-1", "DDDDD5", "LEGACY-2"}) == {"DDDDD5", "LEGACY-2"}
+    candidates = np.array([encode_code(code) for code in ("ZZZZZ9", "CCCCC4", "DDDDD5")], dtype=np.uint32)
+    assert decode_codes(index.filter_new_encoded(candidates)) == ["DDDDD5"]
+    assert decode_codes(index.encoded_values()) == ["AAAAA2", "BBBBB3", "CCCCC4", "ZZZZZ9"]
+    assert len(index) == 5
@@ -0,0 +1,65 @@
+import contextvars
+import json
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from log import RecordLog  # noqa: E402
+
+
+def test_record_log_samples_below_its_level_and_summarises(caplog):
+    records = RecordLog(logging.getLogger("test.records"), sample_level=logging.WARNING,
+                        sample_every=3, summary_seconds=3600)
+    with caplog.at_level(logging.INFO, logger="test.records"):
+        for number in range(7):
+            records.record("zoho_submit", "added {offer_code}", offer_code=f"C{number}", latency=0.5)
+        records.flush()
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages[:3] == ["added C0", "added C3", "added C6"]
+    assert caplog.records[0].offer_code == "C0"
+    assert caplog.records[-1].count == 7
+    assert caplog.records[-1].latency == 0.5
+
+
+def test_record_log_writes_every_event_at_its_level_with_any_field_name(caplog):
+    records = RecordLog(logging.getLogger("test.records"), sample_level=logging.WARNING,
+                        sample_every=0, summary_seconds=3600)
+    with caplog.at_level(logging.INFO, logger="test.records"):
+        records.record("zoho_failed", "rejected: {message}", logging.ERROR, message="Invalid email")
+        records.record("zoho_failed", "rejected: {message}", logging.ERROR, message="Duplicate")
+
+    assert [record.getMessage() for record in caplog.records] == ["rejected: Invalid email", "rejected: Duplicate"]
+
+
+def test_batch_context_tags_records_including_copied_thread_contexts():
+    from log import BatchIdFilter, batch_context
+
+    def make_record():
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "message", None, None)
+        BatchIdFilter().filter(record)
+        return record
+
+    with batch_context("2410161230001"):
+        assert make_record().batch_id == "2410161230001"
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            in_thread = executor.submit(contextvars.copy_context().run, make_record).result()
+        assert in_thread.batch_id == "2410161230001"
+    assert not hasattr(make_record(), "batch_id")
+
+
+def test_json_output_keeps_the_traceback_out_of_the_message():
+    from log import JsonFormatter, StructuredQueueHandler
+
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("test", logging.ERROR, __file__, 1, "failed %s", ("batch",), sys.exc_info())
+    entry = json.loads(JsonFormatter().format(StructuredQueueHandler(None).prepare(record)))
+
+    assert entry["message"] == "failed batch"
+    assert "ValueError: boom" in entry["exception"]
@@ -0,0 +1,150 @@
+from datetime import date
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+sqlalchemy = pytest.importorskip("sqlalchemy")
+pytest.importorskip("requests")
+pytest.importorskip("dotenv")
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+import main  # noqa: E402
+
+MPOS_TABLE = """
+    CREATE TABLE mpos_post_sale_marketing (
+        id                           INTEGER PRIMARY KEY,
+        invoice_number               TEXT,
+        dealer_id                    TEXT,
+        inbound_batch_id             TEXT,
+        needs_python_proccess        TEXT,
+        activity_plan_purchased_date DATE,
+        landing_page_offer_code      TEXT,
+        offer_code_url               TEXT,
+        batch_id                     TEXT,
+        activity_zoho_campaign_load  DATE,
+        customer_email               TEXT,
+        customer_first_name          TEXT,
+        customer_last_name           TEXT,
+        campaign_start_date          DATE,
+        manufacturer                 TEXT,
+        department                   TEXT,
+        campaign_duration            INTEGER
+    )
+"""
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """An in-memory sqlite mpos_post_sale_marketing behind main.get_engine."""
+    engine = sqlalchemy.create_engine("sqlite://", poolclass=StaticPool)
+
+    @sqlalchemy.event.listens_for(engine, "before_cursor_execute", retval=True)
+    def unqualify_returning(conn, cursor, statement, parameters, context, executemany):
+        # sqlite's RETURNING only takes the target table's bare column names
+        head, returning, columns = statement.partition("RETURNING ")
+        return head + returning + columns.replace("main.", ""), parameters
+
+    with engine.begin() as conn:
+        conn.execute(text(MPOS_TABLE))
+    monkeypatch.setattr(main, "get_engine", lambda: engine)
+    return engine
+
+
+def insert_rows(engine, rows):
+    columns = sorted({column for row in rows for column in row})
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO mpos_post_sale_marketing ({', '.join(columns)}) "
+                          f"VALUES ({', '.join(':' + column for column in columns)})"),
+                     [{column: row.get(column) for column in columns} for row in rows])
+
+
+def load_staging_table_sqlite(conn, upload_df, temp_table_name):
+    """load_staging_table without the Postgres-only TEMP ... ON COMMIT DROP and COPY."""
+    upload_df.astype(object).where(upload_df.notna(), None).to_sql(temp_table_name, conn, index=False,
+                                                                   if_exists="replace")
+
+
+def test_update_data_resends_a_reprocessed_contact(engine, monkeypatch):
+    # Loaded into Zoho with its first code; --include-processed gives it a new one
+    insert_rows(engine, [{
+        "id": 1, "invoice_number": "INV1", "dealer_id": "7", "inbound_batch_id": "21",
+        "needs_python_proccess": "0", "landing_page_offer_code": "OLD111",
+        "offer_code_url": "http://default-general-url.com/OLD111", "batch_id": "100",
+        "activity_zoho_campaign_load": date(2024, 8, 1), "customer_email": "jane@example.com",
+    }])
+    monkeypatch.setattr(main, "load_staging_table", load_staging_table_sqlite)
+    query, params = main.build_pending_query("21", include_processed=True)
+    with engine.connect() as conn:
+        df = main.read_pending_frame(text(query), conn, params)
+    df["offer_code"] = ["NEW222"]
+
+    records = main.update_data(df, batch_id=200)
+
+    assert [(row[0], row[3], row[4]) for row in records] == [
+        ("jane@example.com", "http://default-general-url.com/NEW222", "NEW222")
+    ]
+    with engine.connect() as conn:
+        loaded_at = conn.execute(text("SELECT activity_zoho_campaign_load FROM mpos_post_sale_marketing")).scalar()
+    assert loaded_at is None
+
+
+PENDING = "SELECT id, invoice_number, dealer_id FROM mpos_post_sale_marketing"
+
+
+def chunk_invoices(engine, invoices, chunk_size):
+    """Inserts one row per entry of `invoices` and returns iter_invoice_chunks' chunks as invoice lists."""
+    if invoices:
+        insert_rows(engine, [{"id": i, "invoice_number": invoice, "dealer_id": "7"}
+                             for i, invoice in enumerate(invoices, start=1)])
+    return [chunk["invoice_number"].tolist() for chunk in main.iter_invoice_chunks(PENDING, chunk_size)]
+
+
+def test_invoice_split_by_a_page_boundary_is_read_whole_from_the_next_page(engine):
+    chunks = chunk_invoices(engine, ["A", "A", "B", "B", "B", "C"], chunk_size=4)
+    assert chunks == [["A", "A"], ["B", "B", "B"], ["C"]]
+
+
+def test_invoice_filling_a_whole_page_is_yielded_in_full(engine):
+    chunks = chunk_invoices(engine, ["A"] * 5 + ["B"], chunk_size=3)
+    assert chunks == [["A"] * 5, ["B"]]
+
+
+def test_short_last_page_ends_the_stream(engine):
+    assert chunk_invoices(engine, ["A", "B", "B"], chunk_size=2) == [["A"], ["B", "B"]]
+
+
+def test_exactly_full_last_page_is_followed_by_an_empty_one(engine):
+    assert chunk_invoices(engine, ["A", "B"], chunk_size=2) == [["A"], ["B"]]
+
+
+def test_null_invoices_are_skipped_without_swallowing_rows(engine):
+    chunks = chunk_invoices(engine, ["A", None, "B", None, "B", "C", None], chunk_size=2)
+    assert chunks == [["A"], ["B", "B"], ["C"]]
+
+
+def test_no_pending_rows_yields_nothing(engine):
+    assert chunk_invoices(engine, [], chunk_size=2) == []
+
+
+def test_chunked_run_codes_writes_and_imports_every_chunk(engine, monkeypatch):
+    insert_rows(engine, [{"id": i, "invoice_number": invoice, "dealer_id": "7", "customer_email": f"c{i}@example.com"}
+                         for i, invoice in enumerate(["A", "A", "B", "C", "C"], start=1)])
+    codes = iter(["AAAAA2", "BBBBB3", "CCCCC4"])
+    stages, imported = [], []
+    monkeypatch.setattr(main, "load_staging_table", load_staging_table_sqlite)
+    monkeypatch.setattr(main, "issue_offer_codes",
+                        lambda n, index=None, batch_id=None: [next(codes) for _ in range(n)])
+    monkeypatch.setattr(main, "record_stage", lambda batch_id, stage, status=None, detail=None: stages.append(
+        (stage, status, detail)))
+    monkeypatch.setattr(main, "import_contacts", lambda batch_id, records: imported.append(records) or len(records))
+
+    main.process_mpos_chunks(PENDING, 3, batch_id=300)
+
+    assert [[contact[4] for contact in records] for records in imported] == [["AAAAA2"], ["BBBBB3"], ["CCCCC4"]]
+    assert stages[-3:] == [
+        (main.STAGE_OFFER_CODES, main.STATUS_DONE, {"chunks": 3, "rows": 5}),
+        (main.STAGE_DB_UPDATED, main.STATUS_DONE, {"chunks": 3, "rows": 5}),
+        (main.STAGE_ZOHO_LOADED, main.STATUS_DONE, {"loaded": 3}),
+    ]
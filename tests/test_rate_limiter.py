@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+requests = pytest.importorskip("requests")
+
+import rate_limiter  # noqa: E402
+
+
+class FakeBucket:
+    refill_rate = 2.0
+
+    def __init__(self):
+        self.pauses = []
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_one_congestion_event_cuts_the_rate_once(clock):
+    bucket = FakeBucket()
+    limiter = rate_limiter.AdaptiveRateLimiter(bucket, decrease_factor=0.5, min_calls_per_minute=1)
+
+    # Four in-flight calls come back throttled by the same event
+    for _ in range(4):
+        limiter.on_throttle(retry_after=30)
+    assert limiter.rate == 1.0
+    assert bucket.pauses == [30, 30, 30, 30]
+
+    # A 429 after the pause is a new event
+    clock[0] += 31
+    limiter.on_throttle(retry_after=30)
+    assert limiter.rate == 0.5
+
+
+
+def response_with_headers(headers):
+    response = requests.Response()
+    response.headers.update(headers)
+    return response
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"Retry-After": "12"}, 12.0),
+    ({"Retry-After": "-3"}, 0.0),
+    ({"X-RateLimit-Reset": "30"}, 30.0),
+    ({"X-RateLimit-Reset": "soon"}, None),
+    ({}, None),
+])
+def test_parse_retry_after(headers, expected):
+    assert rate_limiter.parse_retry_after(response_with_headers(headers)) == expected
+
+
+def test_parse_retry_after_reads_dates_and_epoch_timestamps(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: 1445412450.0)  # 2015-10-21 07:27:30 GMT
+    date_header = response_with_headers({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+    assert rate_limiter.parse_retry_after(date_header) == 30.0
+    assert rate_limiter.parse_retry_after(response_with_headers({"X-RateLimit-Reset": "1445412490"})) == 40.0
+
+
+def test_parse_retry_after_without_a_response():
+    assert rate_limiter.parse_retry_after(None) is None
@@ -0,0 +1,176 @@
+# zoho_stub.py
+"""
+Local stand-in for the Zoho endpoints used by this project, so the Zoho
+stage can be exercised offline.
+
+Usage:
+    python zoho_stub.py --port 8765 [--reject-rate 0.05] [--latency-ms 80]
+                        [--error-rate 0.01] [--throttle-rate 0.002 --retry-after 30]
+
+Then point the pipeline at it:
+    ZOHO_CAMPAIGNS_URL=http://127.0.0.1:8765
+    ZOHO_ACCOUNTS_URL=http://127.0.0.1:8765
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from log import log
+
+LISTSUBSCRIBE_PATH = "/api/v1.1/json/listsubscribe"
+TOKEN_PATH = "/oauth/v2/token"
+
+
+class StubState:
+    """
+    Behaviour settings and request counters shared by all handler threads.
+
+    reject_rate   fraction of contacts answered with a Zoho-level error
+    latency_ms    mean added latency per request (exponentially distributed)
+    error_rate    fraction of subscribe requests answered with HTTP 500
+    throttle_rate fraction of subscribe requests answered with HTTP 429
+    retry_after   Retry-After seconds sent with each 429 (0 sends none)
+    """
+
+    def __init__(self, reject_rate: float = 0.0, latency_ms: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: int = 0):
+        self.reject_rate = reject_rate
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.counters = {"token": 0, "listsubscribe": 0, "contacts": 0, "errors": 0, "throttled": 0}
+        self._lock = threading.Lock()
+
+    def delay(self):
+        if self.latency_ms > 0:
+            time.sleep(random.expovariate(1000 / self.latency_ms))
+
+    def failure(self):
+        """Returns 429, 500 or None for the next subscribe request."""
+        draw = random.random()
+        if draw < self.throttle_rate:
+            self.count("throttled")
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            self.count("errors")
+            return 500
+        return None
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def accept_contact(self) -> bool:
+        return random.random() >= self.reject_rate
+
+
+class ZohoStubHandler(BaseHTTPRequestHandler):
+    state: StubState = StubState()
+
+    def log_message(self, format, *args):
+        # Keep the default per-request stderr lines out of benchmark output.
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_form(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+        return {key: values[0] for key, values in parse_qs(body).items()}
+
+    def _contact_result(self, lead: dict) -> dict:
+        email = lead.get("Lead Email", "")
+        if email and self.state.accept_contact():
+            return {"email": email, "status": "success"}
+        return {"email": email, "status": "error", "message": "Contact rejected by stub"}
+
+    def _send_failure(self, status: int) -> None:
+        if status == 429:
+            headers = {"Retry-After": str(self.state.retry_after)} if self.state.retry_after else {}
+            self._send_json(429, {"status": "error", "code": "2501", "message": "API rate limit exceeded"}, headers)
+        else:
+            self._send_json(status, {"status": "error", "message": "Internal stub error"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        self.state.delay()
+        if path == LISTSUBSCRIBE_PATH:
+            failure = self.state.failure()
+            if failure:
+                self._read_form()
+                self._send_failure(failure)
+                return
+
+        if path == TOKEN_PATH:
+            self.state.count("token")
+            self._send_json(200, {
+                "access_token": f"stub-token-{random.getrandbits(32):08x}",
+                "expires_in": 3600,
+                "token_type": "Bearer",
+            })
+            return
+
+        if path == LISTSUBSCRIBE_PATH:
+            self.state.count("listsubscribe")
+            self.state.count("contacts")
+            lead = json.loads(self._read_form().get("leadinfo") or "{}")
+            result = self._contact_result(lead)
+            if result["status"] == "success":
+                self._send_json(200, {"status": "success", "message": "A confirmation email is sent to the user."})
+            else:
+                self._send_json(200, {"status": "error", "message": result["message"]})
+            return
+
+        self._send_json(404, {"status": "error", "message": f"Unknown path {path}"})
+
+
+def make_stub_server(host: str, port: int, state: StubState) -> ThreadingHTTPServer:
+    """Builds a stub server whose handlers share the given state."""
+    handler = type("BoundZohoStubHandler", (ZohoStubHandler,), {"state": state})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_stub(host: str = "127.0.0.1", port: int = 8765, state: StubState = None) -> ThreadingHTTPServer:
+    """Starts the stub on a daemon thread and returns the running server."""
+    server = make_stub_server(host, port, state or StubState())
+    threading.Thread(target=server.serve_forever, name="zoho-stub", daemon=True).start()
+    log.info(f"Zoho stub listening on http://{host}:{server.server_address[1]}")
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local Zoho API stub.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reject-rate", type=float, default=0.0,
+                        help="Fraction of contacts the stub reports as failed.")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean added latency per request.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of subscribe calls answered with 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of subscribe calls answered with 429.")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After seconds sent with each 429.")
+    args = parser.parse_args()
+
+    stub_state = StubState(reject_rate=args.reject_rate, latency_ms=args.latency_ms, error_rate=args.error_rate,
+                           throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    server = make_stub_server(args.host, args.port, stub_state)
+    log.info(f"Zoho stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        log.info(f"Zoho stub stopped. Requests served: {stub_state.counters}")